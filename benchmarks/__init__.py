@@ -0,0 +1,22 @@
+"""
+Benchmarks for the hot paths of the worker, run from the project root e.g.
+
+    python -m benchmarks.format_request
+"""
+import os
+import timeit
+
+
+TEST_DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'quickbooks', 'tests', 'qbxml_files'
+)
+
+
+def read_fixture(file_name):
+    with open(os.path.join(TEST_DATA_DIR, file_name)) as fin:
+        return fin.read()
+
+
+def best_of(function, number, repeat=5):
+    'best time in seconds for a single call of function'
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
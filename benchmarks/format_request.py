@@ -0,0 +1,95 @@
+"""
+Compare the single pass format_request writer and the cached request templates with
+the previous ElementTree -> tostring -> minidom -> toprettyxml implementation
+"""
+from __future__ import print_function, unicode_literals
+
+from xml.dom import minidom
+import xml.etree.ElementTree as ET
+
+from constants import STOP_ON_ERROR
+from quickbooks.qbxml_request_formatter import (
+    CheckQueryRequest,
+    ItemQueryRequest,
+    PurchaseOrderQueryRequest,
+)
+from quickbooks.qbxml_serializers import format_request, format_request_part
+from quickbooks.qbxml_templates import format_request as template_format_request
+
+from . import best_of
+
+
+def minidom_format_request(request_type, request_items=None, qbxml_version='13.0', on_error=STOP_ON_ERROR):
+    'format_request as it was implemented before the single pass writer'
+    if not request_items:
+        request_items = dict()
+    section = ET.Element(request_type)
+    if hasattr(request_items, 'items'):
+        request_items = request_items.items()
+    for key, value in request_items:
+        section.extend(format_request_part(key, value))
+    body = ET.Element('QBXMLMsgsRq', onError=on_error)
+    body.append(section)
+    document = ET.Element('QBXML')
+    document.append(body)
+    elements = [
+        ET.ProcessingInstruction('xml', 'version="1.0"'),
+        ET.ProcessingInstruction('qbxml', 'version="{}"'.format(qbxml_version)),
+        document,
+    ]
+    request = ''.join(ET.tostring(x) for x in elements)
+    return minidom.parseString(request).toprettyxml(indent="  ")
+
+
+def item_receipt_request(lines=20):
+    'an ItemReceiptAddRq shaped like the ones posted by the downstream service'
+    return [
+        ('ItemReceiptAdd', (
+            ('VendorRef', (('FullName', 'Mrs. Fields'),)),
+            ('TxnDate', '2016-10-17'),
+            ('RefNumber', 'SOC18731'),
+            ('Memo', 'Received & checked <partial>'),
+            ('LinkToTxnID', '44F338-1465312853'),
+            ('ItemLineAdd', [
+                (
+                    ('ItemRef', (('ListID', '80002CBD-1426114159'),)),
+                    ('Desc', 'SendOutCards 12 Nibbler Cookie Box Assorted (c24)'),
+                    ('Quantity', line),
+                    ('Cost', '3.15'),
+                    ('ClassRef', (('FullName', 'Gifting'),)),
+                )
+                for line in range(lines)
+            ]),
+        )),
+    ]
+
+
+def requests():
+    return [
+        ('CheckQueryRq', CheckQueryRequest(days=20).request_dictionary),
+        ('ItemQueryRq', ItemQueryRequest(list_ids=['80002CBD-1426114159'] * 15).request_dictionary),
+        ('PurchaseOrderQueryRq', PurchaseOrderQueryRequest(txn_ids=['44F338-1465312853'] * 13).request_dictionary),
+        ('ItemReceiptAddRq', item_receipt_request(20)),
+        ('ItemReceiptAddRq', item_receipt_request(200)),
+    ]
+
+
+def main():
+    print('{:<24} {:>12} {:>12} {:>12} {:>8}'.format(
+        'request', 'minidom us', 'direct us', 'template us', 'speedup'
+    ))
+    for request_type, request_items in requests():
+        expected = minidom_format_request(request_type, request_items)
+        assert format_request(request_type, request_items) == expected
+        assert template_format_request(request_type, request_items) == expected
+        number = 200
+        legacy = best_of(lambda: minidom_format_request(request_type, request_items), number)
+        direct = best_of(lambda: format_request(request_type, request_items), number)
+        template = best_of(lambda: template_format_request(request_type, request_items), number)
+        print('{:<24} {:>12.1f} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(
+            request_type, legacy * 1e6, direct * 1e6, template * 1e6, legacy / template
+        ))
+
+
+if __name__ == '__main__':
+    main()
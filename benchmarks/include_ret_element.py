@@ -0,0 +1,45 @@
+"""
+Size of the simulated purchase order response and the time to parse it and read the
+purchase orders out of it with all fields and limited to a few of them with fields
+(IncludeRetElement).
+"""
+from __future__ import print_function, unicode_literals
+
+from quickbooks.qbcom import QuickBooks
+from quickbooks.qbxml_request_formatter import PurchaseOrderQueryRequest
+from quickbooks.qbxml_serializers import parse_response
+
+from . import best_of
+
+
+FIELDS = (
+    ('all', None),
+    ('header', ['TxnID', 'RefNumber', 'TxnDate', 'VendorRef', 'TotalAmount']),
+    ('header+edit', ['TxnID', 'TimeModified', 'EditSequence', 'RefNumber', 'TxnDate', 'VendorRef', 'TotalAmount']),
+)
+
+
+def main():
+    qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator')
+    qb.begin_session()
+    print('{:<12} {:>10} {:>8} {:>10} {:>8}'.format('fields', 'bytes', 'size', 'parse ms', 'kept'))
+    full_size = None
+    try:
+        for name, fields in FIELDS:
+            request = PurchaseOrderQueryRequest(initial=True, fields=fields)
+            response = qb.send(request.request_type, request.request_dictionary)
+            full_size = full_size or len(response)
+
+            def read():
+                return request.get_response_elements(parse_response(request.request_type, response))
+
+            seconds = best_of(read, number=10)
+            print('{:<12} {:>10} {:>7.0%} {:>10.2f} {:>8}'.format(
+                name, len(response), float(len(response)) / full_size, seconds * 1000, len(read())
+            ))
+    finally:
+        qb.end_session()
+
+
+if __name__ == '__main__':
+    main()
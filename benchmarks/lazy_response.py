@@ -0,0 +1,38 @@
+"""
+Time to read the purchase orders kept by PurchaseOrderQueryRequest out of the fixture
+response parsed with xmltodict, streamed with iter_parse_response and indexed with
+LazyResponse.  Timed with the configured QUICKBOOKS_PURCHASE_ORDER_CLASSES, which
+keep most of the fixture, and with only Shipping purchase orders kept (class_names).
+"""
+from __future__ import print_function, unicode_literals
+
+from constants import QUICKBOOKS_PURCHASE_ORDER_CLASSES
+from quickbooks.lazy_response import LazyResponse
+from quickbooks.qbxml_request_formatter import PurchaseOrderQueryRequest
+from quickbooks.qbxml_serializers import iter_parse_response, parse_response
+from quickbooks.records import to_dict
+
+from . import best_of, read_fixture
+
+
+REQUEST_TYPE = 'PurchaseOrderQueryRq'
+
+
+def main():
+    response = read_fixture('purchase_order_query_response.xml')
+    parsers = (
+        ('parse_response', lambda: parse_response(REQUEST_TYPE, response)),
+        ('iter_parse_response', lambda: iter_parse_response(REQUEST_TYPE, response)),
+        ('LazyResponse', lambda: LazyResponse(REQUEST_TYPE, response)),
+    )
+    print('{:<12} {:<22} {:>10} {:>8}'.format('classes', 'parser', 'ms', 'kept'))
+    for classes in (QUICKBOOKS_PURCHASE_ORDER_CLASSES, ['Shipping']):
+        request = PurchaseOrderQueryRequest(initial=True, class_names=classes)
+        for name, parse in parsers:
+            kept = len(request.get_response_elements(parse()))
+            seconds = best_of(lambda: to_dict(request.get_response_elements(parse())), number=20)
+            print('{:<12} {:<22} {:>10.2f} {:>8}'.format(','.join(classes), name, seconds * 1000, kept))
+
+
+if __name__ == '__main__':
+    main()
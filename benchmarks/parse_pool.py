@@ -0,0 +1,57 @@
+"""
+Wall time of a paged item query and of a list of item queries against the simulator,
+which takes LATENCY plus BYTE_COST per character of the response like QuickBooks
+does, parsed inline and by a ParsePool of 2 processes.  The threshold is 0 so every
+response goes to the pool.
+"""
+from __future__ import print_function, unicode_literals
+
+import time
+
+from quickbooks.parse_pool import ParsePool
+from quickbooks.qbcom import QuickBooks
+
+from . import best_of
+
+
+LATENCY = 0.05
+BYTE_COST = 1e-6
+
+
+def run(parser, work):
+    qb = QuickBooks(
+        company_file_name='simulated.QBW', backend='simulator',
+        backend_options={'latency': LATENCY, 'byte_cost': BYTE_COST}, parser=parser,
+    )
+    qb.begin_session()
+    try:
+        return best_of(lambda: work(qb), number=1, repeat=3)
+    finally:
+        qb.end_session()
+
+
+def paged_query(qb):
+    for page in qb.quickbooks_query_pages('item', {'initial': True}, page_size=50):
+        pass
+
+
+def item_queries(qb):
+    futures = [qb.call_async('ItemQueryRq') for _ in range(10)]
+    for future in futures:
+        future.result()
+
+
+def main():
+    pool = ParsePool(processes=2, threshold=0)
+    # start the processes before timing
+    pool.submit(0, time.time).result()
+    print('{:<14} {:>10} {:>10}'.format('work', 'inline ms', 'pool ms'))
+    for name, work in (('paged_query', paged_query), ('item_queries', item_queries)):
+        inline = run(ParsePool(), work)
+        pooled = run(pool, work)
+        print('{:<14} {:>10.1f} {:>10.1f}'.format(name, inline * 1000, pooled * 1000))
+    pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Memory per 10k entities of the parsed fixture responses as xmltodict style OrderedDicts
+and as quickbooks.records classes, measured by walking the object graph with
+sys.getsizeof.  Strings are counted for both, they are the same objects either way.
+"""
+from __future__ import print_function, unicode_literals
+
+import sys
+
+from quickbooks.qbxml_serializers import iter_parse_response
+from quickbooks.records import Record, element_to_record
+
+from . import read_fixture
+
+
+FIXTURES = (
+    ('check_query_response.xml', 'CheckQueryRq'),
+    ('item_query_response.xml', 'ItemQueryRq'),
+    ('purchase_order_query_response.xml', 'PurchaseOrderQueryRq'),
+)
+
+ENTITIES = 10000
+
+
+def deep_size(value, seen=None):
+    'bytes used by value and everything it references'
+    seen = seen if seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, child in value.items():
+            size += deep_size(key, seen) + deep_size(child, seen)
+    elif isinstance(value, list):
+        size += sum(deep_size(child, seen) for child in value)
+    elif isinstance(value, Record):
+        if value.extras is not None:
+            size += deep_size(value.extras, seen)
+        for key in value.fields:
+            size += deep_size(getattr(value, key, None), seen)
+    return size
+
+
+def parse(request_type, response, convert=None):
+    'ENTITIES entities parsed from the response, parsed again as often as needed'
+    entities = list()
+    while len(entities) < ENTITIES:
+        entities += [element for _, element in iter_parse_response(request_type, response, convert)]
+    return entities[:ENTITIES]
+
+
+def main():
+    print('{:<36} {:>14} {:>14} {:>8}'.format('fixture', 'dicts MB/10k', 'records MB/10k', 'ratio'))
+    for file_name, request_type in FIXTURES:
+        response = read_fixture(file_name)
+        dicts = deep_size(parse(request_type, response))
+        records = deep_size(parse(request_type, response, element_to_record))
+        print('{:<36} {:>14.2f} {:>14.2f} {:>8.2f}'.format(
+            file_name, dicts / 1e6, records / 1e6, records / float(dicts)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Payload size and encode/decode time of the process_response arguments for the fixture
+responses with json, pickle (cPickle on python 2 like celery uses) and qbpack
+"""
+from __future__ import print_function, unicode_literals
+
+import json
+
+from six.moves import cPickle as pickle
+
+from quickbooks.qbxml_serializers import parse_response
+from quickbooks.serialization import dumps, loads, lz4_frame
+
+from . import best_of, read_fixture
+
+
+FIXTURES = (
+    ('check_query_response.xml', 'CheckQueryRq'),
+    ('item_query_response.xml', 'ItemQueryRq'),
+    ('purchase_order_query_response.xml', 'PurchaseOrderQueryRq'),
+)
+
+
+def serializers():
+    yield 'json', lambda value: json.dumps(value).encode('utf-8'), lambda data: json.loads(data.decode('utf-8'))
+    yield 'pickle', lambda value: pickle.dumps(value, 2), pickle.loads
+    yield 'qbpack', lambda value: dumps(value, compression=None), loads
+    yield 'qbpack+zlib', lambda value: dumps(value, compression='zlib'), loads
+    if lz4_frame is not None:
+        yield 'qbpack+lz4', lambda value: dumps(value, compression='lz4'), loads
+
+
+def main():
+    print('{:<36} {:<12} {:>10} {:>8} {:>11} {:>11}'.format(
+        'fixture', 'serializer', 'bytes', 'ratio', 'encode ms', 'decode ms'
+    ))
+    for file_name, request_type in FIXTURES:
+        response = parse_response(request_type, read_fixture(file_name))
+        payload = ['surrogate-key', 'model_name', response, 'quickbooks']
+        json_size = None
+        for name, encode, decode in serializers():
+            data = encode(payload)
+            assert decode(data) == payload
+            json_size = json_size or len(data)
+            encode_time = best_of(lambda: encode(payload), 10)
+            decode_time = best_of(lambda: decode(data), 10)
+            print('{:<36} {:<12} {:>10} {:>8.3f} {:>11.2f} {:>11.2f}'.format(
+                file_name, name, len(data), len(data) / float(json_size), encode_time * 1e3, decode_time * 1e3
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,21 @@
 from __future__ import absolute_import
 
 from config.celery_app import celery_app
-from .config import QB_LOOKUP, SETTINGS
+from .config import QB_ARCHIVE, QB_CACHE, QB_LOOKUP, QB_METRICS, QB_MIRROR, QB_PARSE, QB_PIPELINE, QB_SERIALIZATION, QB_SESSION, QB_SYNC, QB_TRAFFIC, SETTINGS
 
 
 __all__ = [
+    'QB_ARCHIVE',
+    'QB_CACHE',
     'QB_LOOKUP',
+    'QB_METRICS',
+    'QB_MIRROR',
+    'QB_PARSE',
+    'QB_PIPELINE',
+    'QB_SERIALIZATION',
+    'QB_SESSION',
+    'QB_SYNC',
+    'QB_TRAFFIC',
     'SETTINGS',
     'celery_app',
 ]
@@ -6,7 +6,9 @@ from celery import signals
 from raven import Client as RavenClient
 from raven.contrib.celery import register_signal, register_logger_signal
 
-from .config import SETTINGS
+from quickbooks.serialization import register_serializer
+
+from .config import QB_SERIALIZATION, SETTINGS
 
 
 class Celery(celery.Celery):
@@ -20,6 +22,9 @@ class Celery(celery.Celery):
         register_signal(client)
 
 
+# qbpack has to be registered before the accepted content types are checked
+register_serializer(compression=QB_SERIALIZATION['compression'])
+
 celery_app = Celery(SETTINGS.get('app_name'))
 celery_app.config_from_object('config:config')
 
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+from datetime import timedelta
 import json
 import os
 
@@ -17,8 +18,88 @@ QB_LOOKUP = {
     'application_name': SETTINGS.get(u'qb_application_name'),
     'company_file_name': SETTINGS.get(u'qb_file_location'),
     'service_user': SETTINGS.get(u'service_user'),
+    # 'com' or 'simulator' to run without QuickBooks, see quickbooks.simulator
+    'backend': SETTINGS.get(u'qb_backend', u'com'),
+    'backend_options': SETTINGS.get(u'qb_backend_options', {}),
+    # parse query results into slotted records, see quickbooks.records
+    'records': SETTINGS.get(u'qb_records', False),
+    # index responses and decode only what adapters read, see quickbooks.lazy_response
+    'lazy': SETTINGS.get(u'qb_lazy_responses', False),
 }
 
+# keep the company file open across tasks, see quickbooks.session.SessionManager
+QB_SESSION = {
+    'idle_timeout': SETTINGS.get(u'session_idle_timeout', 300),
+    'max_tasks': SETTINGS.get(u'session_max_tasks', 100),
+    'health_check_after': SETTINGS.get(u'session_health_check_after', 60),
+}
+
+# serializer of the messages sent to the quickbooks queue, None for the celery default
+# or 'qbpack' (compressed with quickbooks_compression: zlib, lz4 or null), see
+# quickbooks.serialization.  The consuming worker has to accept it as well.
+QB_SERIALIZATION = {
+    'serializer': SETTINGS.get(u'quickbooks_serializer'),
+    'compression': SETTINGS.get(u'quickbooks_compression', u'zlib'),
+}
+
+# parse responses of at least parse_threshold characters in a pool of parse_processes
+# processes while the next request is sent, 0 parses everything inline.  See
+# quickbooks.parse_pool
+QB_PARSE = {
+    'processes': SETTINGS.get(u'parse_processes', 0),
+    'threshold': SETTINGS.get(u'parse_threshold', 256 * 1024),
+}
+
+# requests of qb_requests formatted and responses waiting to be parsed while
+# QuickBooks processes a request, see quickbooks.pipeline
+QB_PIPELINE = {
+    'queue_size': SETTINGS.get(u'pipeline_queue_size', 4),
+}
+
+# timings and counts of the COM client in the Prometheus text format, written to
+# metrics_textfile after every task and/or served on http://127.0.0.1:metrics_port/
+# See quickbooks.metrics
+QB_METRICS = {
+    'textfile': SETTINGS.get(u'metrics_textfile'),
+    'port': SETTINGS.get(u'metrics_port'),
+}
+
+# watermarks for incremental quickbooks_query runs, see quickbooks.sync_state
+QB_SYNC = {
+    'state_db': SETTINGS.get(u'state_db', u'qb_state.sqlite3'),
+    'overlap_minutes': SETTINGS.get(u'sync_overlap_minutes', 10),
+}
+
+# local copy of query results answering lookups by id or name, see quickbooks.mirror
+# disabled unless mirror_db is set
+QB_MIRROR = {
+    'path': SETTINGS.get(u'mirror_db'),
+    'max_age': SETTINGS.get(u'mirror_max_age', 300),
+}
+
+# query results kept in the worker for query_cache_ttls seconds by request type e.g.
+# {"ItemQueryRq": 300}, writes drop the results they change.  See quickbooks.cache
+QB_CACHE = {
+    'ttls': SETTINGS.get(u'query_cache_ttls', {}),
+    'max_entries': SETTINGS.get(u'query_cache_max_entries', 256),
+    'max_bytes': SETTINGS.get(u'query_cache_max_bytes', 64 * 1024 * 1024),
+}
+
+# every request and response appended to compressed segments in archive_dir by a
+# background thread instead of xml files for save_xml, see quickbooks.archive
+QB_ARCHIVE = {
+    'directory': SETTINGS.get(u'archive_dir'),
+    'max_segment_bytes': SETTINGS.get(u'archive_max_segment_bytes', 64 * 1024 * 1024),
+    'max_segment_seconds': SETTINGS.get(u'archive_max_segment_seconds', 24 * 60 * 60),
+    'max_segments': SETTINGS.get(u'archive_max_segments', 100),
+    'buffer_size': SETTINGS.get(u'archive_buffer_size', 1000),
+}
+
+# the qb_requests, quickbooks_query and pretty_print tasks the worker runs appended
+# to traffic_capture for replays, see quickbooks.traffic
+QB_TRAFFIC = {
+    'capture_path': SETTINGS.get(u'traffic_capture'),
+}
 
 
 default_exchange = Exchange('qb_desktop', type='direct')
@@ -33,7 +114,7 @@ CELERY_DEFAULT_EXCHANGE_TYPE = 'direct'
 CELERY_DEFAULT_ROUTING_KEY = 'qb_desktop'
 CELERY_DEFAULT_QUEUE = 'qb_desktop'
 CELERY_CREATE_MISSING_QUEUES = False
-CELERY_ACCEPT_CONTENT = ['pickle', 'json']
+CELERY_ACCEPT_CONTENT = ['pickle', 'json', 'qbpack']
 BROKER_URL = SETTINGS.get('broker')
 CELERY_RESULT_BACKEND = SETTINGS.get('backend')
 CELERY_ENABLE_UTC = True
@@ -43,6 +124,13 @@ CELERY_DEFAULT_QUEUE = 'qb_desktop'
 CELERYD_HIJACK_ROOT_LOGGER = False
 IGNORE_RESULT = False
 CELERY_ALWAYS_EAGER = False
+CELERYBEAT_SCHEDULE = {
+    'release-idle-quickbooks-session': {
+        'task': 'qb_desktop.tasks.release_idle_session',
+        'schedule': timedelta(seconds=60),
+        'options': {'expires': 60},
+    },
+}
 
 LOGGING = {
     'version': 1,
@@ -1,5 +1,23 @@
+from collections import OrderedDict
+
+
 def pluralize(something):
     if not isinstance(something, list):
         something = [something]
     return something
 
+
+
+def freeze(value):
+    """
+    hashable copy of a request dictionary or response, lists and tuples alike.  Keys
+    of OrderedDicts keep their order, those of other dictionaries are sorted
+    """
+    if hasattr(value, 'items'):
+        items = value.items()
+        if not isinstance(value, OrderedDict):
+            items = sorted(items)
+        return tuple((key, freeze(child)) for key, child in items)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(child) for child in value)
+    return value
@@ -0,0 +1,281 @@
+# coding=utf-8
+"""
+Append-only archive of the requests sent to QuickBooks and their responses
+
+Archive.record hands an exchange (request type, request, response, surrogate key,
+latency) to a background thread through a bounded buffer and returns right away,
+when the buffer is full the exchange is dropped instead of slowing the request
+down.  The thread appends every exchange as a JSON line compressed into a gzip
+member of its own to the current segment file, so a segment reads with zcat and a
+single exchange decompresses on its own from its offset.  Next to every segment an
+index file has a JSON line of metadata per exchange: id, time, request type,
+surrogate key, latency, statusCode and statusSeverity, offset and length.
+
+Segments are rotated after max_segment_bytes or max_segment_seconds, only the
+newest max_segments of the directory are kept.
+
+An exchange is pulled out for the Intuit qbxml validator with the reader, e.g.
+
+    python -m quickbooks.archive list C:\\archive --request-type ItemReceiptAddRq --errors
+    python -m quickbooks.archive show C:\\archive 6f1c0d... > request.xml
+    python -m quickbooks.archive show C:\\archive 6f1c0d... --response > response.xml
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+
+import six
+from six.moves import queue
+
+from .parse_pool import response_status
+
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.idx'
+
+DEFAULT_MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_SEGMENT_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_SEGMENTS = 100
+# exchanges waiting for the writer thread
+DEFAULT_BUFFER_SIZE = 1000
+
+# gzip header and trailer around the deflate stream
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+CLOSE = object()
+
+
+def compress_member(data, level=6):
+    'data as a complete gzip member, members concatenated are a valid gzip file'
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def segment_paths(directory):
+    'the segments of the directory, oldest first'
+    return sorted(glob.glob(os.path.join(directory, '*' + SEGMENT_SUFFIX)))
+
+
+def index_path(segment):
+    return segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+def iter_index(directory):
+    'the index entries of every exchange in the directory, oldest first, with the segment path'
+    for segment in segment_paths(directory):
+        try:
+            with open(index_path(segment), 'rb') as fin:
+                for line in fin:
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        # the last line of a segment being written
+                        continue
+                    entry['segment'] = segment
+                    yield entry
+        except (IOError, OSError):
+            continue
+
+
+def read_exchange(entry):
+    'the exchange of an index entry: its metadata with the request and response'
+    with open(entry['segment'], 'rb') as fin:
+        fin.seek(entry['offset'])
+        data = fin.read(entry['length'])
+    return json.loads(zlib.decompress(data, GZIP_WBITS).decode('utf-8'))
+
+
+def find_exchange(directory, exchange_id):
+    'the exchange with the id or an id starting with it, None if there is none'
+    for entry in iter_index(directory):
+        if entry['id'].startswith(exchange_id):
+            return read_exchange(entry)
+    return None
+
+
+class Archive(object):
+    """
+    Appends the exchanges recorded to rotating segments in directory from a
+    background thread, started on the first record.  close writes what is buffered.
+
+    Example usage:
+
+        archive = Archive('C:\\archive')
+        archive.record('ItemReceiptAddRq', request, response, surrogate_key=12, latency=0.31)
+        ...
+        archive.close()
+    """
+    def __init__(self, directory, max_segment_bytes=DEFAULT_MAX_SEGMENT_BYTES, max_segment_seconds=DEFAULT_MAX_SEGMENT_SECONDS, max_segments=DEFAULT_MAX_SEGMENTS, buffer_size=DEFAULT_BUFFER_SIZE, compression_level=6, clock=time.time):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        self.max_segments = max_segments
+        self.compression_level = compression_level
+        self.clock = clock
+        self.buffer = queue.Queue(buffer_size)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.segment = None
+        self.index = None
+        self.segment_started = None
+
+    def record(self, request_type, request, response=None, surrogate_key=None, latency=None):
+        'queue the exchange for the writer, False if the buffer was full and it was dropped'
+        exchange = {
+            'id': uuid.uuid4().hex,
+            'time': datetime.datetime.utcnow().isoformat(),
+            'request_type': request_type,
+            'surrogate_key': surrogate_key,
+            'latency': latency,
+            'request': request,
+            'response': response,
+        }
+        self.start()
+        try:
+            self.buffer.put_nowait(exchange)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='quickbooks-archive')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def close(self):
+        'write the buffered exchanges and close the segment'
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.buffer.put(CLOSE)
+            thread.join()
+
+    def run(self):
+        while True:
+            try:
+                exchange = self.buffer.get(timeout=1)
+            except queue.Empty:
+                self.flush()
+                continue
+            if exchange is CLOSE:
+                self.close_segment()
+                return
+            try:
+                self.write(exchange)
+            except Exception as e:
+                logger.error('Could not archive {}: {}'.format(exchange['request_type'], e))
+            if self.buffer.empty():
+                self.flush()
+
+    def write(self, exchange):
+        status = response_status(exchange['response']) if exchange['response'] else dict()
+        exchange['status_code'] = status.get('@statusCode')
+        exchange['status_severity'] = status.get('@statusSeverity')
+        data = compress_member(json.dumps(exchange).encode('utf-8') + b'\n', self.compression_level)
+
+        self.rotate()
+        offset = self.segment.tell()
+        self.segment.write(data)
+        entry = dict(
+            (key, value) for key, value in exchange.items() if key not in ('request', 'response')
+        )
+        entry.update(offset=offset, length=len(data))
+        self.index.write(json.dumps(entry).encode('utf-8') + b'\n')
+
+    def rotate(self):
+        'start a new segment when there is none or the current one is full or old enough'
+        if self.segment is not None:
+            full = self.segment.tell() >= self.max_segment_bytes
+            old = self.clock() - self.segment_started >= self.max_segment_seconds
+            if not (full or old):
+                return
+            self.close_segment()
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # names sort by when the segment was started
+        name = 'exchanges-{}-{}'.format(datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f'), os.getpid())
+        path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        self.segment = open(path, 'ab')
+        self.index = open(index_path(path), 'ab')
+        self.segment_started = self.clock()
+        self.prune(path)
+
+    def prune(self, current):
+        'remove the oldest segments beyond max_segments'
+        if not self.max_segments:
+            return
+        segments = [segment for segment in segment_paths(self.directory) if segment != current]
+        for segment in segments[:max(len(segments) + 1 - self.max_segments, 0)]:
+            for path in (segment, index_path(segment)):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.error(e)
+
+    def flush(self):
+        if self.segment is not None:
+            self.segment.flush()
+            self.index.flush()
+
+    def close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+        self.segment = self.index = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Read the QuickBooks request archive')
+    commands = parser.add_subparsers(dest='command')
+    listing = commands.add_parser('list', help='list the archived exchanges')
+    listing.add_argument('directory')
+    listing.add_argument('--request-type')
+    listing.add_argument('--surrogate-key')
+    listing.add_argument('--errors', action='store_true', help='only responses with statusSeverity Error')
+    show = commands.add_parser('show', help='print the request or response of an exchange')
+    show.add_argument('directory')
+    show.add_argument('id', help='exchange id or the start of it')
+    show.add_argument('--response', action='store_true', help='print the response instead of the request')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for entry in iter_index(args.directory):
+            if args.request_type and entry['request_type'] != args.request_type:
+                continue
+            if args.surrogate_key and str(entry['surrogate_key']) != args.surrogate_key:
+                continue
+            if args.errors and entry['status_severity'] != 'Error':
+                continue
+            print('{id} {time} {request_type} key={surrogate_key} latency={latency} status={status_code}'.format(**entry))
+        return 0
+
+    if args.command == 'show':
+        exchange = find_exchange(args.directory, args.id)
+        if exchange is None:
+            parser.error('no exchange {}'.format(args.id))
+        xml = exchange['response' if args.response else 'request'] or ''
+        print(xml.encode('utf-8') if six.PY2 else xml)
+        return 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
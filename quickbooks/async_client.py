@@ -0,0 +1,249 @@
+# coding=utf-8
+"""
+Use a QuickBooks session from many threads at once
+
+QuickBooks talks to the company file through a single threaded apartment COM object,
+every request has to come from the thread that initialized COM and began the session.
+AsyncQuickBooks owns that thread: the session is begun and ended and every request is
+sent on it, one at a time in the order they were queued.  Requests are formatted and
+responses parsed on a small pool of worker threads so the COM thread only ever waits
+for QuickBooks and the callers never block on each other.
+
+call returns a concurrent.futures.Future of the parsed response and query an iterator
+over the response elements of a query adapter fetching the next pages while the ones
+before are iterated over.  Any number of threads can use them at once.  With a
+timeout a call gives up waiting, it is dropped if its request was not sent yet,
+QuickBooks still finishes one that was.  On python 3 asyncio.wrap_future awaits a call.
+"""
+from __future__ import unicode_literals
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, wait
+from functools import partial
+import threading
+
+from .exceptions import QuickBooksError
+from .parse_pool import response_status
+from .qbcom import QuickBooks, get_request_formatter
+
+
+DEFAULT_WORKERS = 2
+# pages of a paged query requested ahead of the elements iterated over
+DEFAULT_PREFETCH = 2
+
+
+def run_stages(stages, value=None, timeout=None):
+    """
+    Future of passing value through the (executor, function) stages in turn.
+    Cancelling the Future cancels the stage waiting in its executor and skips the
+    rest, after timeout seconds it fails with a TimeoutError the same way.
+    """
+    outer = Future()
+    lock = threading.Lock()
+    current = list()
+    timers = list()
+
+    def finish(result=None, error=None, cancel=False):
+        with lock:
+            if outer.done():
+                return
+            if cancel:
+                outer.cancel()
+            elif error is not None:
+                outer.set_exception(error)
+            else:
+                outer.set_result(result)
+            step = current[0] if current else None
+        for timer in timers:
+            timer.cancel()
+        if step is not None:
+            step.cancel()
+
+    def run(value, remaining):
+        if not remaining:
+            finish(value)
+            return
+        executor, function = remaining[0]
+        try:
+            step = executor.submit(function, value)
+        except RuntimeError:
+            finish(error=QuickBooksError('The QuickBooks client is closed'))
+            return
+        with lock:
+            current[:] = [step]
+            stopped = outer.done()
+        if stopped:
+            step.cancel()
+            return
+        step.add_done_callback(lambda step: advance(step, remaining[1:]))
+
+    def advance(step, remaining):
+        if outer.done():
+            return
+        if step.cancelled():
+            finish(cancel=True)
+        elif step.exception() is not None:
+            finish(error=step.exception())
+        else:
+            run(step.result(), remaining)
+
+    outer.add_done_callback(lambda outer: finish(cancel=True) if outer.cancelled() else None)
+    if timeout:
+        timer = threading.Timer(timeout, lambda: finish(error=TimeoutError()))
+        timer.daemon = True
+        timers.append(timer)
+        timer.start()
+    run(value, stages)
+    return outer
+
+
+class AsyncQuickBooks(object):
+    """
+    Thread safe facade for a QuickBooks instance, the one given or one built from
+    kwargs.  timeout is the default of call and of every page of query in seconds.
+
+    Example usage:
+
+        with AsyncQuickBooks(**QB_LOOKUP) as client:
+            future = client.call('HostQueryRq')
+            for item in client.query('item', {'full_names': ['Widget']}):
+                ...
+            response = future.result()
+    """
+    def __init__(self, qb=None, workers=DEFAULT_WORKERS, timeout=None, prefetch=DEFAULT_PREFETCH, **kwargs):
+        self.qb = qb if qb is not None else QuickBooks(**kwargs)
+        self.timeout = timeout
+        self.prefetch = prefetch
+        self.com_thread = ThreadPoolExecutor(1, thread_name_prefix='quickbooks-com')
+        self.workers = ThreadPoolExecutor(workers, thread_name_prefix='quickbooks-worker')
+
+    def run(self, stages, value=None, timeout=None):
+        'run_stages giving up after timeout seconds, the default timeout unless given'
+        return run_stages(stages, value, self.timeout if timeout is None else timeout)
+
+    def start(self):
+        'Future of beginning the session on the COM thread'
+        return self.run([(self.com_thread, lambda _: self.qb.begin_session())])
+
+    def close(self):
+        """
+        Future of ending the session on the COM thread, QuickBooks is left running like
+        the session manager leaves it.  The threads exit once their work is done.
+        """
+        future = self.run([(self.com_thread, lambda _: self.qb.end_session(force=False))])
+        self.com_thread.shutdown(wait=False)
+        self.workers.shutdown(wait=False)
+        return future
+
+    def __enter__(self):
+        self.start().result()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close().result()
+
+    def send(self, request_type, request):
+        return self.qb.process_request(request_type, request)
+
+    def call(self, request_type, request_dictionary=None, attributes=None, timeout=None):
+        'Future of the parsed response to the request, see QuickBooks.call'
+        return self.run([
+            (self.workers, lambda _: self.qb.format_request(request_type, request_dictionary, attributes=attributes)),
+            (self.com_thread, partial(self.send, request_type)),
+            (self.workers, partial(self.qb.read_response, request_type)),
+        ], timeout=timeout)
+
+    def query(self, query_type, request_args=dict(), page_size=None, timeout=None):
+        """
+        iterator over the response elements of the query, see
+        QuickBooks.quickbooks_query.  With a page_size the next pages are requested
+        while the elements of the ones before are iterated over.
+        """
+        return QueryIterator(self, query_type, request_args, page_size, timeout)
+
+
+class QueryIterator(object):
+    """
+    Iterator over the response elements of a query.  Up to prefetch pages are
+    requested ahead on the COM thread and parsed one at a time in order by the
+    workers.  close stops requesting pages.
+    """
+    def __init__(self, client, query_type, request_args, page_size=None, timeout=None):
+        if page_size:
+            request_args = dict(request_args, max_returned=page_size)
+        self.client = client
+        self.qb = client.qb
+        self.request_object = get_request_formatter(query_type, request_args)
+        self.lazy = self.qb.lazy and self.request_object.lazy_response and not self.qb.records
+        self.page_size = page_size
+        self.timeout = client.timeout if timeout is None else timeout
+        self.elements = deque()
+        # Futures of the elements of the pages requested, in order
+        self.pages = deque()
+        # whether there are pages left, only changed on the COM thread
+        self.more = True
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.elements:
+            self.request_pages()
+            if not self.pages:
+                raise StopIteration
+            page = self.pages.popleft()
+            try:
+                self.elements.extend(page.result(self.timeout))
+            except Exception:
+                self.close()
+                raise
+        return self.elements.popleft()
+
+    next = __next__
+
+    def close(self):
+        self.closed = True
+        for page in self.pages:
+            page.cancel()
+        self.pages.clear()
+        self.elements.clear()
+
+    def request_pages(self):
+        while not self.closed and self.more and len(self.pages) < self.client.prefetch:
+            previous = self.pages[-1] if self.pages else None
+            # pages wait for the ones before them, timeout only applies to iterating
+            self.pages.append(run_stages([
+                (self.client.com_thread, self.fetch),
+                (self.client.workers, partial(self.parse, previous)),
+            ]))
+
+    def fetch(self, _):
+        """
+        the response to the next page, None once there are no more, run on the COM
+        thread after the page before was fetched
+        """
+        if not self.more:
+            return None
+        request_object = self.request_object
+        request = self.qb.format_request(
+            request_object.request_type, request_object.request_dictionary, attributes=request_object.request_attributes,
+        )
+        response = self.client.send(request_object.request_type, request)
+        status = response_status(response)
+        remaining = status.get('@iteratorRemainingCount')
+        if not self.page_size or status.get('@statusSeverity') == 'Error' or not remaining or int(remaining) == 0:
+            self.more = False
+        else:
+            request_object.continue_iterator(status['@iteratorID'])
+        return response
+
+    def parse(self, previous, response):
+        'the response elements of a page, run by a worker once the page before was parsed'
+        if previous is not None:
+            wait([previous])
+        if response is None:
+            return []
+        request_object = self.request_object
+        response = self.qb.read_response(request_object.request_type, response, stream=True, lazy=self.lazy)
+        return list(self.qb.filtered(request_object, request_object.get_response_elements(response)))
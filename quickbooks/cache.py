@@ -0,0 +1,200 @@
+# coding=utf-8
+"""
+Read-through cache of query results kept in the worker process
+
+The same lookups (an item by full name, the checks of the last days) are often queried
+again within minutes.  QuickBooks(cache=QueryCache(...)) answers a query it has a
+result for from the cache instead of sending it, results are kept for the TTL of their
+request type, queries of types without a TTL are always sent.
+
+Entries are keyed by the request type and the request dictionary (freeze normalizes
+plain dictionaries) and held pickled, so every hit returns a copy callers can change.
+The cache holds at most max_entries results of max_bytes pickled bytes in total, the
+least recently used are dropped first.
+
+Every request QuickBooks sends that is not a query (adds, modifies, deletes and voids,
+also inside batches) drops the entries of its entity family and of the families it
+changes as well, e.g. an ItemReceiptAddRq drops cached items and purchase orders.
+Changes made in QuickBooks itself are only picked up once the TTL runs out.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import logging
+import re
+import time
+
+from six.moves import cPickle as pickle
+
+from . import freeze
+from .coalescing import is_query
+
+
+logger = logging.getLogger(__name__)
+
+# opening tag of every request of a request or envelope
+REQUEST_TAG = re.compile(r'<(?!QBXMLMsgsRq)(\w+Rq)[\s/>]')
+# the type of entity a TxnDelRq, ListDelRq or TxnVoidRq removes
+DELETE_TYPE = re.compile(r'<(?:TxnDelType|ListDelType|TxnVoidType)>\s*(\w+)\s*<')
+DELETE_REQUESTS = ('TxnDelRq', 'ListDelRq', 'TxnVoidRq')
+
+OPERATIONS = ('Query', 'Add', 'Mod', 'Del', 'Void')
+
+# families whose cached results a write of the family changes as well, None for every
+# family.  Transactions with item lines change item quantities, receipts and bills
+# received against a purchase order change its lines.
+DEPENDENT_FAMILIES = {
+    'ItemReceipt': ('Item', 'PurchaseOrder'),
+    'Bill': ('Item', 'PurchaseOrder'),
+    'PurchaseOrder': ('Item',),
+    'Check': ('Item',),
+    'CreditCardCharge': ('Item',),
+    'CreditCardCredit': ('Item',),
+    'VendorCredit': ('Item',),
+    'Invoice': ('Item',),
+    'SalesReceipt': ('Item',),
+    'SalesOrder': ('Item',),
+    'CreditMemo': ('Item',),
+    'InventoryAdjustment': ('Item',),
+    'BuildAssembly': ('Item',),
+    'ClearedStatus': ('Check', 'CreditCardCharge', 'CreditCardCredit', 'Deposit'),
+    'DataExt': None,
+}
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def family(name):
+    'the entity family of an entity name e.g. Item for ItemInventory'
+    if name.startswith('Item') and not name.startswith('ItemReceipt'):
+        return 'Item'
+    return name
+
+
+def entity_family(request_type):
+    'the entity family a request reads or writes e.g. Item for ItemInventoryAddRq'
+    name = request_type[:-2] if request_type.endswith('Rq') else request_type
+    for operation in OPERATIONS:
+        if name.endswith(operation):
+            name = name[:-len(operation)]
+            break
+    return family(name)
+
+
+def written_families(request):
+    """
+    set of the entity families the adds, modifies and deletes of a qbxml request
+    change, None if it could change any of them
+    """
+    families = set()
+    for request_type in REQUEST_TAG.findall(request):
+        if is_query(request_type):
+            continue
+        if request_type in DELETE_REQUESTS:
+            names = DELETE_TYPE.findall(request)
+            if not names:
+                return None
+            written = [family(name) for name in names]
+        else:
+            written = [entity_family(request_type)]
+        for name in written:
+            dependents = DEPENDENT_FAMILIES.get(name, ())
+            if dependents is None:
+                return None
+            families.add(name)
+            families.update(dependents)
+    return families
+
+
+class QueryCache(object):
+    """
+    LRU of pickled query results with a TTL per request type in seconds, request types
+    missing from ttls are kept for default_ttl seconds, 0 doesn't cache them.
+
+    Example usage:
+
+        cache = QueryCache(ttls={'ItemQueryRq': 300, 'CheckQueryRq': 60})
+        qb = QuickBooks(cache=cache, **QB_LOOKUP)
+        qb.quickbooks_query('item', {'full_names': ['Widget']})
+        qb.quickbooks_query('item', {'full_names': ['Widget']})  # no request
+    """
+    def __init__(self, ttls=None, default_ttl=0, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, clock=time.time):
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        # key -> (family, expires, pickled result), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def ttl(self, request_type):
+        return self.ttls.get(request_type, self.default_ttl)
+
+    @staticmethod
+    def key(kind, request_type, request_dictionary=None):
+        'kind tells results of the same request apart e.g. parsed responses and response elements'
+        return freeze((kind, request_type, request_dictionary))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+    def get(self, key):
+        'a copy of the cached result, None if there is no fresh one'
+        entry = self.entries.pop(key, None)
+        if entry is None or entry[1] <= self.clock():
+            if entry is not None:
+                self.size -= len(entry[2])
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return pickle.loads(entry[2])
+
+    def put(self, key, request_type, value):
+        'cache a result of a request of request_type, returns whether it was cached'
+        ttl = self.ttl(request_type)
+        if not ttl:
+            return False
+        try:
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError) as e:
+            logger.debug('Not caching {}: {}'.format(request_type, e))
+            return False
+        if len(payload) > self.max_bytes:
+            return False
+        self.discard(key)
+        self.entries[key] = (entity_family(request_type), self.clock() + ttl, payload)
+        self.size += len(payload)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+        return True
+
+    def invalidate(self, families=None):
+        'drop the entries of the given entity families, every entry with None'
+        if families is None:
+            self.entries.clear()
+            self.size = 0
+            return
+        for key, (entry_family, _, payload) in list(self.entries.items()):
+            if entry_family in families:
+                del self.entries[key]
+                self.size -= len(payload)
+
+    def invalidate_request(self, request):
+        'drop the entries a qbxml request sent to QuickBooks may have changed'
+        families = written_families(request)
+        if families is None or families:
+            self.invalidate(families)
+
+    def clear(self):
+        self.invalidate()
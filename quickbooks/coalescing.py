@@ -0,0 +1,235 @@
+# coding=utf-8
+"""
+Merge the single id queries of a qb_requests request list into one request each
+
+Callers often send many ItemQueryRq with one ListID or PurchaseOrderQueryRq with one
+TxnID in the same request list, sometimes the same request twice.  Coalescer turns
+the request list into as few requests as it can and fans every response back out to
+the entries it answers:
+
+  * consecutive queries of the same type filtering on a single ListID, TxnID,
+    RefNumber or FullName element, with otherwise identical contents, are sent as one
+    query with every value in that element
+  * identical queries are sent once and every entry gets the same response
+
+Only queries are merged and never across an add or modify in between, so every entry
+still sees the changes of the requests before it.  Requests are sent in the order of
+the first entry they answer.  Entries with a value the merged query found nothing for
+are sent again on their own, so they get the status QuickBooks gives them.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+import six
+
+from . import freeze, pluralize
+
+
+# elements filtering a query by id or name and the field of the response elements they match
+ID_FILTERS = ('ListID', 'TxnID', 'RefNumber', 'FullName')
+# matched regardless of case like QuickBooks does
+CASE_INSENSITIVE_FILTERS = ('RefNumber', 'FullName')
+
+# values per merged query
+MAX_VALUES = 100
+
+STATUS_OK = ('0', 'Info', 'Status OK')
+
+
+def is_query(request_type):
+    return request_type.endswith('QueryRq')
+
+
+def id_filter(request_dict):
+    """
+    (position, filter element, values, other items) of a query filtering on a single
+    id or name element, None if the query can't be merged
+    """
+    items = list(request_dict.items()) if hasattr(request_dict, 'items') else list(request_dict or ())
+    if not all(isinstance(item, tuple) and len(item) == 2 for item in items):
+        return None
+    filters = [index for index, (key, _) in enumerate(items) if key in ID_FILTERS]
+    if len(filters) != 1:
+        return None
+    position = filters[0]
+    key, values = items[position]
+    values = pluralize(values)
+    if not values or not all(isinstance(value, six.string_types) for value in values):
+        return None
+    # responses are fanned out by the filter element, it has to be returned
+    included = [field for name, value in items if name == 'IncludeRetElement' for field in pluralize(value)]
+    if included and key not in included:
+        return None
+    return position, key, list(values), items[:position] + items[position + 1:]
+
+
+def normalize(key, value):
+    if value is not None and key in CASE_INSENSITIVE_FILTERS:
+        return value.lower()
+    return value
+
+
+def status_attributes(status):
+    code, severity, message = status
+    return [('@statusCode', code), ('@statusSeverity', severity), ('@statusMessage', message)]
+
+
+def response_for(response, key, values):
+    """
+    the response a query for values of the key element would have received, built from
+    the response to the merged query.  None if some of the values weren't found, the
+    status QuickBooks gives a query for them isn't in the merged response
+    """
+    (response_type, contents), = response.items()
+    contents = contents or OrderedDict()
+    wanted = set(normalize(key, value) for value in values)
+    found = set()
+    elements = OrderedDict()
+    for label, value in contents.items():
+        if label.startswith('@'):
+            continue
+        matched = list()
+        for element in pluralize(value):
+            field = normalize(key, element.get(key)) if hasattr(element, 'get') else None
+            if field in wanted:
+                matched.append(element)
+                found.add(field)
+        if matched:
+            elements[label] = matched[0] if len(matched) == 1 else matched
+
+    if found != wanted:
+        return None
+    entry_contents = OrderedDict(status_attributes(STATUS_OK))
+    entry_contents.update(elements)
+    return OrderedDict([(response_type, entry_contents)])
+
+
+def is_failed(response):
+    'whether the response to a merged query is not a single *Rs element without an error'
+    if not response or len(response) != 1:
+        return True
+    contents = list(response.values())[0] or dict()
+    return contents.get('@statusSeverity') == 'Error'
+
+
+class Coalescer(object):
+    """
+    requests is the list of (surrogate_key, model_name, (request_type, request_dict))
+    entries to send instead of the request list, fan_out gives the (entry, response)
+    of every entry of the request list a response to requests[request_id] answers.
+    A response of None means the merged query failed or didn't find all of the values
+    of the entry and the entry has to be sent on its own.
+
+    With coalesce=False every entry is sent as is.
+
+    Example usage:
+
+        coalescer = Coalescer(request_list)
+        for request_id, (_, _, (request_type, request_dict)) in enumerate(coalescer.requests):
+            response = qb.call(request_type, request_dictionary=request_dict)
+            for entry, entry_response in coalescer.fan_out(request_id, response):
+                send_response(entry, entry_response, app)
+    """
+    def __init__(self, request_list, max_values=MAX_VALUES, coalesce=True):
+        self.max_values = max_values
+        self.requests = list()
+        # for every request a list of (entry, filter element, values), the element is
+        # None for entries getting the response as is
+        self.targets = list()
+        if not coalesce:
+            for entry in request_list:
+                self.add(entry, [(entry, None, None)])
+            return
+
+        queries = list()
+        for entry in request_list:
+            request_type = self.request_type(entry)
+            if request_type is not None and is_query(request_type):
+                queries.append(entry)
+                continue
+            self.add_queries(queries)
+            queries = list()
+            self.add(entry, [(entry, None, None)])
+        self.add_queries(queries)
+
+    @staticmethod
+    def request_type(entry):
+        try:
+            surrogate_key, model_name, (request_type, request_dict) = entry
+        except (TypeError, ValueError):
+            return None
+        return request_type if isinstance(request_type, six.string_types) else None
+
+    def add(self, entry, targets):
+        self.requests.append(entry)
+        self.targets.append(targets)
+
+    def add_queries(self, entries):
+        'add a run of queries, merged where possible, in the order of their first entry'
+        # (request_type, position, key, others) of merged groups, (None, request) of identical ones
+        groups = OrderedDict()
+        for entry in entries:
+            surrogate_key, model_name, (request_type, request_dict) = entry
+            merge = id_filter(request_dict)
+            if merge is None:
+                groups.setdefault((None, freeze((request_type, request_dict))), list()).append((entry, None))
+                continue
+            position, key, values, others = merge
+            group_key = (request_type, position, key, freeze(others))
+            groups.setdefault(group_key, list()).append((entry, values))
+
+        for group_key, members in groups.items():
+            if group_key[0] is None:
+                self.add(members[0][0], [(entry, None, None) for entry, _ in members])
+                continue
+            request_type, position, key, _ = group_key
+            if len(members) == 1:
+                entry, values = members[0]
+                self.add(entry, [(entry, None, None)])
+                continue
+            for chunk, values in self.chunks(members):
+                self.add_merged(request_type, position, key, chunk, values)
+
+    def chunks(self, members):
+        'split the members of a group into chunks of at most max_values distinct values'
+        chunk = list()
+        values = OrderedDict()
+        for entry, entry_values in members:
+            new = [value for value in entry_values if value not in values]
+            if chunk and len(values) + len(new) > self.max_values:
+                yield chunk, list(values)
+                chunk = list()
+                values = OrderedDict()
+            chunk.append((entry, entry_values))
+            values.update((value, None) for value in entry_values)
+        if chunk:
+            yield chunk, list(values)
+
+    def add_merged(self, request_type, position, key, members, values):
+        surrogate_key, model_name, (_, request_dict) = members[0][0]
+        _, _, _, others = id_filter(request_dict)
+        merged_dict = others[:position] + [(key, values)] + others[position:]
+        self.add(
+            (None, None, (request_type, merged_dict)),
+            [(entry, key, entry_values) for entry, entry_values in members],
+        )
+
+    @property
+    def merged(self):
+        'number of entries that are not sent as requests of their own'
+        return sum(len(targets) for targets in self.targets) - len(self.requests)
+
+    def is_merged(self, request_id):
+        'whether requests[request_id] is a merged query, entries of it may have to be sent again'
+        return any(key is not None for _, key, _ in self.targets[request_id])
+
+    def fan_out(self, request_id, response):
+        'the (entry, response) of every entry answered by the response to requests[request_id]'
+        for entry, key, values in self.targets[request_id]:
+            if key is None:
+                yield entry, response
+            elif is_failed(response):
+                yield entry, None
+            else:
+                yield entry, response_for(response, key, values)
@@ -0,0 +1,271 @@
+# coding=utf-8
+"""
+Columnar export of query results
+
+Entities from QuickBooks.quickbooks_query are turned into typed columns a batch at a
+time.  Numbers, dates and datetimes become NumPy arrays (float64 with NaN,
+datetime64 with NaT) and the batches can be written to Parquet or to an Arrow IPC file
+the reader can memory-map.  Requires numpy, and pyarrow for writing files.
+
+Example usage:
+
+    from quickbooks.columnar import column_batches, write_parquet
+
+    for batch in column_batches('item', qb.quickbooks_query('item', {'initial': True})):
+        batch.columns['QuantityOnHand'].sum()
+
+    write_parquet('items.parquet', 'item', qb.quickbooks_query('item', {'initial': True}))
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .exceptions import QuickBooksError
+from .sync_state import parse_time_modified
+
+
+TEXT = 'text'
+NUMBER = 'number'
+INTEGER = 'integer'
+BOOLEAN = 'boolean'
+DATETIME = 'datetime'
+DATE = 'date'
+
+
+class Column(object):
+    """
+    A column of the export, paths are the places in the entity its value is taken
+    from e.g. 'ClassRef/FullName', the first one present is used
+    """
+    __slots__ = ('name', 'kind', 'paths')
+
+    def __init__(self, name, kind=TEXT, paths=None):
+        self.name = name
+        self.kind = kind
+        self.paths = [tuple(path.split('/')) for path in (paths or [name])]
+
+    def value(self, entity):
+        'text of the entity at the first of the paths that is present, or None'
+        for path in self.paths:
+            value = entity
+            for key in path:
+                value = value.get(key) if hasattr(value, 'get') else None
+                if value is None:
+                    break
+            if hasattr(value, 'get'):
+                # elements with attributes keep their text under #text
+                value = value.get('#text')
+            if value is not None:
+                return value
+        return None
+
+
+COMMON_COLUMNS = [
+    Column('TimeCreated', DATETIME),
+    Column('TimeModified', DATETIME),
+    Column('EditSequence'),
+]
+
+COLUMNS = {
+    'item': [
+        Column('ListID'),
+        Column('FullName'),
+        Column('Name'),
+        Column('category'),
+        Column('IsActive', BOOLEAN),
+        Column('Sublevel', INTEGER),
+        Column('ParentFullName', paths=['ParentRef/FullName']),
+        Column('ManufacturerPartNumber'),
+        Column('SalesDesc', paths=['SalesDesc', 'SalesOrPurchase/Desc', 'SalesAndPurchase/SalesDesc']),
+        Column('SalesPrice', NUMBER, paths=['SalesPrice', 'SalesOrPurchase/Price', 'SalesAndPurchase/SalesPrice']),
+        Column('PurchaseCost', NUMBER, paths=['PurchaseCost', 'SalesAndPurchase/PurchaseCost']),
+        Column('AverageCost', NUMBER),
+        Column('QuantityOnHand', NUMBER),
+        Column('QuantityOnOrder', NUMBER),
+        Column('QuantityOnSalesOrder', NUMBER),
+        Column('PrefVendorFullName', paths=['PrefVendorRef/FullName']),
+    ] + COMMON_COLUMNS,
+    'check': [
+        Column('TxnID'),
+        Column('TxnNumber', INTEGER),
+        Column('RefNumber'),
+        Column('TxnDate', DATE),
+        Column('Amount', NUMBER),
+        Column('AccountFullName', paths=['AccountRef/FullName']),
+        Column('PayeeFullName', paths=['PayeeEntityRef/FullName']),
+        Column('Memo'),
+        Column('IsToBePrinted', BOOLEAN),
+    ] + COMMON_COLUMNS,
+    'purchase_order': [
+        Column('TxnID'),
+        Column('TxnNumber', INTEGER),
+        Column('RefNumber'),
+        Column('TxnDate', DATE),
+        Column('DueDate', DATE),
+        Column('ExpectedDate', DATE),
+        Column('TotalAmount', NUMBER),
+        Column('VendorFullName', paths=['VendorRef/FullName']),
+        Column('ClassFullName', paths=['ClassRef/FullName']),
+        Column('IsManuallyClosed', BOOLEAN),
+        Column('IsFullyReceived', BOOLEAN),
+    ] + COMMON_COLUMNS,
+}
+
+
+def get_columns(query_type):
+    try:
+        return COLUMNS[query_type]
+    except KeyError:
+        raise QuickBooksError('No columns defined for {}'.format(query_type))
+
+
+def convert_value(kind, text):
+    'python value of the text for a column kind, None when missing'
+    if text is None or text == '':
+        return None
+    if kind == NUMBER:
+        return float(text)
+    if kind == INTEGER:
+        return int(text)
+    if kind == BOOLEAN:
+        return text == 'true'
+    if kind == DATETIME:
+        return parse_time_modified(text)
+    return text
+
+
+def require(module, name):
+    if module is None:
+        raise QuickBooksError('Columnar export requires {}'.format(name))
+
+
+class ColumnBatch(object):
+    """
+    Columns of a batch of entities.  columns are NumPy arrays by name, integer and
+    boolean columns can't hold missing values so masks has a boolean array of the
+    missing rows for them.  Datetimes are UTC.
+    """
+    def __init__(self, columns, values):
+        require(numpy, 'numpy')
+        self.specs = columns
+        self.size = len(values[0]) if values else 0
+        self.columns = OrderedDict()
+        self.masks = OrderedDict()
+        for column, column_values in zip(columns, values):
+            self.columns[column.name] = self.to_array(column, column_values)
+
+    def to_array(self, column, values):
+        kind = column.kind
+        if kind == NUMBER:
+            return numpy.array([numpy.nan if i is None else i for i in values], dtype='float64')
+        if kind in (INTEGER, BOOLEAN):
+            self.masks[column.name] = numpy.array([i is None for i in values], dtype=bool)
+            dtype = 'int64' if kind == INTEGER else bool
+            return numpy.array([i or 0 for i in values], dtype=dtype)
+        if kind == DATETIME:
+            return numpy.array(values, dtype='datetime64[s]')
+        if kind == DATE:
+            return numpy.array(values, dtype='datetime64[D]')
+        return numpy.array(values, dtype=object)
+
+    def __len__(self):
+        return self.size
+
+    def to_arrow(self):
+        'the batch as a pyarrow.RecordBatch'
+        require(pyarrow, 'pyarrow')
+        arrays = list()
+        for column in self.specs:
+            values = self.columns[column.name]
+            mask = self.masks.get(column.name)
+            if column.kind == TEXT:
+                arrays.append(pyarrow.array(list(values), type=pyarrow.string()))
+            elif mask is not None:
+                arrays.append(pyarrow.array(values, mask=mask, type=arrow_type(column.kind)))
+            else:
+                # NaN and NaT become nulls
+                arrays.append(pyarrow.array(values, type=arrow_type(column.kind), from_pandas=True))
+        return pyarrow.RecordBatch.from_arrays(arrays, [column.name for column in self.specs])
+
+
+def arrow_type(kind):
+    return {
+        TEXT: pyarrow.string(),
+        NUMBER: pyarrow.float64(),
+        INTEGER: pyarrow.int64(),
+        BOOLEAN: pyarrow.bool_(),
+        DATETIME: pyarrow.timestamp('s'),
+        DATE: pyarrow.date32(),
+    }[kind]
+
+
+def arrow_schema(query_type):
+    require(pyarrow, 'pyarrow')
+    return pyarrow.schema([pyarrow.field(i.name, arrow_type(i.kind)) for i in get_columns(query_type)])
+
+
+def column_batches(query_type, entities, batch_size=10000):
+    'yields a ColumnBatch for every batch_size entities, only one batch of rows is held at a time'
+    require(numpy, 'numpy')
+    columns = get_columns(query_type)
+    values = [list() for _ in columns]
+    for entity in entities:
+        for column, column_values in zip(columns, values):
+            column_values.append(convert_value(column.kind, column.value(entity)))
+        if len(values[0]) >= batch_size:
+            yield ColumnBatch(columns, values)
+            values = [list() for _ in columns]
+    if values[0]:
+        yield ColumnBatch(columns, values)
+
+
+def write_parquet(path, query_type, entities, batch_size=10000, compression='snappy'):
+    'write the entities to a Parquet file with a row group per batch, returns the number of rows'
+    schema = arrow_schema(query_type)
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression=compression) as writer:
+        for batch in column_batches(query_type, entities, batch_size):
+            writer.write_table(pyarrow.Table.from_batches([batch.to_arrow()], schema=schema))
+            rows += len(batch)
+    return rows
+
+
+def write_arrow(path, query_type, entities, batch_size=10000):
+    'write the entities to an Arrow IPC file readers can memory-map, returns the number of rows'
+    schema = arrow_schema(query_type)
+    rows = 0
+    with pyarrow.OSFile(path, 'wb') as sink:
+        writer = pyarrow.ipc.RecordBatchFileWriter(sink, schema)
+        try:
+            for batch in column_batches(query_type, entities, batch_size):
+                writer.write_batch(batch.to_arrow())
+                rows += len(batch)
+        finally:
+            writer.close()
+    return rows
+
+
+WRITERS = {
+    'parquet': write_parquet,
+    'arrow': write_arrow,
+}
+
+
+def export(path, query_type, entities, file_format='parquet', batch_size=10000):
+    try:
+        writer = WRITERS[file_format]
+    except KeyError:
+        raise QuickBooksError('Unknown columnar format {}'.format(file_format))
+    return writer(path, query_type, entities, batch_size=batch_size)
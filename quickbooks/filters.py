@@ -0,0 +1,189 @@
+# coding=utf-8
+"""
+Push the predicates of a query down into qbxml filter elements
+
+The query adapters take predicates on the entities they return: the entity (vendor
+or payee), account and class, given as ListIDs or full names, and a status (open or
+closed purchase orders, active or inactive items).  QueryFilters sends the ones the
+request type has a filter element for to QuickBooks (pushed) and checks the rest
+against every response element (post filters):
+
+  * CheckQueryRq and PurchaseOrderQueryRq have EntityFilter and AccountFilter
+  * ItemQueryRq has ActiveStatus
+  * none of them filters by class or purchase orders by status
+
+Lookups by id or name can't be combined with filter elements so all of their
+predicates are post filters.  QueryFilters counts the elements QuickBooks returned
+and how many each post filter dropped, how many a pushed filter saved only
+QuickBooks knows.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from .exceptions import QuickBooksError
+
+
+# predicate -> (ListID param, FullName param) of the query adapters
+REF_PREDICATES = OrderedDict([
+    ('entity', ('entity_list_ids', 'entity_names')),
+    ('account', ('account_list_ids', 'account_names')),
+    ('class', ('class_list_ids', 'class_names')),
+])
+
+# filter elements of the request types by predicate
+NATIVE_FILTERS = {
+    'CheckQueryRq': {'entity': 'EntityFilter', 'account': 'AccountFilter'},
+    'PurchaseOrderQueryRq': {'entity': 'EntityFilter', 'account': 'AccountFilter'},
+    'ItemQueryRq': {'status': 'ActiveStatus'},
+}
+
+# reference of the response elements a post filter checks
+REF_FIELDS = {
+    ('CheckQueryRq', 'entity'): 'PayeeEntityRef',
+    ('CheckQueryRq', 'account'): 'AccountRef',
+    ('PurchaseOrderQueryRq', 'entity'): 'VendorRef',
+    ('PurchaseOrderQueryRq', 'class'): 'ClassRef',
+    ('ItemQueryRq', 'class'): 'ClassRef',
+}
+
+
+def is_open_purchase_order(element):
+    return element.get('IsManuallyClosed') != 'true' and element.get('IsFullyReceived') != 'true'
+
+
+def is_closed_purchase_order(element):
+    return not is_open_purchase_order(element)
+
+
+def is_active(element):
+    return element.get('IsActive') != 'false'
+
+
+def is_inactive(element):
+    return element.get('IsActive') == 'false'
+
+
+def any_status(element):
+    return True
+
+
+# status -> (filter element value, post filter) by request type, None without a filter
+# element.  Post filters are module level so request objects pickle for the ParsePool
+STATUSES = {
+    'ItemQueryRq': {
+        'active': ('ActiveOnly', is_active),
+        'inactive': ('InactiveOnly', is_inactive),
+        'all': ('All', any_status),
+    },
+    'PurchaseOrderQueryRq': {
+        'open': (None, is_open_purchase_order),
+        'closed': (None, is_closed_purchase_order),
+    },
+}
+
+
+def ref_values(list_ids, names):
+    """
+    (key, values) of a reference predicate.  ListIDs are preferred when both are
+    given, QuickBooks only takes one or the other.  None without any values
+    """
+    if list_ids:
+        return 'ListID', list(list_ids)
+    if names:
+        return 'FullName', list(names)
+    return None
+
+
+class RefMatcher(object):
+    'post filter of a reference predicate, whether the field of an element references one of values'
+    def __init__(self, field, key, values):
+        self.field = field
+        self.key = key
+        self.values = frozenset(values)
+
+    def __call__(self, element):
+        return (element.get(self.field) or dict()).get(self.key) in self.values
+
+
+class QueryFilters(object):
+    """
+    The predicates of a query of request_type given in params, pushed holds the
+    (filter element, value) of every pushed predicate, post the check of every other
+    one.  lookup is set for queries by id or name.
+
+    Example usage:
+
+        filters = QueryFilters('PurchaseOrderQueryRq', {'class_names': ['Gifting'], 'entity_names': ['Acme']})
+        filters.pushed  # {'entity': ('EntityFilter', {'FullName': ['Acme']})}
+        purchase_orders = list(filters.filter(response_elements))
+        filters.returned, filters.dropped  # 47, {'class': 21}
+    """
+    def __init__(self, request_type, params, lookup=False):
+        self.request_type = request_type
+        self.lookup = lookup
+        self.native = dict() if lookup else NATIVE_FILTERS.get(request_type, dict())
+        # predicate -> the values it was given
+        self.predicates = OrderedDict()
+        self.pushed = OrderedDict()
+        self.post = OrderedDict()
+        self.returned = 0
+        self.dropped = OrderedDict()
+
+        for predicate, (list_id_param, name_param) in REF_PREDICATES.items():
+            ref = ref_values(params.get(list_id_param), params.get(name_param))
+            if ref is None:
+                continue
+            key, values = ref
+            self.predicates[predicate] = {key: values}
+            field = REF_FIELDS.get((request_type, predicate))
+            self.add(predicate, {key: values}, field and RefMatcher(field, key, values))
+
+        status = params.get('status')
+        if status:
+            try:
+                value, check = STATUSES[request_type][status]
+            except KeyError:
+                raise QuickBooksError('{} has no status {}'.format(request_type, status))
+            self.predicates['status'] = status
+            self.add('status', value, check)
+
+    def add(self, predicate, value, check):
+        element = self.native.get(predicate)
+        if element is not None and value is not None:
+            self.pushed[predicate] = (element, value)
+        elif check is not None:
+            self.post[predicate] = check
+        else:
+            raise QuickBooksError('{}{} can\'t be filtered by {}'.format(
+                self.request_type, ' lookups' if self.lookup else '', predicate
+            ))
+
+    def keep(self, element):
+        'whether the element passes the post filters, counting it'
+        self.returned += 1
+        for predicate, check in self.post.items():
+            if not check(element):
+                self.drop(predicate)
+                return False
+        return True
+
+    def drop(self, predicate):
+        'count an element dropped by the adapter itself e.g. purchase orders without lines'
+        self.dropped[predicate] = self.dropped.get(predicate, 0) + 1
+
+    def filter(self, elements):
+        for element in elements:
+            if self.keep(element):
+                yield element
+
+    @property
+    def kept(self):
+        return self.returned - sum(self.dropped.values())
+
+    def take_counts(self):
+        'the (returned, dropped) counts so far, counting starts over'
+        counts = self.returned, self.dropped
+        self.returned = 0
+        self.dropped = OrderedDict()
+        return counts
@@ -0,0 +1,37 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import json
+
+from .records import json_default
+
+
+def serialized_size(entity):
+    'approximate size of the entity in a task message'
+    return len(json.dumps(entity, default=json_default))
+
+
+def chunk_entities(entities, max_count=None, max_bytes=None, size=serialized_size):
+    """
+    Group entities into chunks of at most max_count entities and max_bytes of
+    serialized entities (a single larger entity is sent on its own) as they are
+    produced.  Yields (sequence, chunk, last) where sequence counts from 0 and last is
+    True for the final chunk only.  There is always a final chunk, it is empty if there
+    were no entities, so the end of the stream is always marked.
+    """
+    sequence = 0
+    chunk = list()
+    chunk_bytes = 0
+    for entity in entities:
+        entity_bytes = size(entity) if max_bytes else 0
+        full = max_count and len(chunk) >= max_count
+        too_big = max_bytes and chunk_bytes + entity_bytes > max_bytes
+        # a chunk is only sent once the next entity shows it isn't the last one
+        if chunk and (full or too_big):
+            yield sequence, chunk, False
+            sequence += 1
+            chunk = list()
+            chunk_bytes = 0
+        chunk.append(entity)
+        chunk_bytes += entity_bytes
+    yield sequence, chunk, True
@@ -0,0 +1,200 @@
+# coding=utf-8
+"""
+Lazy alternative to parse_response for callers that only read a few paths
+
+LazyResponse keeps the raw response and indexes where every *Ret element and each of
+its children start and end in a single regular expression scan.  Nothing is decoded
+until it is accessed: LazyElement.get('ClassRef') parses only the ClassRef element
+of the response text, so dropping a purchase order by its class costs the scan and
+one tiny parse instead of building the whole tree.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import re
+from xml.sax.saxutils import unescape
+
+import six
+
+try:
+    from xml.etree.cElementTree import fromstring
+except ImportError:
+    from xml.etree.ElementTree import fromstring
+
+from .qbxml_serializers import RESPONSE_DEPTH, RESPONSE_ELEMENT_DEPTH, element_to_dict, log_response_status
+
+
+TAG = re.compile(
+    r'<(/?)([A-Za-z_][\w.:-]*)((?:\s+[\w.:-]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*)\s*(/?)>'
+)
+ATTRIBUTE = re.compile(r'([\w.:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+ENTITIES = {'&quot;': '"', '&apos;': "'"}
+
+CHILD_DEPTH = RESPONSE_ELEMENT_DEPTH + 1
+
+MISSING = object()
+
+
+def parse_attributes(text):
+    return OrderedDict(
+        (name, unescape(double if double is not None else single, ENTITIES))
+        for name, double, single in ATTRIBUTE.findall(text)
+    )
+
+
+def decode(source, start, end):
+    'element_to_dict of the element source[start:end]'
+    fragment = source[start:end]
+    if isinstance(fragment, six.text_type):
+        fragment = fragment.encode('utf-8')
+    return element_to_dict(fromstring(fragment))
+
+
+class LazyElement(object):
+    """
+    A *Ret element of a LazyResponse.  get, [] and in decode only the children that
+    are asked for (and remember them), setting a key, to_dict or getting children
+    making up most of the element decodes the whole element which is then used for
+    everything.
+    """
+    __slots__ = ('source', 'start', 'end', 'spans', 'decoded', 'children')
+
+    def __init__(self, source, start, end, spans):
+        self.source = source
+        self.start = start
+        self.end = end
+        # child tag -> [(start, end)] in document order
+        self.spans = spans
+        self.decoded = None
+        self.children = dict()
+
+    def get(self, key, default=None):
+        if self.decoded is not None:
+            return self.decoded.get(key, default)
+        value = self.children.get(key, MISSING)
+        if value is MISSING:
+            spans = self.spans.get(key)
+            if not spans:
+                return default
+            # e.g. the line items of a purchase order, decode it once instead of twice
+            if sum(end - start for start, end in spans) * 2 > self.end - self.start:
+                return self.to_dict().get(key, default)
+            values = [decode(self.source, start, end) for start, end in spans]
+            value = values[0] if len(values) == 1 else values
+            self.children[key] = value
+        return value
+
+    def find(self, path, default=None):
+        'value at a path of element names e.g. ClassRef/FullName'
+        value = self
+        for key in path.split('/'):
+            value = value.get(key, MISSING) if hasattr(value, 'get') else MISSING
+            if value is MISSING:
+                return default
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.to_dict()[key] = value
+
+    def __contains__(self, key):
+        if self.decoded is not None:
+            return key in self.decoded
+        return key in self.spans
+
+    def keys(self):
+        if self.decoded is not None:
+            return list(self.decoded)
+        return list(self.spans)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        'the OrderedDict xmltodict builds for the element'
+        if self.decoded is None:
+            self.decoded = decode(self.source, self.start, self.end)
+            self.children = None
+        return self.decoded
+
+    def __repr__(self):
+        return 'LazyElement({!r})'.format(self.source[self.start:self.end][:80])
+
+
+class LazyResponse(object):
+    """
+    Iterating yields (label, LazyElement) for every *Ret element like ResponseStream,
+    statuses has the attributes of each *Rs element keyed by response type.
+    """
+    def __init__(self, request_type, response):
+        self.request_type = request_type
+        self.source = response
+        self.statuses = OrderedDict()
+        self.elements = list()
+        self._scan()
+
+    def _scan(self):
+        source = self.source
+        elements = self.elements
+        depth = 0
+        start = None
+        spans = None
+        child_start = None
+        for match in TAG.finditer(source):
+            closing, tag, attributes, empty = match.groups()
+            if closing:
+                if depth == RESPONSE_ELEMENT_DEPTH:
+                    elements.append((tag, LazyElement(source, start, match.end(), spans)))
+                elif depth == CHILD_DEPTH:
+                    spans.setdefault(tag, list()).append((child_start, match.end()))
+                depth -= 1
+                continue
+
+            depth += 1
+            if depth == RESPONSE_DEPTH:
+                status = OrderedDict(('@' + key, value) for key, value in parse_attributes(attributes).items())
+                self.statuses[tag] = status
+                log_response_status(self.request_type, status)
+            elif depth == RESPONSE_ELEMENT_DEPTH:
+                start = match.start()
+                spans = OrderedDict()
+            elif depth == CHILD_DEPTH:
+                child_start = match.start()
+
+            if empty:
+                if depth == RESPONSE_ELEMENT_DEPTH:
+                    elements.append((tag, LazyElement(source, start, match.end(), spans)))
+                elif depth == CHILD_DEPTH:
+                    spans.setdefault(tag, list()).append((child_start, match.end()))
+                depth -= 1
+
+    def __iter__(self):
+        return iter(self.elements)
+
+    def __len__(self):
+        return len(self.elements)
+
+    @property
+    def status(self):
+        'Attributes of the first *Rs element'
+        for status in self.statuses.values():
+            return status
+        return dict()
+
+    def first(self, label, default=None):
+        'the first element with the label e.g. PreferencesRet'
+        for element_label, element in self.elements:
+            if element_label == label:
+                return element
+        return default
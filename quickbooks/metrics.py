@@ -0,0 +1,288 @@
+# coding=utf-8
+"""
+Counters and histograms of where the time of the COM client goes
+
+QuickBooks times every stage of a request (format, process_request, parse) and of
+its session (begin, end, close_by_force) into a Metrics registry and counts requests,
+responses by statusCode, bytes sent and received, session opens, query cache hits and
+the response elements the query adapters filter out.  quickbooks.pipeline counts how
+long each of its stages was busy.  Hooks added with
+Metrics.add_hook are called with every timed stage, e.g. to log slow requests.
+
+The registry is exported in the Prometheus text format with write_textfile (for the
+node exporter textfile collector) or serve (a local HTTP endpoint).
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+import six
+from six.moves import BaseHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+# seconds, the last bucket is +Inf
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# metrics recorded by QuickBooks
+STAGE_SECONDS = 'qb_stage_seconds'
+SESSION_SECONDS = 'qb_session_seconds'
+REQUESTS = 'qb_requests_total'
+RESPONSES = 'qb_responses_total'
+REQUEST_BYTES = 'qb_request_bytes_total'
+RESPONSE_BYTES = 'qb_response_bytes_total'
+SESSION_OPENS = 'qb_session_opens_total'
+SESSION_ERRORS = 'qb_session_errors_total'
+CACHE_HITS = 'qb_cache_hits_total'
+CACHE_MISSES = 'qb_cache_misses_total'
+FILTERS_PUSHED = 'qb_filters_pushed_total'
+ELEMENTS_RETURNED = 'qb_elements_returned_total'
+ELEMENTS_DROPPED = 'qb_elements_dropped_total'
+PIPELINE_SECONDS = 'qb_pipeline_seconds_total'
+PIPELINE_BUSY_SECONDS = 'qb_pipeline_busy_seconds_total'
+ARCHIVE_DROPPED = 'qb_archive_dropped_total'
+
+
+def encoded_size(text):
+    'bytes of the qbxml text encoded as UTF-8'
+    if isinstance(text, six.text_type):
+        return len(text.encode('utf-8'))
+    return len(text)
+
+
+def label_key(labels):
+    'hashable, sorted labels'
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, six.text_type(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else six.text_type(value)
+
+
+class Counter(object):
+    'a value per label set that only goes up'
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = dict()
+
+    def inc(self, labels, value=1):
+        key = label_key(labels)
+        self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        for key in sorted(self.values):
+            yield self.name, key, self.values[key]
+
+
+class Histogram(object):
+    'bucketed observations per label set, buckets are upper bounds'
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(float(i) for i in buckets) + (float('inf'),)
+        # label key -> [bucket counts, sum, count]
+        self.values = dict()
+
+    def observe(self, labels, value):
+        key = label_key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][index] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        for key in sorted(self.values):
+            counts, total, count = self.values[key]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', key + (('le', format_value(bound)),), cumulative
+            yield self.name + '_sum', key, total
+            yield self.name + '_count', key, count
+
+
+class Metrics(object):
+    """
+    Registry of counters and histograms.  Metrics are created on first use, hooks are
+    called as hook(name, labels, seconds) for every timer and observe.
+
+    Example usage:
+
+        metrics = Metrics()
+        with metrics.timer('qb_stage_seconds', stage='parse', request_type='ItemQueryRq'):
+            ...
+        metrics.inc('qb_requests_total', request_type='ItemQueryRq')
+        print(metrics.render())
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, clock=time.time):
+        self.buckets = buckets
+        self.clock = clock
+        self.metrics = OrderedDict()
+        self.hooks = list()
+        # the HTTP exporter renders from its own thread
+        self.lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def counter(self, name, documentation=''):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Counter(name, documentation)
+        return metric
+
+    def histogram(self, name, documentation='', buckets=None):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Histogram(name, documentation, buckets or self.buckets)
+        return metric
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counter(name).inc(labels, value)
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self.histogram(name).observe(labels, value)
+        for hook in self.hooks:
+            try:
+                hook(name, labels, value)
+            except Exception as e:
+                logger.error(e)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        'observe the seconds spent in the block, also when it raises'
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(name, self.clock() - start, **labels)
+
+    def render(self):
+        'the registry in the Prometheus text exposition format'
+        lines = list()
+        with self.lock:
+            for metric in self.metrics.values():
+                if metric.documentation:
+                    lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+                lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+                for sample_name, labels, value in metric.samples():
+                    lines.append('{}{} {}'.format(sample_name, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class TimedStream(object):
+    """
+    Iterates over a response stream observing only the time spent parsing it once it
+    is exhausted, then calls callback with the stream.  Other attributes (status,
+    statuses) are the stream's.
+    """
+    def __init__(self, stream, metrics, name, labels, callback=None):
+        self.stream = stream
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.callback = callback
+
+    def __iter__(self):
+        clock = self.metrics.clock
+        iterator = iter(self.stream)
+        elapsed = 0.0
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += clock() - start
+            yield item
+        self.metrics.observe(self.name, elapsed, **self.labels)
+        if self.callback is not None:
+            self.callback(self.stream)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def describe(metrics):
+    'register the metrics recorded by QuickBooks with their help text'
+    metrics.histogram(STAGE_SECONDS, 'Seconds spent per stage of a request by request type')
+    metrics.histogram(SESSION_SECONDS, 'Seconds spent starting and ending QuickBooks sessions')
+    metrics.counter(REQUESTS, 'Requests sent to QuickBooks by request type')
+    metrics.counter(RESPONSES, 'Responses received by response type, statusCode and statusSeverity')
+    metrics.counter(REQUEST_BYTES, 'Bytes of qbxml sent to QuickBooks, UTF-8 encoded')
+    metrics.counter(RESPONSE_BYTES, 'Bytes of qbxml received from QuickBooks, UTF-8 encoded')
+    metrics.counter(SESSION_OPENS, 'QuickBooks sessions started')
+    metrics.counter(SESSION_ERRORS, 'QuickBooks sessions that could not be started')
+    metrics.counter(CACHE_HITS, 'Queries answered by the query cache by request type')
+    metrics.counter(CACHE_MISSES, 'Cacheable queries sent to QuickBooks by request type')
+    metrics.counter(FILTERS_PUSHED, 'Query requests sent with a predicate as a filter element by request type and predicate')
+    metrics.counter(ELEMENTS_RETURNED, 'Response elements QuickBooks returned to the query adapters by request type')
+    metrics.counter(ELEMENTS_DROPPED, 'Response elements dropped by the query adapters by request type and predicate')
+    metrics.counter(PIPELINE_SECONDS, 'Seconds spent running request pipelines')
+    metrics.counter(PIPELINE_BUSY_SECONDS, 'Seconds every stage of the request pipelines was busy by stage')
+    metrics.counter(ARCHIVE_DROPPED, 'Exchanges not archived because the archive buffer was full by request type')
+    return metrics
+
+
+def write_textfile(metrics, path):
+    'write the registry to path, replacing it at once so readers never see half a file'
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as fout:
+        fout.write(metrics.render().encode('utf-8'))
+    if os.name == 'nt' and os.path.exists(path):
+        # os.rename doesn't replace files on windows
+        os.remove(path)
+    os.rename(temporary, path)
+
+
+def serve(metrics, port, host='127.0.0.1'):
+    'serve the registry on http://host:port/metrics from a daemon thread, returns the server'
+    class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-exporter')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,147 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from contextlib import closing
+import json
+import sqlite3
+import time
+
+from .records import json_default
+from .sync_state import LOOKUP_PARAMS
+
+
+# lookup query params and the mirror column holding the matching response field
+LOOKUP_COLUMNS = OrderedDict([
+    ('txn_ids', 'txn_id'),
+    ('list_ids', 'list_id'),
+    ('ref_numbers', 'ref_number'),
+    ('full_names', 'full_name'),
+])
+
+# query params selecting which entities are returned rather than what they contain
+SELECTION_PARAMS = LOOKUP_PARAMS + ('initial', 'days', 'start_date', 'end_date', 'max_returned')
+
+# sqlite allows 999 parameters per statement
+MAX_LOOKUP_VALUES = 500
+
+
+def query_variant(query_params):
+    """
+    the query params that change the contents of the returned entities e.g.
+    include_line_items.  Entities are only served to queries of the same variant.
+    """
+    params = dict((k, v) for k, v in query_params.items() if k not in SELECTION_PARAMS)
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def lookup_filter(query_params):
+    'the (param, values) of a lookup by id or name, (None, None) for other queries'
+    for param in LOOKUP_COLUMNS:
+        if query_params.get(param):
+            return param, list(query_params[param])
+    return None, None
+
+
+class EntityMirror(object):
+    """
+    Local sqlite copy of query results so lookups by id or name can be answered without
+    a round trip to QuickBooks.
+
+    Every entity returned by QuickBooks.quickbooks_query is stored with the time it was
+    synced and entities synced less than max_age seconds ago (or at any time with a
+    max_age of None) answer later txn_ids, list_ids, ref_numbers and full_names lookups.
+    Values without a fresh entity are still sent to QuickBooks.  A RefNumber shared by
+    several entities is answered with the ones in the mirror.
+
+    Example usage:
+
+        qb = QuickBooks(mirror=EntityMirror('qb_mirror.sqlite3', max_age=300), **QB_LOOKUP)
+        qb.quickbooks_query('item', {'initial': True})  # fills the mirror
+        qb.quickbooks_query('item', {'list_ids': ['80003A41-1474655232']})  # no request
+    """
+    def __init__(self, path, max_age=300, clock=time.time):
+        self.path = path
+        self.max_age = max_age
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        with closing(self.connect()) as connection, connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entities ('
+                'query_type TEXT, variant TEXT, entity_id TEXT, list_id TEXT, txn_id TEXT, '
+                'ref_number TEXT, full_name TEXT, time_modified TEXT, synced_at REAL, body TEXT, '
+                'PRIMARY KEY (query_type, variant, entity_id))'
+            )
+            for column in list(LOOKUP_COLUMNS.values()) + ['time_modified']:
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS entities_{0} ON entities (query_type, variant, {0})'.format(column)
+                )
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def store(self, query_type, query_params, entities):
+        'insert or replace the entities returned for the query'
+        variant = query_variant(query_params)
+        synced_at = self.clock()
+        rows = list()
+        for entity in entities:
+            entity_id = entity.get('ListID') or entity.get('TxnID')
+            if not entity_id:
+                continue
+            rows.append((
+                query_type, variant, entity_id, entity.get('ListID'), entity.get('TxnID'),
+                entity.get('RefNumber'), entity.get('FullName'), entity.get('TimeModified'),
+                synced_at, json.dumps(entity, default=json_default),
+            ))
+        with closing(self.connect()) as connection, connection:
+            connection.executemany('INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def feed(self, query_type, query_params, entities, chunk_size=500):
+        'generator storing entities as they pass through in chunks of chunk_size'
+        chunk = list()
+        for entity in entities:
+            chunk.append(entity)
+            if len(chunk) >= chunk_size:
+                self.store(query_type, query_params, chunk)
+                chunk = list()
+            yield entity
+        if chunk:
+            self.store(query_type, query_params, chunk)
+
+    def lookup(self, query_type, query_params):
+        """
+        fresh entities for a lookup query and the lookup values none were found for,
+        returns (entities, missing values)
+        """
+        param, values = lookup_filter(query_params)
+        column = LOOKUP_COLUMNS[param]
+        oldest = self.clock() - self.max_age if self.max_age is not None else None
+        entities = list()
+        found = set()
+        with closing(self.connect()) as connection:
+            for start in range(0, len(values), MAX_LOOKUP_VALUES):
+                chunk = values[start:start + MAX_LOOKUP_VALUES]
+                sql = 'SELECT {0}, body FROM entities WHERE query_type = ? AND variant = ? AND {0} IN ({1})'.format(
+                    column, ', '.join('?' * len(chunk))
+                )
+                arguments = [query_type, query_variant(query_params)] + chunk
+                if oldest is not None:
+                    sql += ' AND synced_at >= ?'
+                    arguments.append(oldest)
+                for value, body in connection.execute(sql, arguments):
+                    found.add(value)
+                    entities.append(json.loads(body, object_pairs_hook=OrderedDict))
+        missing = [i for i in values if i not in found]
+        self.hits += len(values) - len(missing)
+        self.misses += len(missing)
+        return entities, missing
+
+    def clear(self, query_type=None):
+        with closing(self.connect()) as connection, connection:
+            if query_type is None:
+                connection.execute('DELETE FROM entities')
+            else:
+                connection.execute('DELETE FROM entities WHERE query_type = ?', (query_type,))
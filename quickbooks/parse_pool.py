@@ -0,0 +1,168 @@
+# coding=utf-8
+"""
+Parse responses in other processes while the COM session sends the next request
+
+The worker runs with --pool=solo so the COM call, parsing and post processing of a
+task all run on one core.  ParsePool hands responses of at least threshold characters
+to a concurrent.futures process pool and returns a Future right away, smaller ones are
+parsed inline and returned as a finished Future so callers don't have to tell them apart.
+
+Multi request envelopes are split into their *Rs elements with a cheap string scan so
+every response of a batch is parsed separately.  The status attributes are read and
+logged by the scan in this process, the pool only parses (with cElementTree into the
+structure xmltodict builds, see element_to_dict) and runs the adapter.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import re
+
+from concurrent.futures import Future, ProcessPoolExecutor
+import six
+
+try:
+    from xml.etree.cElementTree import fromstring
+except ImportError:
+    from xml.etree.ElementTree import fromstring
+
+from .lazy_response import parse_attributes
+from .qbxml_serializers import element_to_dict, log_response_status, parse_response
+
+
+# opening tag of a *Rs element inside QBXMLMsgsRs, nothing else ends in Rs
+RESPONSE_TAG = re.compile(
+    r'<(?!QBXMLMsgsRs)(\w+Rs)((?:\s+[\w.:-]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*)\s*(/?)>'
+)
+
+# responses smaller than this are parsed inline, sending them to a process costs more
+DEFAULT_THRESHOLD = 256 * 1024
+
+
+def split_response(response):
+    """
+    list of (response_type, status, section) for every *Rs element of the response,
+    status holds its attributes keyed like xmltodict e.g. @requestID
+    """
+    sections = list()
+    position = 0
+    while True:
+        match = RESPONSE_TAG.search(response, position)
+        if match is None:
+            return sections
+        response_type, attributes, empty = match.groups()
+        if empty:
+            end = match.end()
+        else:
+            closing = '</{}>'.format(response_type)
+            end = response.index(closing, match.end()) + len(closing)
+        status = OrderedDict(('@' + key, value) for key, value in parse_attributes(attributes).items())
+        sections.append((response_type, status, response[match.start():end]))
+        position = end
+
+
+def response_status(response):
+    'attributes of the first *Rs element e.g. @iteratorID without parsing the response'
+    match = RESPONSE_TAG.search(response)
+    if match is None:
+        return OrderedDict()
+    return OrderedDict(('@' + key, value) for key, value in parse_attributes(match.group(2)).items())
+
+
+def parse_section(response_type, status, section):
+    """
+    the parse_response body of a single *Rs element, status keeps its attributes in
+    document order which ElementTree does not
+    """
+    if isinstance(section, six.text_type):
+        section = section.encode('utf-8')
+    contents = OrderedDict(status)
+    for key, value in (element_to_dict(fromstring(section)) or dict()).items():
+        if not key.startswith('@'):
+            contents[key] = value
+    return OrderedDict([(six.text_type(response_type), contents)])
+
+
+def parse_query_section(request_object, response_type, status, section):
+    """
+    response elements of a query response as QuickBooks.quickbooks_query returns them
+    and the (returned, dropped) counts of the request object's filters
+    """
+    elements = list(request_object.get_response_elements(parse_section(response_type, status, section)))
+    return elements, request_object.filters.take_counts()
+
+
+def resolved(value):
+    'a finished Future of value'
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def finished(function, *args):
+    'a Future of function(*args) run right away'
+    try:
+        return resolved(function(*args))
+    except Exception as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+
+class ParsePool(object):
+    """
+    Parses responses of at least threshold characters in a pool of the given number of
+    processes, with processes=0 everything is parsed inline.  The pool is started on
+    first use.
+
+    Example usage:
+
+        parser = ParsePool(processes=3)
+        futures = parser.parse_batch(response)  # requestID -> Future
+        ...  # send the next request
+        responses = [future.result() for future in futures.values()]
+    """
+    def __init__(self, processes=0, threshold=DEFAULT_THRESHOLD):
+        self.processes = processes
+        self.threshold = threshold
+        self.executor = None
+
+    def submit(self, size, function, *args):
+        if not self.processes or size < self.threshold:
+            return finished(function, *args)
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.processes)
+        return self.executor.submit(function, *args)
+
+    def parse(self, request_type, response):
+        'Future of the parse_response output for the response to a single request'
+        sections = split_response(response)
+        if len(sections) != 1:
+            return finished(parse_response, request_type, response)
+        response_type, status, section = sections[0]
+        log_response_status(request_type, status)
+        return self.submit(len(section), parse_section, response_type, status, section)
+
+    def parse_batch(self, response):
+        'OrderedDict of requestID to a Future of the parse_batch_response entry'
+        futures = OrderedDict()
+        for response_type, status, section in split_response(response):
+            log_response_status(response_type, status)
+            futures[status.get('@requestID')] = self.submit(len(section), parse_section, response_type, status, section)
+        return futures
+
+    def parse_query(self, request_object, response):
+        """
+        Future of the list of response elements of a query response and the counts of
+        its filters, the QuickBooksQueryRequest is pickled along with the response
+        """
+        sections = split_response(response)
+        if not sections:
+            return resolved((list(), request_object.filters.take_counts()))
+        response_type, status, section = sections[0]
+        log_response_status(request_object.request_type, status)
+        return self.submit(len(section), parse_query_section, request_object, response_type, status, section)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,201 @@
+# coding=utf-8
+"""
+Overlap the stages of sending many requests
+
+Sending a list of requests one after the other leaves QuickBooks idle while python
+formats the next request and parses and hands off the last response.  Pipeline runs
+every item through a list of stages with one thread per stage and bounded queues in
+between, so while the COM stage waits for QuickBooks to process request N the
+stage before it formats request N+1 and the one after it parses response N-1.
+
+The COM stage (inline) runs on the thread calling Pipeline.run, the thread that
+began the QuickBooks session.  Every stage handles the items one at a time in order
+so the results come out in the order of the items.  An item a stage raised an
+Exception for is passed to on_error and skipped by the stages after it.
+
+Results are handed to on_result on the calling thread as well, between the items
+of the inline stage, for work that must not leave that thread like sending celery
+tasks or more requests.  The inline stage can wait for the results of every item
+before the current one with flush.
+
+Every stage counts the seconds it was busy, busy seconds over the run time is its
+utilization: the stage close to 1 is the bottleneck, the others wait for it.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import threading
+import time
+
+from six.moves import queue
+
+from .metrics import PIPELINE_BUSY_SECONDS, PIPELINE_SECONDS
+
+
+# items waiting between two stages
+DEFAULT_QUEUE_SIZE = 4
+
+# seconds between checks whether the run was stopped while waiting on a queue
+POLL_SECONDS = 0.1
+
+DONE = object()
+
+
+class Pipeline(object):
+    """
+    stages is a list of (name, function), every function is called with the result
+    of the stage before, the first with the item.  The stage named inline runs on the
+    calling thread, the others on a thread of their own.  Results of items that
+    failed are None.  on_result(result) of run is called on the calling thread for
+    every result in order.
+
+    Example usage:
+
+        pipeline = Pipeline([
+            ('format', format_request), ('process_request', process_request), ('parse', parse),
+        ], inline='process_request')
+        responses = pipeline.run(requests)
+        pipeline.utilization()  # {'format': 0.05, 'process_request': 0.93, 'parse': 0.4}
+    """
+    def __init__(self, stages, inline=None, queue_size=DEFAULT_QUEUE_SIZE, on_error=None, metrics=None, clock=time.time):
+        self.stages = list(stages)
+        self.inline = inline
+        self.queue_size = queue_size
+        self.on_error = on_error
+        self.metrics = metrics
+        self.clock = clock
+        # seconds every stage was busy and the run took, of the last run
+        self.busy = OrderedDict((name, 0.0) for name, _ in self.stages)
+        self.elapsed = 0.0
+        self.stopped = threading.Event()
+        # of the current run: the results delivered, how many items the inline stage
+        # handed on and where the results come out
+        self.results = list()
+        self.handed_on = 0
+        self.on_result = None
+        self.outbox = None
+
+    def run(self, items, on_result=None):
+        'the result of the last stage for every item in order'
+        self.stopped.clear()
+        self.busy = OrderedDict((name, 0.0) for name, _ in self.stages)
+        queues = [queue.Queue(self.queue_size) for _ in self.stages[1:]]
+        queues.append(queue.Queue())
+        inboxes = [None] + queues[:-1]
+        inline = None
+        threads = list()
+        self.results = list()
+        self.handed_on = 0
+        self.on_result = on_result
+        self.outbox = queues[-1]
+        start = self.clock()
+        try:
+            for index, stage in enumerate(self.stages):
+                source = self.receive(inboxes[index]) if index else self.entries(items)
+                name, _ = stage
+                if name == self.inline:
+                    inline = (stage, source, queues[index])
+                    continue
+                thread = threading.Thread(
+                    target=self.run_stage, args=(stage, source, queues[index]), name='pipeline-{}'.format(name)
+                )
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            if inline is not None:
+                self.run_stage(*inline, after=self.handed_over)
+            for entry in self.receive(queues[-1]):
+                self.deliver(entry)
+            for thread in threads:
+                thread.join()
+            return self.results
+        finally:
+            # the inline stage raised or was interrupted, e.g. by a time limit
+            self.stopped.set()
+            self.elapsed = self.clock() - start
+            self.record()
+
+    def entries(self, items):
+        for item in items:
+            yield item, False
+
+    def receive(self, inbox):
+        while not self.stopped.is_set():
+            try:
+                entry = inbox.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if entry is DONE:
+                return
+            yield entry
+
+    def send(self, outbox, entry):
+        while not self.stopped.is_set():
+            try:
+                outbox.put(entry, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def handed_over(self):
+        'after every item of the inline stage: deliver the results that are ready'
+        self.handed_on += 1
+        while True:
+            try:
+                entry = self.outbox.get_nowait()
+            except queue.Empty:
+                return
+            self.deliver(entry)
+
+    def flush(self):
+        'called by the inline stage, deliver the results of every item it handed on'
+        while len(self.results) < self.handed_on and not self.stopped.is_set():
+            try:
+                entry = self.outbox.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            self.deliver(entry)
+
+    def deliver(self, entry):
+        value, failed = entry
+        result = None if failed else value
+        self.results.append(result)
+        if self.on_result is not None:
+            try:
+                self.on_result(result)
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error('result', e)
+
+    def run_stage(self, stage, source, outbox, after=None):
+        name, function = stage
+        try:
+            for value, failed in source:
+                if not failed:
+                    start = self.clock()
+                    try:
+                        value = function(value)
+                    except Exception as e:
+                        failed = True
+                        if self.on_error is not None:
+                            self.on_error(name, e)
+                    finally:
+                        self.busy[name] += self.clock() - start
+                self.send(outbox, (value, failed))
+                if after is not None:
+                    after()
+        finally:
+            self.send(outbox, DONE)
+
+    def utilization(self):
+        'busy seconds over the run time of every stage in the last run'
+        return OrderedDict(
+            (name, busy / self.elapsed if self.elapsed else 0.0) for name, busy in self.busy.items()
+        )
+
+    def record(self):
+        if self.metrics is None:
+            return
+        self.metrics.inc(PIPELINE_SECONDS, self.elapsed)
+        for name, busy in self.busy.items():
+            self.metrics.inc(PIPELINE_BUSY_SECONDS, busy, stage=name)
@@ -0,0 +1,97 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import csv
+import ctypes
+import os
+
+import six
+
+try:
+    from pythoncom import CoInitialize
+    from pywintypes import com_error
+    from win32com.client import Dispatch
+    from win32com.client.makepy import GenerateFromTypeLibSpec
+except ImportError:
+    # not running on windows, only the simulated request processor is available
+    Dispatch = None
+else:
+    # After running the following command, you can check the generated type library
+    # for a list of dispatchable classes and their associated methods.
+    # The generated type library should be in site-packages/win32com/gen_py/
+    # e.g. /Python27/Lib/site-packages/win32com/gen_py/
+    GenerateFromTypeLibSpec('QBXMLRP2 1.0 Type Library')
+
+from .exceptions import QuickBooksError
+
+
+# values of the QBXMLRP2 type library constants localQBD and qbFileOpenDoNotCare
+LOCAL_QBD = 1
+QB_FILE_OPEN_DO_NOT_CARE = 2
+
+
+class COMBackend(object):
+    'QBXMLRP2.RequestProcessor through the QuickBooks SDK COM interface'
+
+    def __init__(self):
+        self.errors = (com_error,) if Dispatch is not None else ()
+
+    def initialize(self):
+        if Dispatch is None:
+            raise QuickBooksError('The COM request processor requires pywin32 and the QuickBooks SDK')
+        CoInitialize()
+
+    def dispatch(self):
+        return Dispatch('QBXMLRP2.RequestProcessor')
+
+    def close_by_force(self, service_user):
+        rows = os.popen('tasklist /V /FO CSV').readlines()
+        pids = [i for i in csv.DictReader(rows)]
+
+        for i in pids:
+            user_name = i['User Name'] if i['User Name'] else ''
+            if user_name.endswith(service_user) and i['Image Name'] in ['qbupdate.exe', 'QBW32.EXE']:
+                # Kill the process using pywin32
+                PROCESS_TERMINATE = 1
+                handle = ctypes.windll.kernel32.OpenProcess(PROCESS_TERMINATE, False, int(i['PID']))
+                ctypes.windll.kernel32.TerminateProcess(handle, -1)
+                ctypes.windll.kernel32.CloseHandle(handle)
+
+
+class SimulatorBackend(object):
+    """
+    quickbooks.simulator.RequestProcessorSimulator instead of QuickBooks, options are
+    passed to the simulator e.g. fixture_dir, latency and byte_cost
+    """
+    def __init__(self, **options):
+        from .simulator import RequestProcessorSimulator, SimulatorError
+
+        self.options = options
+        self.simulator_class = RequestProcessorSimulator
+        self.errors = (SimulatorError,)
+
+    def initialize(self):
+        pass
+
+    def dispatch(self):
+        return self.simulator_class(**self.options)
+
+    def close_by_force(self, service_user):
+        pass
+
+
+BACKENDS = {
+    'com': COMBackend,
+    'simulator': SimulatorBackend,
+}
+
+
+def get_backend(backend='com', **options):
+    'backend instance by name, backend instances are returned as they are'
+    if not isinstance(backend, six.string_types):
+        return backend
+    try:
+        backend_class = BACKENDS[backend]
+    except KeyError:
+        raise QuickBooksError('Unknown request processor backend {}'.format(backend))
+    return backend_class(**options)
@@ -1,34 +1,46 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
-from collections import OrderedDict
-import csv
-import ctypes
+from collections import OrderedDict, deque
 import datetime
 from itertools import chain
-import os
 import uuid
 
-from pythoncom import CoInitialize
-from pywintypes import com_error
-import win32api
-from win32com.client import Dispatch, constants
-from win32com.client.makepy import GenerateFromTypeLibSpec
-
+from constants import STOP_ON_ERROR
+from .coalescing import is_failed, is_query
 from .exceptions import AdapterNotFound, QuickBooksError
-from .qbxml_serializers import format_request, parse_response
+from .lazy_response import LazyResponse
+from .metrics import (
+    ARCHIVE_DROPPED,
+    CACHE_HITS,
+    CACHE_MISSES,
+    ELEMENTS_DROPPED,
+    ELEMENTS_RETURNED,
+    FILTERS_PUSHED,
+    REQUEST_BYTES,
+    REQUESTS,
+    RESPONSE_BYTES,
+    RESPONSES,
+    SESSION_ERRORS,
+    SESSION_OPENS,
+    SESSION_SECONDS,
+    STAGE_SECONDS,
+    Metrics,
+    TimedStream,
+    describe,
+    encoded_size,
+)
+from .mirror import lookup_filter
+from .parse_pool import ParsePool, resolved, response_status
+from .processors import LOCAL_QBD, QB_FILE_OPEN_DO_NOT_CARE, get_backend
+from .qbxml_serializers import format_envelope, iter_parse_response, parse_batch_response, parse_response
+from .qbxml_templates import format_request, format_request_section, register_template
 from .qbxml_request_formatter import (
     CheckQueryRequest,
     ItemQueryRequest,
     PurchaseOrderQueryRequest
 )
-
-
-# After running the following command, you can check the generated type library
-# for a list of dispatchable classes and their associated methods.
-# The generated type library should be in site-packages/win32com/gen_py/
-# e.g. /Python27/Lib/site-packages/win32com/gen_py/
-GenerateFromTypeLibSpec('QBXMLRP2 1.0 Type Library')
+from .records import element_to_record, to_dict
 
 
 def save_request_xml(request_type, request):
@@ -38,96 +50,507 @@ def save_request_xml(request_type, request):
         fout.write(request)
 
 
+QUERY_ADAPTERS = {
+    'check': CheckQueryRequest,
+    'item': ItemQueryRequest,
+    'purchase_order': PurchaseOrderQueryRequest,
+}
+
+
 def get_request_formatter(request_type, query_params):
-    adapters = {
-        'check': CheckQueryRequest,
-        'item': ItemQueryRequest,
-        'purchase_order': PurchaseOrderQueryRequest,
-    }
     try:
-        return adapters[request_type](**query_params)
+        return QUERY_ADAPTERS[request_type](**query_params)
     except KeyError:
         raise AdapterNotFound(
             "Adapter for {0} not found.".format(request_type)
         )
 
 
+def preload_query_templates():
+    """
+    compile the request templates for every shape the query adapters produce so the
+    first request of each kind doesn't pay for it
+    """
+    today = datetime.date.today()
+    example_params = [
+        {'initial': True},
+        {'days': 30},
+        {'start_date': today, 'end_date': today},
+        {'txn_ids': ['']},
+        {'ref_numbers': ['']},
+        {'list_ids': ['']},
+        {'full_names': ['']},
+    ]
+    for adapter in QUERY_ADAPTERS.values():
+        for query_params in example_params:
+            request_object = adapter(**query_params)
+            register_template(request_object.request_type, request_object.request_dictionary)
+
+
+def pack_batches(sections, max_batch_size=None, max_batch_bytes=None):
+    """
+    Group formatted (request_id, section) tuples into lists that are sent together in
+    one envelope.  A batch holds at most max_batch_size requests and max_batch_bytes
+    characters of request sections, a single larger request is sent on its own.
+    """
+    batch = list()
+    batch_bytes = 0
+    for request_id, section in sections:
+        full = max_batch_size and len(batch) >= max_batch_size
+        too_big = max_batch_bytes and batch_bytes + len(section) > max_batch_bytes
+        if batch and (full or too_big):
+            yield batch
+            batch = list()
+            batch_bytes = 0
+        batch.append((request_id, section))
+        batch_bytes += len(section)
+    if batch:
+        yield batch
+
+
 class QuickBooks(object):
-    'Wrapper for the QuickBooks RequestProcessor COM interface'
+    """
+    Wrapper for the QuickBooks RequestProcessor COM interface
+
+    backend picks the request processor, 'com' for QuickBooks itself or 'simulator'
+    for quickbooks.simulator.RequestProcessorSimulator configured by backend_options
+
+    with a quickbooks.mirror.EntityMirror query results are kept locally and lookups
+    by id or name are answered from it while its entities are fresh
+
+    with records=True streamed responses build quickbooks.records classes instead of
+    OrderedDicts, convert them with to_dict before handing them off
+
+    with lazy=True queries of adapters with lazy_response set return a
+    quickbooks.lazy_response.LazyResponse, worth it when most elements are dropped
+    after reading a few fields
+
+    parser is a quickbooks.parse_pool.ParsePool parsing the responses of call_async,
+    call_batch_async and paged queries while the next request is sent, inline by default
+
+    every request and session stage is timed into metrics, a quickbooks.metrics.Metrics
+    registry, see quickbooks.metrics for what is recorded
+
+    with a quickbooks.cache.QueryCache results of call and quickbooks_query (without a
+    page_size) are answered from it for the TTL of their request type, every request
+    that is not a query drops the cached results it may have changed
+
+    with a quickbooks.archive.Archive every request and its response are archived and
+    save_xml archives requests that are only formatted instead of writing xml files
+    """
 
-    def __init__(self, application_id='', application_name='Example', company_file_name='', service_user=None, connection_type=constants.localQBD):
+    def __init__(self, application_id='', application_name='Example', company_file_name='', service_user=None, connection_type=LOCAL_QBD, backend='com', backend_options=None, mirror=None, records=False, lazy=False, parser=None, metrics=None, cache=None, archive=None):
         'Connect'
         self.application_id = application_id
         self.application_name = application_name
         self.company_file_name = company_file_name
         self.service_user = service_user
         self.connection_type = connection_type
+        self.backend = get_backend(backend, **(backend_options or {}))
+        self.mirror = mirror
+        self.records = records
+        self.lazy = lazy
+        self.parser = parser or ParsePool()
+        self.metrics = metrics or describe(Metrics())
+        self.cache = cache
+        self.archive = archive
+        self.request_processor = None
+        self.session = None
+        self.closed = False
+        # errors of the request processor, see quickbooks.session.SessionManager
+        self.com_errors = 0
+        # responses with statusSeverity Error, a query that got one may be incomplete
+        self.error_responses = 0
+
+    @property
+    def is_open(self):
+        return self.session is not None
 
     def begin_session(self):
         try:
-            CoInitialize()
-            self.request_processor = Dispatch('QBXMLRP2.RequestProcessor')
-            self.request_processor.OpenConnection2(
-                self.application_id, self.application_name, self.connection_type
-            )
-            self.session = self.request_processor.BeginSession(
-                self.company_file_name, constants.qbFileOpenDoNotCare
-            )
-        except com_error, error:
+            with self.metrics.timer(SESSION_SECONDS, stage='begin'):
+                self.backend.initialize()
+                self.request_processor = self.backend.dispatch()
+                self.request_processor.OpenConnection2(
+                    self.application_id, self.application_name, self.connection_type
+                )
+                self.session = self.request_processor.BeginSession(
+                    self.company_file_name, QB_FILE_OPEN_DO_NOT_CARE
+                )
+        except self.backend.errors as error:
+            self.metrics.inc(SESSION_ERRORS)
             self.close_by_force()
             raise QuickBooksError('Could not start QuickBooks COM interface: %s' % error)
+        self.metrics.inc(SESSION_OPENS)
 
     def __del__(self):
-        'Disconnect'
-        self.end_session()
+        'Disconnect, QuickBooks is only closed by force if this instance has a session'
+        if not self.closed:
+            self.end_session(force=self.is_open)
 
-    def end_session(self):
-        'Disconnect'
+    def end_session(self, force=True):
+        """
+        Disconnect, with force=False QuickBooks is left running after ending the session
+        """
         try:
-            # attempt to do this correctly although it doesn't
-            self.request_processor.EndSession(self.session)
-            self.request_processor.CloseConnection()
+            if self.is_open:
+                with self.metrics.timer(SESSION_SECONDS, stage='end'):
+                    # attempt to do this correctly although it doesn't
+                    self.request_processor.EndSession(self.session)
+                    self.request_processor.CloseConnection()
         finally:
+            self.session = None
+            self.request_processor = None
+            self.closed = True
             # either way, close by force when you are finished
-            self.close_by_force()
+            if force:
+                self.close_by_force()
 
     def close_by_force(self):
-        rows = os.popen('tasklist /V /FO CSV').readlines()
-        pids = [i for i in csv.DictReader(rows)]
-
-        for i in pids:
-            user_name = i['User Name'] if i['User Name'] else ''
-            if user_name.endswith(self.service_user) and i['Image Name'] in ['qbupdate.exe', 'QBW32.EXE']:
-                # Kill the process using pywin32
-                PROCESS_TERMINATE = 1
-                handle = ctypes.windll.kernel32.OpenProcess(PROCESS_TERMINATE, False, int(i['PID']))
-                ctypes.windll.kernel32.TerminateProcess(handle, -1)
-                ctypes.windll.kernel32.CloseHandle(handle)
-
-    def format_request(self, request_type, request_dictionary=None, save_xml=False):
-        request = format_request(request_type, request_dictionary)
-        if save_xml:
+        with self.metrics.timer(SESSION_SECONDS, stage='close_by_force'):
+            self.backend.close_by_force(self.service_user)
+
+    def format_request(self, request_type, request_dictionary=None, save_xml=False, attributes=None):
+        with self.metrics.timer(STAGE_SECONDS, stage='format', request_type=request_type):
+            request = format_request(request_type, request_dictionary, attributes=attributes)
+        if save_xml and self.archive is not None:
+            self.archive.record(request_type, request)
+        elif save_xml:
             save_request_xml(request_type, request)
         return request
 
-    def call(self, request_type, request_dictionary=None, save_xml=False):
-        'Send request and parse response'
-        request = self.format_request(request_type, request_dictionary, save_xml=save_xml)
-        response = self.request_processor.ProcessRequest(self.session, request)
+    def call(self, request_type, request_dictionary=None, save_xml=False, stream=False, attributes=None, lazy=False):
+        """
+        Send request and parse response
+
+        with stream=True the response is parsed incrementally and a ResponseStream of
+        (label, element) tuples is returned instead of the full response dictionary,
+        with lazy=True as well a LazyResponse that only decodes the parts accessed
+
+        parsed responses to queries are answered from the cache when it has them
+        """
+        key = None if stream else self.cache_key('response', request_type, request_dictionary, attributes)
+        if key is not None:
+            response = self.cached(key, request_type)
+            if response is not None:
+                return response
+        response = self.send(request_type, request_dictionary, save_xml=save_xml, attributes=attributes)
+        response = self.read_response(request_type, response, stream=stream, lazy=lazy)
+        if key is not None and not is_failed(response):
+            self.cache.put(key, request_type, response)
+        return response
+
+    def read_response(self, request_type, response, stream=False, lazy=False):
+        'parse the unparsed response to a request like call does'
+        if stream and lazy:
+            with self.metrics.timer(STAGE_SECONDS, stage='parse', request_type=request_type):
+                response = LazyResponse(request_type, response)
+            self.record_statuses(response.statuses)
+            return response
+        if stream:
+            return TimedStream(
+                iter_parse_response(request_type, response, element_to_record if self.records else None),
+                self.metrics, STAGE_SECONDS, {'stage': 'parse', 'request_type': request_type},
+                lambda stream: self.record_statuses(stream.statuses),
+            )
+        with self.metrics.timer(STAGE_SECONDS, stage='parse', request_type=request_type):
+            response = parse_response(request_type, response)
+        self.record_statuses(response)
+        return response
+
+    def call_async(self, request_type, request_dictionary=None, save_xml=False, attributes=None):
+        'Send request and return a Future of the parsed response, parsed by the parser'
+        response = self.send(request_type, request_dictionary, save_xml=save_xml, attributes=attributes)
+        return self.watch(self.parser.parse(request_type, response), request_type)
+
+    def send(self, request_type, request_dictionary=None, save_xml=False, attributes=None):
+        'Send request and return the unparsed response'
+        # process_request archives the exchange
+        save_xml = save_xml and self.archive is None
+        request = self.format_request(
+            request_type, request_dictionary, save_xml=save_xml, attributes=attributes
+        )
+        response = self.process_request(request_type, request)
         if save_xml:
             save_request_xml(request_type, response)
-        return parse_response(request_type, response)
+        return response
+
+    def process_request(self, request_type, request, surrogate_key=None):
+        'ProcessRequest counting and timing the request, surrogate_key is archived with it'
+        self.metrics.inc(REQUESTS, request_type=request_type)
+        self.metrics.inc(REQUEST_BYTES, encoded_size(request), request_type=request_type)
+        response = None
+        start = self.metrics.clock()
+        try:
+            with self.metrics.timer(STAGE_SECONDS, stage='process_request', request_type=request_type):
+                response = self.request_processor.ProcessRequest(self.session, request)
+        except self.backend.errors:
+            self.com_errors += 1
+            raise
+        finally:
+            # a write that failed may still have changed some of the entities
+            if self.cache is not None:
+                self.cache.invalidate_request(request)
+            if self.archive is not None:
+                self.archive_exchange(request_type, request, response, surrogate_key, self.metrics.clock() - start)
+        self.metrics.inc(RESPONSE_BYTES, encoded_size(response), request_type=request_type)
+        return response
+
+    def archive_exchange(self, request_type, request, response, surrogate_key, latency):
+        'hand the exchange to the archive, counting it when the archive buffer was full'
+        if not self.archive.record(request_type, request, response, surrogate_key, round(latency, 6)):
+            self.metrics.inc(ARCHIVE_DROPPED, request_type=request_type)
+
+    def cache_key(self, kind, request_type, request_dictionary=None, attributes=None):
+        'the cache key of a query with a TTL, None if its results are not cached'
+        if self.cache is None or attributes or not is_query(request_type) or not self.cache.ttl(request_type):
+            return None
+        return self.cache.key(kind, request_type, request_dictionary)
 
-    def quickbooks_query(self, query_type, request_args=dict()):
+    def cached(self, key, request_type):
+        'the cached result for key counting the hit or miss, None on a miss'
+        result = self.cache.get(key)
+        self.metrics.inc(CACHE_HITS if result is not None else CACHE_MISSES, request_type=request_type)
+        return result
+
+    def record_statuses(self, responses):
+        'count the responses of a parse_response body or statuses by statusCode'
+        for response_type, contents in responses.items():
+            contents = contents if hasattr(contents, 'get') else dict()
+            if contents.get('@statusSeverity') == 'Error':
+                self.error_responses += 1
+            self.metrics.inc(
+                RESPONSES, response_type=response_type,
+                status_code=contents.get('@statusCode'), severity=contents.get('@statusSeverity'),
+            )
+
+    def watch(self, future, request_type, statuses=True):
+        'record the parse time (from now) and the statuses of a Future of the parser'
+        metrics = self.metrics
+        start = metrics.clock()
+
+        def done(future):
+            metrics.observe(STAGE_SECONDS, metrics.clock() - start, stage='parse', request_type=request_type)
+            if statuses and future.exception() is None and future.result() is not None:
+                self.record_statuses(future.result())
+
+        future.add_done_callback(done)
+        return future
+
+    def format_request_section(self, request_type, request_dictionary=None, request_id=None):
+        'Format a single request of a multi request envelope, see call_batch'
+        attributes = {'requestID': request_id} if request_id is not None else None
+        return format_request_section(request_type, request_dictionary, attributes=attributes)
+
+    def call_batch(self, sections, on_error=STOP_ON_ERROR, save_xml=False):
+        """
+        Send several requests formatted with format_request_section in one envelope and
+        one ProcessRequest call.  sections is a list of (request_id, section), returns a
+        list of the parsed responses in the same order.  With stopOnError QuickBooks skips
+        the requests after the first error, their response is None.
+        """
+        response = self.send_batch(sections, on_error, save_xml)
+        with self.metrics.timer(STAGE_SECONDS, stage='parse', request_type='QBXMLMsgsRq'):
+            responses = parse_batch_response(response)
+        for entry in responses.values():
+            self.record_statuses(entry)
+        return [responses.get(str(request_id)) for request_id, _ in sections]
+
+    def call_batch_async(self, sections, on_error=STOP_ON_ERROR, save_xml=False):
+        """
+        call_batch returning a Future of every parsed response instead, the responses
+        are parsed by the parser
+        """
+        futures = self.parser.parse_batch(self.send_batch(sections, on_error, save_xml))
+        for future in futures.values():
+            self.watch(future, 'QBXMLMsgsRq')
+        return [futures.get(str(request_id)) or resolved(None) for request_id, _ in sections]
+
+    def send_batch(self, sections, on_error=STOP_ON_ERROR, save_xml=False):
+        'Send the sections in one envelope and return the unparsed response'
+        save_xml = save_xml and self.archive is None
+        with self.metrics.timer(STAGE_SECONDS, stage='format', request_type='QBXMLMsgsRq'):
+            request = format_envelope([section for _, section in sections], on_error=on_error)
+        if save_xml:
+            save_request_xml('QBXMLMsgsRq', request)
+        response = self.process_request('QBXMLMsgsRq', request)
+        if save_xml:
+            save_request_xml('QBXMLMsgsRs', response)
+        return response
+
+    def call_many(self, requests, max_batch_size=None, max_batch_bytes=None, on_error=STOP_ON_ERROR):
+        """
+        Send a list of (request_type, request_dictionary) packed into as few envelopes as
+        pack_batches allows, returns the parsed responses in order
+        """
+        sections = (
+            (index, self.format_request_section(request_type, request_dictionary, index))
+            for index, (request_type, request_dictionary) in enumerate(requests)
+        )
+        responses = list()
+        for batch in pack_batches(sections, max_batch_size, max_batch_bytes):
+            responses += self.call_batch(batch, on_error=on_error)
+        return responses
+
+    def quickbooks_query(self, query_type, request_args=dict(), page_size=None):
+        """
+        returns response elements for the query.  With a page_size the results are
+        fetched with a qbxml iterator one page at a time, see quickbooks_query_pages
+        """
+        if self.mirror is not None:
+            return self.mirrored_query(query_type, request_args, page_size)
+        return self.query_quickbooks(query_type, request_args, page_size)
+
+    def mirrored_query(self, query_type, request_args=dict(), page_size=None):
+        """
+        quickbooks_query answering lookups from the mirror where it can, only the ids or
+        names missing from it are queried.  Everything QuickBooks returns is mirrored.
+        """
+        param, values = lookup_filter(request_args)
+        if param is None:
+            results = self.query_quickbooks(query_type, request_args, page_size)
+            return self.mirror.feed(query_type, request_args, results)
+
+        entities, missing = self.mirror.lookup(query_type, request_args)
+        if not missing:
+            return iter(entities)
+        results = self.query_quickbooks(query_type, dict(request_args, **{param: missing}), page_size)
+        return chain(entities, self.mirror.feed(query_type, request_args, results))
+
+    def query_quickbooks(self, query_type, request_args=dict(), page_size=None):
+        if page_size:
+            return chain.from_iterable(
+                self.quickbooks_query_pages(query_type, request_args, page_size)
+            )
         request_object = get_request_formatter(query_type, request_args)
+        # post filters are not part of the request
+        key = self.cache_key(
+            ('elements', request_object.filters.predicates), request_object.request_type, request_object.request_dictionary
+        )
+        if key is not None:
+            elements = self.cached(key, request_object.request_type)
+            if elements is not None:
+                return iter(elements)
+        lazy = self.lazy and request_object.lazy_response and not self.records
         response = self.call(
             request_object.request_type,
             request_dictionary=request_object.request_dictionary,
+            stream=True,
+            lazy=lazy,
         )
-        return request_object.get_response_elements(response)
+        elements = self.filtered(request_object, request_object.get_response_elements(response))
+        if key is None:
+            return elements
+
+        # cached queries are read in full before the first element is returned
+        elements = list(elements)
+        if response.status.get('@statusSeverity') != 'Error':
+            # lazy elements hold on to the whole response
+            self.cache.put(key, request_object.request_type, to_dict(elements) if lazy else elements)
+        return iter(elements)
+
+    def quickbooks_query_pages(self, query_type, request_args=dict(), page_size=500):
+        """
+        Generator yielding a list of response elements for every page of the query.
+        The first request starts a qbxml iterator returning at most page_size elements,
+        following requests continue it until iteratorRemainingCount reaches 0
+        so only a single page is ever held in memory.
+
+        with a parser using processes pages are parsed by it while the next page is
+        requested, see parsed_query_pages
+        """
+        if self.parser.processes and not self.lazy and not self.records:
+            for page in self.parsed_query_pages(query_type, request_args, page_size):
+                yield page
+            return
+
+        request_args = dict(request_args, max_returned=page_size)
+        request_object = get_request_formatter(query_type, request_args)
+        while True:
+            response = self.call(
+                request_object.request_type,
+                request_dictionary=request_object.request_dictionary,
+                attributes=request_object.request_attributes,
+                stream=True,
+                lazy=self.lazy and request_object.lazy_response and not self.records,
+            )
+            yield list(self.filtered(request_object, request_object.get_response_elements(response)))
+
+            # response status is only complete once the page has been consumed
+            status = response.status
+            remaining = status.get('@iteratorRemainingCount')
+            if status.get('@statusSeverity') == 'Error' or not remaining or int(remaining) == 0:
+                break
+            request_object.continue_iterator(status['@iteratorID'])
+
+    def parsed_query_pages(self, query_type, request_args=dict(), page_size=500):
+        """
+        quickbooks_query_pages sending the request for the next page as soon as the
+        iteratorID is read, pages are parsed by the parser meanwhile.  At most one page
+        more than the parser has processes is waiting to be parsed.
+        """
+        request_args = dict(request_args, max_returned=page_size)
+        request_object = get_request_formatter(query_type, request_args)
+        pending = deque()
+        while True:
+            response = self.send(
+                request_object.request_type,
+                request_dictionary=request_object.request_dictionary,
+                attributes=request_object.request_attributes,
+            )
+            pending.append(self.watch(
+                self.parser.parse_query(request_object, response), request_object.request_type, statuses=False
+            ))
+
+            status = response_status(response)
+            self.record_statuses({request_object.response_type: status})
+            remaining = status.get('@iteratorRemainingCount')
+            if status.get('@statusSeverity') == 'Error' or not remaining or int(remaining) == 0:
+                break
+            request_object.continue_iterator(status['@iteratorID'])
+            if len(pending) > self.parser.processes:
+                yield self.parsed_page(request_object, pending.popleft())
+
+        while pending:
+            yield self.parsed_page(request_object, pending.popleft())
+
+    def parsed_page(self, request_object, future):
+        elements, counts = future.result()
+        self.record_filters(request_object.filters, counts)
+        return elements
+
+    def filtered(self, request_object, elements):
+        'the response elements, the counts of the query filters are recorded once all were read'
+        if isinstance(elements, list):
+            self.record_filters(request_object.filters)
+            return elements
+        return self.iter_filtered(request_object, elements)
+
+    def iter_filtered(self, request_object, elements):
+        for element in elements:
+            yield element
+        self.record_filters(request_object.filters)
+
+    def record_filters(self, filters, counts=None):
+        'count the filter elements sent and the response elements returned and dropped'
+        returned, dropped = counts or filters.take_counts()
+        request_type = filters.request_type
+        for predicate in filters.pushed:
+            self.metrics.inc(FILTERS_PUSHED, request_type=request_type, predicate=predicate)
+        self.metrics.inc(ELEMENTS_RETURNED, returned, request_type=request_type)
+        for predicate, count in dropped.items():
+            self.metrics.inc(ELEMENTS_DROPPED, count, request_type=request_type, predicate=predicate)
+
+    def ping(self):
+        'cheap request used to check an open session still works'
+        response = self.call('HostQueryRq')
+        return response.get('HostQueryRs', {}).get('@statusSeverity') != 'Error'
 
     def get_preferences(self):
-        response = self.call('PreferencesQueryRq')
-        preferences = response.get('PreferencesQueryRs', {}).get('PreferencesRet', {})
+        if self.lazy:
+            preferences = self.call('PreferencesQueryRq', stream=True, lazy=True).first('PreferencesRet', {})
+        else:
+            response = self.call('PreferencesQueryRq')
+            preferences = response.get('PreferencesQueryRs', {}).get('PreferencesRet', {})
         return [(i, dict(preferences[i])) for i in preferences]
 
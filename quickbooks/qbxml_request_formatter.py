@@ -7,6 +7,7 @@ import datetime
 from constants import DISTRIBUTOR_ACCOUNTS, QUICKBOOKS_PURCHASE_ORDER_CLASSES
 
 from . import pluralize
+from .filters import QueryFilters
 
 
 class QuickBooksQueryRequest(object):
@@ -27,7 +28,26 @@ class QuickBooksQueryRequest(object):
             request_dictionary=request_object.request_dictionary,
         )
         purchase_order_elements = request_object.get_response_elements(response)
+
+    get_response_elements also accepts the (label, element) stream returned by
+    ``qb.call(..., stream=True)`` so elements can be processed while the response is parsed.
+
+    Adapters with lazy_response are sent a LazyResponse by QuickBooks(lazy=True),
+    they only read a few paths of most elements.
+
+    fields limits the response elements to the listed top level elements with
+    IncludeRetElement, e.g. fields=['TxnID', 'RefNumber', 'TotalAmount'].  The
+    elements get_response_elements reads (required_fields) are always included.
+
+    The entity, account, class and status predicates (e.g. entity_names, class_list_ids,
+    status='open') are sent as filter elements where the request type has them and
+    checked against the response elements otherwise, see quickbooks.filters.  filters
+    counts the elements returned and dropped.
     """
+    lazy_response = False
+    # top level elements of the response elements get_response_elements reads
+    required_fields = ()
+
     def __init__(self, request_type, response_type, response_element_label=None, *args, **kwargs):
         self.request_type = request_type
         self.response_type = response_type
@@ -37,12 +57,6 @@ class QuickBooksQueryRequest(object):
         self.start_date = kwargs.get('start_date')
         self.end_date = kwargs.get('end_date')
 
-        # ACCOUNT FILTER
-        # should be a list whether one or many but only names or ids.  Never both! 
-        # refer to quickbooks sdk documentation
-        self.account_names = kwargs.get('account_names', list())
-        self.account_list_ids = kwargs.get('account_list_ids', list())
-
         self.include_line_items = kwargs.get('include_line_items', True)
         # these should be a list whether one of many
         self.ref_numbers = kwargs.get('ref_numbers')
@@ -50,6 +64,16 @@ class QuickBooksQueryRequest(object):
         self.txn_ids = kwargs.get('txn_ids')
         self.full_names = kwargs.get('full_names')
         self.list_ids = kwargs.get('list_ids')
+        # page size for iterator queries, only used with date range queries
+        self.max_returned = kwargs.get('max_returned')
+        # top level elements of the response elements to return, all of them by default
+        self.fields = kwargs.get('fields')
+        # entity, account, class and status predicates, lookups can't have filter elements
+        self.filters = QueryFilters(
+            request_type, kwargs, lookup=bool(self.txn_ids or self.ref_numbers or self.list_ids or self.full_names)
+        )
+        # attributes of the request element itself e.g. iterator="Start"
+        self.request_attributes = OrderedDict()
         self.request_dictionary = list()
         self._build_request()
 
@@ -66,10 +90,14 @@ class QuickBooksQueryRequest(object):
         elif self.full_names:
             self.full_name_filter()
         else:
+            self.max_returned_filter()
+            self.status_filter()
             self.modified_date_range_filter()
+            self.entity_filter()
             self.account_filter()
 
         self.include_line_items_filter()
+        self.include_ret_element_filter()
 
     def txn_id_filter(self):
         """
@@ -99,6 +127,22 @@ class QuickBooksQueryRequest(object):
         if self.full_names:
             self.request_dictionary.append(('FullName', self.full_names))
 
+    def max_returned_filter(self):
+        """
+        MaxReturned has to come first in the filter section.  Setting it also starts a
+        qbxml iterator so the remaining results can be fetched with continue_iterator
+        """
+        if self.max_returned:
+            self.request_dictionary.append(('MaxReturned', self.max_returned))
+            self.request_attributes['iterator'] = 'Start'
+
+    def continue_iterator(self, iterator_id):
+        """
+        request the next page of an iterator started with max_returned
+        """
+        self.request_attributes['iterator'] = 'Continue'
+        self.request_attributes['iteratorID'] = iterator_id
+
     def _get_dates(self):
         """
         get appropriate start and end dates depending on whether inital, days or start_date 
@@ -123,32 +167,60 @@ class QuickBooksQueryRequest(object):
         if date_range:
             self.request_dictionary.append(('ModifiedDateRangeFilter', OrderedDict(date_range)))
 
+    def push_filter(self, predicate):
+        'add the filter element of a pushed predicate'
+        pushed = self.filters.pushed.get(predicate)
+        if pushed:
+            self.request_dictionary.append(pushed)
+
+    def status_filter(self):
+        """ActiveStatus of item queries comes right after MaxReturned"""
+        self.push_filter('status')
+
+    def entity_filter(self):
+        self.push_filter('entity')
+
     def account_filter(self):
-        values = None
-        # list IDs are always preferred if available so check these first
-        if self.account_list_ids:
-            values = {'ListID': self.account_list_ids}
-        elif self.account_names:
-            values = {'FullName': self.account_names}
-        if values:
-            self.request_dictionary.append(('AccountFilter', values))
-                
+        self.push_filter('account')
+
     def include_line_items_filter(self):
         if self.include_line_items:
             self.request_dictionary.append(('IncludeLineItems', '1'))
 
+    def include_ret_element_filter(self):
+        """
+        IncludeRetElement follows the filters and IncludeLineItems in the check,
+        item and purchase order queries, only OwnerID comes after it
+        """
+        if self.fields:
+            fields = list(self.fields)
+            fields += [i for i in self.required_fields if i not in fields]
+            self.request_dictionary.append(('IncludeRetElement', fields))
+
+    @staticmethod
+    def is_stream(response):
+        """
+        parsed responses are dictionaries, streamed responses are iterables of (label, element)
+        """
+        return not hasattr(response, 'get')
+
     def get_response_elements(self, response):
         """
         Removes unnecessary nested from quickbooks response.  Ensure _call method is called first
         """
-        response_elements = response.get(self.response_type, dict()).get(self.response_element_label, dict())
-        for element in pluralize(response_elements):
+        if self.is_stream(response):
+            elements = (element for label, element in response if label == self.response_element_label)
+        else:
+            elements = pluralize(response.get(self.response_type, dict()).get(self.response_element_label, dict()))
+        for element in self.filters.filter(elements):
             yield element
 
 
 class CheckQueryRequest(QuickBooksQueryRequest):
     def __init__(self, **kwargs):
-        kwargs['account_names'] = DISTRIBUTOR_ACCOUNTS
+        # only checks of the distributor accounts, lookups get any check
+        if not any(kwargs.get(i) for i in ('txn_ids', 'ref_numbers', 'list_ids', 'full_names')):
+            kwargs['account_names'] = DISTRIBUTOR_ACCOUNTS
         super(CheckQueryRequest, self).__init__('CheckQueryRq', 'CheckQueryRs', 'CheckRet', **kwargs)
 
 
@@ -167,6 +239,17 @@ class ItemQueryRequest(QuickBooksQueryRequest):
         """
         adding some item specific logic
         """
+        for item in self.filters.filter(self.categorized_items(response)):
+            yield item
+
+    def categorized_items(self, response):
+        if self.is_stream(response):
+            for category, item in response:
+                if 'Item' in category:
+                    item['category'] = category
+                    yield item
+            return
+
         # remove unnecessary nesting
         items = response.get(self.response_type)
         keys = [key for key in items.keys() if 'Item' in key]
@@ -177,7 +260,14 @@ class ItemQueryRequest(QuickBooksQueryRequest):
                 yield item
 
 class PurchaseOrderQueryRequest(QuickBooksQueryRequest):
+    # purchase orders of other classes are dropped after reading their ClassRef
+    lazy_response = True
+    required_fields = ('ClassRef', 'PurchaseOrderLineRet', 'PurchaseOrderLineGroupRet')
+
     def __init__(self, **kwargs):
+        # only purchase orders of the relevant quickbooks classes unless classes are given
+        if kwargs.get('class_names') is None and not kwargs.get('class_list_ids'):
+            kwargs['class_names'] = QUICKBOOKS_PURCHASE_ORDER_CLASSES
         super(PurchaseOrderQueryRequest, self).__init__(
             'PurchaseOrderQueryRq', 
             'PurchaseOrderQueryRs',
@@ -193,20 +283,20 @@ class PurchaseOrderQueryRequest(QuickBooksQueryRequest):
 
         verified_pos = list()
         for purchase_order in purchase_orders:
-            # only include relevant quickbooks classes
-            if purchase_order.get('ClassRef', dict()).get('FullName') in QUICKBOOKS_PURCHASE_ORDER_CLASSES:
-                # keep purchase order line items consistent 
-                po_lines = list()
-                po_lines += pluralize(purchase_order.get('PurchaseOrderLineRet', list()))
-
-                po_line_groups = purchase_order.get('PurchaseOrderLineGroupRet', dict())
-                if not isinstance(po_line_groups, list):
-                    po_line_groups = [po_line_groups]
-                for group in po_line_groups: 
-                    po_lines += pluralize(group.get('PurchaseOrderLineRet', list()))
-
-                if po_lines:
-                    purchase_order['po_lines'] = po_lines
-                    verified_pos.append(purchase_order)
+            # keep purchase order line items consistent 
+            po_lines = list()
+            po_lines += pluralize(purchase_order.get('PurchaseOrderLineRet', list()))
+
+            po_line_groups = purchase_order.get('PurchaseOrderLineGroupRet', dict())
+            if not isinstance(po_line_groups, list):
+                po_line_groups = [po_line_groups]
+            for group in po_line_groups: 
+                po_lines += pluralize(group.get('PurchaseOrderLineRet', list()))
+
+            if po_lines:
+                purchase_order['po_lines'] = po_lines
+                verified_pos.append(purchase_order)
+            else:
+                self.filters.drop('lines')
         return verified_pos
 
@@ -2,40 +2,137 @@
 from __future__ import unicode_literals
 
 from collections import OrderedDict
+from io import BytesIO
 import json
 import logging
-from xml.dom import minidom
 import xml.etree.ElementTree as ET
 
+import six
 import xmltodict
 
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
 from constants import STOP_ON_ERROR
+from . import pluralize
 from .exceptions import QuickBooksError
 
 
 logger = logging.getLogger(__name__)
 
+# QBXML > QBXMLMsgsRs > *Rs > *Ret
+RESPONSE_DEPTH = 3
+RESPONSE_ELEMENT_DEPTH = 4
+# cElementTree rejects unicode event names
+ITERPARSE_EVENTS = (str('start'), str('end'))
+
+
+def format_request(request_type, request_items=None, qbxml_version='13.0', on_error=STOP_ON_ERROR, attributes=None, indent='  '):
+    """
+    Format request as QBXML, attributes are set on the request element e.g. iterator="Start"
+
+    The document is written in a single pass and matches what minidom's toprettyxml
+    produced for the equivalent ElementTree.  Pass indent=None for a compact request
+    without any whitespace between elements.
+    """
+    section = format_request_section(request_type, request_items, attributes, indent)
+    return format_envelope([section], qbxml_version, on_error, indent)
+
+
+def format_request_section(request_type, request_items=None, attributes=None, indent='  '):
+    'Format the request element for use in format_envelope'
+    newline = '\n' if indent is not None else ''
+    indent = indent or ''
+    parts = list()
+    write_request_section(parts, request_type, request_items, attributes, indent * 2, indent, newline)
+    return ''.join(parts)
+
+
+def format_envelope(sections, qbxml_version='13.0', on_error=STOP_ON_ERROR, indent='  '):
+    'Wrap formatted request sections in the QBXML document'
+    newline = '\n' if indent is not None else ''
+    indent = indent or ''
+    parts = [
+        '<?xml version="1.0" ?>', newline,
+        '<?qbxml version="{}"?>'.format(escape_xml(qbxml_version)), newline,
+        '<QBXML>', newline,
+        indent, '<QBXMLMsgsRq onError="', escape_xml(on_error), '">', newline,
+    ]
+    parts += sections
+    parts += [indent, '</QBXMLMsgsRq>', newline, '</QBXML>', newline]
+    return ''.join(parts)
+
+
+def escape_xml(text):
+    'Escape text and attribute values the same way minidom does'
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+
+def format_attributes(attributes):
+    'attributes are sorted by name like minidom does'
+    return ''.join(
+        ' {}="{}"'.format(name, escape_xml(six.text_type(attributes[name])))
+        for name in sorted(attributes or {})
+    )
 
-def format_request(request_type, request_items=None, qbxml_version='13.0', on_error=STOP_ON_ERROR):
-    'Format request as QBXML'
+
+def write_request_section(parts, request_type, request_items=None, attributes=None, prefix='    ', indent='  ', newline='\n'):
+    'Append the formatted request element and its contents to the parts list'
     if not request_items:
         request_items = dict()
-    section = ET.Element(request_type)
     if hasattr(request_items, 'items'):
         request_items = request_items.items()
-    for key, value in request_items:
-        section.extend(format_request_part(key, value))
-    body = ET.Element('QBXMLMsgsRq', onError=on_error)
-    body.append(section)
-    document = ET.Element('QBXML')
-    document.append(body)
-    elements = [
-        ET.ProcessingInstruction('xml', 'version="1.0"'),
-        ET.ProcessingInstruction('qbxml', 'version="{}"'.format(qbxml_version)),
-        document,
-    ]
-    request = ''.join(ET.tostring(x) for x in elements)
-    return minidom.parseString(request).toprettyxml(indent="  ")
+    write_element(parts, request_type, request_items, prefix, indent, newline, format_attributes(attributes))
+
+
+def write_element(parts, key, items, prefix, indent, newline, attributes=''):
+    'Append an element with (key, value) children, self closing if nothing is written inside'
+    position = len(parts)
+    parts.append('{}<{}{}>{}'.format(prefix, key, attributes, newline))
+    child_prefix = prefix + indent
+    for child_key, child_value in items:
+        write_request_part(parts, child_key, child_value, child_prefix, indent, newline)
+    if len(parts) == position + 1:
+        parts[position] = '{}<{}{}/>{}'.format(prefix, key, attributes, newline)
+    else:
+        parts.append('{}</{}>{}'.format(prefix, key, newline))
+
+
+def write_request_part(parts, key, value, prefix, indent, newline):
+    'Format request part recursively, accepts the same structures as format_request_part'
+    # If value is a dictionary or tuple
+    if isinstance(value, tuple):
+        value = _tuple_items(value)
+    elif hasattr(value, 'items'):
+        value = value.items()
+    elif not isinstance(value, list):
+        text = six.text_type(value)
+        if text:
+            parts.append('{}<{}>{}</{}>{}'.format(prefix, key, escape_xml(text), key, newline))
+        else:
+            parts.append('{}<{}/>{}'.format(prefix, key, newline))
+        return
+    # If value is a list
+    else:
+        for entry in value:
+            if isinstance(entry, tuple):
+                write_element(parts, key, _tuple_items(entry), prefix, indent, newline)
+            elif hasattr(entry, 'items'):
+                write_element(parts, key, entry.items(), prefix, indent, newline)
+            # If value is a list of repeating elements
+            else:
+                write_request_part(parts, key, entry, prefix, indent, newline)
+        return
+    write_element(parts, key, value, prefix, indent, newline)
+
+
+def _tuple_items(value):
+    'tuples are treated as an OrderedDict, only build one if a key repeats'
+    if len(set(key for key, _ in value)) == len(value):
+        return value
+    return OrderedDict(value).items()
 
 
 def format_request_part(key, value):
@@ -78,8 +175,115 @@ def parse_response(request_type, response):
     response_dict = xmltodict.parse(response)
     response_body = response_dict['QBXML']['QBXMLMsgsRs']
     contents = response_body.get(list(response_body.keys())[0], {})
+    log_response_status(request_type, contents)
+    return response_body
+
+
+def parse_batch_response(response):
+    """
+    Parse QBXML response to a multi request envelope.  Returns an OrderedDict of
+    requestID to the response body of that request, shaped like parse_response output
+    """
+    response_dict = xmltodict.parse(response)
+    response_body = response_dict['QBXML']['QBXMLMsgsRs'] or dict()
+    responses = OrderedDict()
+    for response_type, contents in response_body.items():
+        # several responses of the same type are grouped in a list by xmltodict
+        for entry in pluralize(contents):
+            entry = entry or OrderedDict()
+            log_response_status(response_type, entry)
+            responses[entry.get('@requestID')] = OrderedDict([(response_type, entry)])
+    return responses
+
+
+def log_response_status(request_type, contents):
+    'Log QuickBooks errors reported in the attributes of a *Rs element'
     qb_error = contents.get('@statusSeverity')
     if qb_error == 'Error':
         logger.error('Request Type: {} Error Message: {}'.format(request_type, contents.get('@statusMessage')))
-    return response_body
+
+
+def iter_parse_response(request_type, response, convert=None):
+    'Parse QBXML response incrementally, see ResponseStream'
+    return ResponseStream(request_type, response, convert)
+
+
+class ResponseStream(object):
+    """
+    Incremental alternative to parse_response for large responses
+
+    Iterating yields a (label, element) tuple for every *Ret element as soon as its
+    closing tag is parsed, e.g. ('ItemInventoryRet', OrderedDict(...)).  Elements are
+    converted to the same structure xmltodict produces and are removed from the
+    partially built tree right away, so only one element is held in memory at a time.
+
+    The attributes of each *Rs element (statusCode, iteratorID...) are collected in
+    ``statuses`` keyed by response type as soon as the opening tag is read.
+
+    convert builds the yielded element from the ElementTree element, element_to_dict
+    by default or e.g. quickbooks.records.element_to_record
+    """
+    def __init__(self, request_type, response, convert=None):
+        self.request_type = request_type
+        self.response = response
+        self.convert = convert or element_to_dict
+        self.statuses = OrderedDict()
+
+    def __iter__(self):
+        source = self.response
+        if isinstance(source, six.text_type):
+            source = source.encode('utf-8')
+        convert = self.convert
+        depth = 0
+        response_element = None
+        for event, element in iterparse(BytesIO(source), events=ITERPARSE_EVENTS):
+            if event == 'start':
+                depth += 1
+                if depth == RESPONSE_DEPTH:
+                    response_element = element
+                    status = OrderedDict(
+                        ('@' + key, value) for key, value in element.attrib.items()
+                    )
+                    self.statuses[element.tag] = status
+                    log_response_status(self.request_type, status)
+                continue
+
+            if depth == RESPONSE_ELEMENT_DEPTH:
+                yield element.tag, convert(element)
+                # free the element, it is always the only child left on its parent
+                element.clear()
+                response_element.remove(element)
+            depth -= 1
+
+    @property
+    def status(self):
+        'Attributes of the first *Rs element'
+        for status in self.statuses.values():
+            return status
+        return dict()
+
+
+def element_to_dict(element):
+    """
+    Convert an ElementTree element to the OrderedDict structure built by xmltodict,
+    text and names are unicode like xmltodict's, python 2 ElementTree returns str for ASCII
+    """
+    text = six.text_type(element.text.strip()) if element.text else None
+    children = list(element)
+    if not children and not element.attrib:
+        return text or None
+
+    contents = OrderedDict(('@' + key, six.text_type(value)) for key, value in element.attrib.items())
+    for child in children:
+        value = element_to_dict(child)
+        tag = six.text_type(child.tag)
+        if tag not in contents:
+            contents[tag] = value
+        elif isinstance(contents[tag], list):
+            contents[tag].append(value)
+        else:
+            contents[tag] = [contents[tag], value]
+    if text:
+        contents['#text'] = text
+    return contents
 
@@ -0,0 +1,254 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import threading
+
+import six
+
+from constants import STOP_ON_ERROR
+from .qbxml_serializers import (
+    escape_xml,
+    format_attributes,
+    format_envelope,
+    write_request_part,
+)
+
+
+# shape signature markers
+SCALAR = 's'
+# shapes that can't be compiled (lists mixing shapes, tuples repeating a key)
+# are written by qbxml_serializers.write_request_part instead
+DYNAMIC = 'x'
+TUPLE = 't'
+DICT = 'd'
+LIST = 'l'
+REQUEST = 'r'
+
+# anything else is written as text
+CONTAINER_TYPES = (tuple, list, dict)
+
+
+class ShapeMismatch(Exception):
+    'raised while rendering request items that do not have the shape of the template'
+
+
+def shape_signature(value):
+    """
+    Hashable description of the shape of a request part: element names, nesting and
+    repeat points but none of the values.  Lists are a repeat point and only keep a
+    single entry shape, so a TxnID list has the same signature whatever its length.
+    """
+    if isinstance(value, tuple):
+        keys = [key for key, _ in value]
+        if len(set(keys)) != len(keys):
+            return DYNAMIC
+        return (TUPLE, tuple((key, shape_signature(child)) for key, child in value))
+    if isinstance(value, dict):
+        return (DICT, tuple((key, shape_signature(child)) for key, child in value.items()))
+    if isinstance(value, list):
+        entries = set(shape_signature(entry) for entry in value)
+        if len(entries) > 1:
+            return DYNAMIC
+        return (LIST, entries.pop() if entries else None)
+    return SCALAR
+
+
+def request_items_list(request_items):
+    'top level request items as a sequence of (key, value), they keep their order and may repeat'
+    if not request_items:
+        return ()
+    if isinstance(request_items, dict):
+        return list(request_items.items())
+    return request_items
+
+
+def request_signature(request_items):
+    items = request_items_list(request_items)
+    return (REQUEST, tuple((key, shape_signature(value)) for key, value in items))
+
+
+def request_keys(request_items):
+    'cheap cache key for the request items, the full shape is checked while rendering'
+    return tuple(key for key, _ in request_items_list(request_items))
+
+
+class RequestTemplate(object):
+    """
+    Emitter compiled for one request type and shape.  All tags and indentation are
+    prepared up front so rendering only walks the values and fills them in.  The
+    output is the same as qbxml_serializers.format_request_section.
+
+    Rendering checks the request items against the compiled shape as it goes and
+    raises ShapeMismatch if they don't fit.
+    """
+    def __init__(self, request_type, signature, indent='  '):
+        self.request_type = request_type
+        self.signature = signature
+        self.newline = '\n' if indent is not None else ''
+        self.indent = indent or ''
+        self.emit = self._compile(request_type, signature, self.indent * 2)
+
+    def render(self, request_items=None, attributes=None):
+        'Format the request element for use in format_envelope'
+        parts = list()
+        self.emit(parts, request_items_list(request_items), format_attributes(attributes))
+        return ''.join(parts)
+
+    def _compile(self, key, signature, prefix):
+        if signature == SCALAR:
+            return self._compile_scalar(key, prefix)
+        if signature == DYNAMIC:
+            return self._compile_dynamic(key, prefix)
+        kind, children = signature
+        if kind == LIST:
+            return self._compile_list(key, children, prefix)
+        return self._compile_element(key, kind, children, prefix)
+
+    def _compile_scalar(self, key, prefix):
+        start = '{}<{}>'.format(prefix, key)
+        end = '</{}>{}'.format(key, self.newline)
+        empty = '{}<{}/>{}'.format(prefix, key, self.newline)
+        text_type = six.text_type
+
+        def emit(parts, value, attributes=''):
+            if isinstance(value, CONTAINER_TYPES):
+                raise ShapeMismatch(key)
+            text = text_type(value)
+            if text:
+                parts.append(start + escape_xml(text) + end)
+            else:
+                parts.append(empty)
+        return emit
+
+    def _compile_dynamic(self, key, prefix):
+        indent, newline = self.indent, self.newline
+
+        def emit(parts, value, attributes=''):
+            write_request_part(parts, key, value, prefix, indent, newline)
+        return emit
+
+    def _compile_list(self, key, entry_signature, prefix):
+        if entry_signature is None:
+            def emit(parts, value, attributes=''):
+                if not isinstance(value, list) or value:
+                    raise ShapeMismatch(key)
+            return emit
+        emit_entry = self._compile(key, entry_signature, prefix)
+
+        def emit(parts, value, attributes=''):
+            if not isinstance(value, list):
+                raise ShapeMismatch(key)
+            for entry in value:
+                emit_entry(parts, entry)
+        return emit
+
+    def _compile_element(self, key, kind, children, prefix):
+        child_prefix = prefix + self.indent
+        emitters = [
+            (child_key, self._compile(child_key, child, child_prefix))
+            for child_key, child in children
+        ]
+        size = len(emitters)
+        value_type = {TUPLE: tuple, DICT: dict}.get(kind, CONTAINER_TYPES)
+        start = '{}<{}'.format(prefix, key)
+        end = '{}</{}>{}'.format(prefix, key, self.newline)
+        opened = '>' + self.newline
+        closed = '/>' + self.newline
+
+        def emit(parts, value, attributes=''):
+            if not isinstance(value, value_type) or len(value) != size:
+                raise ShapeMismatch(key)
+            if kind == DICT:
+                value = value.items()
+            position = len(parts)
+            parts.append(start + attributes + opened)
+            for (expected_key, emit_child), (child_key, child) in zip(emitters, value):
+                if child_key != expected_key:
+                    raise ShapeMismatch(child_key)
+                emit_child(parts, child)
+            if len(parts) == position + 1:
+                parts[position] = start + attributes + closed
+            else:
+                parts.append(end)
+        return emit
+
+
+class TemplateCache(object):
+    """
+    Size bounded LRU cache of compiled request templates
+
+    Templates are looked up by request type and the top level keys of the request,
+    each entry keeps the few shapes (full signatures) seen for that key and a new
+    template is only compiled when none of them fit the request items.
+    """
+    def __init__(self, maxsize=128, max_shapes=8):
+        self.maxsize = maxsize
+        self.max_shapes = max_shapes
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def render(self, request_type, request_items=None, attributes=None, indent='  '):
+        key = (request_type, request_keys(request_items), indent)
+        with self._lock:
+            # most recently used entries are kept at the end
+            shapes = self.templates.pop(key, None) or list()
+            self.templates[key] = shapes
+            while len(self.templates) > self.maxsize:
+                self.templates.popitem(last=False)
+            shapes = list(shapes)
+
+        for template in shapes:
+            try:
+                section = template.render(request_items, attributes)
+            except ShapeMismatch:
+                continue
+            with self._lock:
+                self.hits += 1
+            return section
+
+        with self._lock:
+            self.misses += 1
+        template = self.compile(request_type, request_items, indent)
+        return template.render(request_items, attributes)
+
+    def compile(self, request_type, request_items=None, indent='  '):
+        'compile and cache the template for the shape of the request items'
+        template = RequestTemplate(request_type, request_signature(request_items), indent)
+        key = (request_type, request_keys(request_items), indent)
+        with self._lock:
+            shapes = self.templates.pop(key, None) or list()
+            shapes = [i for i in shapes if i.signature != template.signature]
+            shapes.insert(0, template)
+            self.templates[key] = shapes[:self.max_shapes]
+            while len(self.templates) > self.maxsize:
+                self.templates.popitem(last=False)
+        return template
+
+    def clear(self):
+        with self._lock:
+            self.templates.clear()
+
+    def __len__(self):
+        return sum(len(shapes) for shapes in self.templates.values())
+
+
+TEMPLATE_CACHE = TemplateCache()
+
+
+def register_template(request_type, request_items=None, indent='  ', cache=TEMPLATE_CACHE):
+    'Compile the template for the shape of the example request items ahead of time'
+    return cache.compile(request_type, request_items, indent)
+
+
+def format_request_section(request_type, request_items=None, attributes=None, indent='  ', cache=TEMPLATE_CACHE):
+    'qbxml_serializers.format_request_section using a cached template'
+    return cache.render(request_type, request_items, attributes, indent)
+
+
+def format_request(request_type, request_items=None, qbxml_version='13.0', on_error=STOP_ON_ERROR, attributes=None, indent='  ', cache=TEMPLATE_CACHE):
+    'qbxml_serializers.format_request using a cached template'
+    section = format_request_section(request_type, request_items, attributes, indent, cache)
+    return format_envelope([section], qbxml_version, on_error, indent)
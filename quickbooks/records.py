@@ -0,0 +1,269 @@
+# coding=utf-8
+"""
+Slotted record classes for the response elements of the supported queries
+
+Parsed entities are normally xmltodict style OrderedDicts, with records=True the
+response parser builds a record per *Ret element instead.  Record classes are
+generated from a list of fields (the qbxml elements in schema order) and keep their
+values in __slots__, so an entity costs a fixed size object instead of a hash table.
+Values are the same text, nested records, dictionaries and lists xmltodict produces.
+
+Records support the mapping access the query adapters use (get, [], in, keys, items)
+and to_dict returns the OrderedDict xmltodict would have built for the celery
+hand-off.  Elements or attributes without a field end up in the extras dictionary.
+Records pickle by class name, e.g. for quickbooks.cache.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from .qbxml_serializers import element_to_dict
+
+
+MISSING = object()
+
+
+class Record(object):
+    __slots__ = ('extras',)
+    fields = ()
+    field_set = frozenset()
+
+    def __init__(self, *args, **kwargs):
+        self.extras = None
+        for key, value in OrderedDict(*args, **kwargs).items():
+            self[key] = value
+
+    def get(self, key, default=None):
+        if key in self.field_set:
+            return getattr(self, key, default)
+        if self.extras is not None:
+            return self.extras.get(key, default)
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.field_set:
+            setattr(self, key, value)
+        else:
+            if self.extras is None:
+                self.extras = OrderedDict()
+            self.extras[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self.field_set:
+            delattr(self, key)
+        else:
+            del self.extras[key]
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def keys(self):
+        keys = [i for i in self.fields if hasattr(self, i)]
+        if self.extras:
+            keys += list(self.extras)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def to_dict(self):
+        'the OrderedDict xmltodict builds for the element, nested records included'
+        return OrderedDict((key, to_dict(value)) for key, value in self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.items())
+
+    def __reduce__(self):
+        # generated classes aren't module attributes, pickle finds them by name instead
+        return restore_record, (self.__class__.__name__, self.items())
+
+
+def to_dict(value):
+    'records and lazy elements (also in lists) as OrderedDicts, anything else as it is'
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [to_dict(i) for i in value]
+    return value
+
+
+def json_default(value):
+    'json.dumps default accepting records and lazy elements'
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    return str(value)
+
+
+def record_class(name, fields):
+    'generate a Record subclass with a slot for every field'
+    fields = tuple(fields)
+    return type(str(name), (Record,), {
+        '__slots__': fields,
+        'fields': fields,
+        'field_set': frozenset(fields),
+    })
+
+
+REF_FIELDS = ('ListID', 'FullName')
+ADDRESS_FIELDS = ('Addr1', 'Addr2', 'Addr3', 'Addr4', 'Addr5', 'City', 'State', 'PostalCode', 'Country', 'Note')
+
+TXN_HEADER_FIELDS = ('TxnID', 'TimeCreated', 'TimeModified', 'EditSequence', 'TxnNumber')
+
+CHECK_FIELDS = TXN_HEADER_FIELDS + (
+    'AccountRef', 'PayeeEntityRef', 'RefNumber', 'TxnDate', 'Amount', 'CurrencyRef',
+    'ExchangeRate', 'AmountInHomeCurrency', 'Memo', 'Address', 'AddressBlock',
+    'IsToBePrinted', 'IsTaxIncluded', 'SalesTaxCodeRef', 'ExternalGUID', 'LinkedTxn',
+    'ExpenseLineRet', 'ItemLineRet', 'ItemGroupLineRet', 'DataExtRet',
+)
+EXPENSE_LINE_FIELDS = (
+    'TxnLineID', 'AccountRef', 'Amount', 'Memo', 'CustomerRef', 'ClassRef',
+    'SalesTaxCodeRef', 'BillableStatus', 'SalesRepRef', 'DataExtRet',
+)
+ITEM_LINE_FIELDS = (
+    'TxnLineID', 'ItemRef', 'InventorySiteRef', 'InventorySiteLocationRef', 'SerialNumber',
+    'LotNumber', 'Desc', 'Quantity', 'UnitOfMeasure', 'OverrideUOMSetRef', 'Cost', 'Amount',
+    'CustomerRef', 'ClassRef', 'SalesTaxCodeRef', 'BillableStatus', 'SalesRepRef', 'DataExtRet',
+)
+
+ITEM_HEADER_FIELDS = (
+    'ListID', 'TimeCreated', 'TimeModified', 'EditSequence', 'Name', 'FullName',
+    'BarCodeValue', 'IsActive', 'ClassRef', 'ParentRef', 'Sublevel',
+)
+# category is set by ItemQueryRequest.get_response_elements
+ITEM_TRAILER_FIELDS = ('ExternalGUID', 'DataExtRet', 'category')
+ITEM_INVENTORY_FIELDS = ITEM_HEADER_FIELDS + (
+    'ManufacturerPartNumber', 'UnitOfMeasureSetRef', 'IsTaxIncluded', 'SalesTaxCodeRef',
+    'SalesDesc', 'SalesPrice', 'IncomeAccountRef', 'PurchaseDesc', 'PurchaseCost',
+    'PurchaseTaxCodeRef', 'COGSAccountRef', 'PrefVendorRef', 'AssetAccountRef',
+    'BuildPoint', 'ReorderPoint', 'Max', 'QuantityOnHand', 'AverageCost',
+    'QuantityOnOrder', 'QuantityOnSalesOrder',
+)
+ITEM_SALES_OR_PURCHASE_FIELDS = ITEM_HEADER_FIELDS + (
+    'ManufacturerPartNumber', 'UnitOfMeasureSetRef', 'IsTaxIncluded', 'SalesTaxCodeRef',
+    'SpecialItemType', 'SalesOrPurchase', 'SalesAndPurchase',
+)
+ITEM_VARIANT_FIELDS = {
+    'ItemInventoryRet': ITEM_INVENTORY_FIELDS,
+    'ItemInventoryAssemblyRet': ITEM_INVENTORY_FIELDS + ('ItemInventoryAssemblyLine',),
+    'ItemNonInventoryRet': ITEM_SALES_OR_PURCHASE_FIELDS,
+    'ItemServiceRet': ITEM_SALES_OR_PURCHASE_FIELDS,
+    'ItemOtherChargeRet': ITEM_SALES_OR_PURCHASE_FIELDS,
+    'ItemFixedAssetRet': ITEM_HEADER_FIELDS + (
+        'AcquiredAs', 'PurchaseDesc', 'PurchaseDate', 'PurchaseCost', 'VendorOrPayeeName',
+        'AssetAccountRef', 'FixedAssetSalesInfo', 'AssetDesc', 'Location', 'PONumber',
+        'SerialNumber', 'WarrantyExpDate', 'Notes', 'AssetNumber', 'CostBasis',
+        'YearEndAccumulatedDepreciation', 'YearEndBookValue',
+    ),
+    'ItemGroupRet': ITEM_HEADER_FIELDS + (
+        'ItemDesc', 'UnitOfMeasureSetRef', 'IsPrintItemsInGroup', 'SpecialItemType', 'ItemGroupLine',
+    ),
+    'ItemDiscountRet': ITEM_HEADER_FIELDS + (
+        'ItemDesc', 'SalesTaxCodeRef', 'DiscountRate', 'DiscountRatePercent', 'AccountRef',
+    ),
+    'ItemSubtotalRet': ITEM_HEADER_FIELDS + ('ItemDesc', 'SpecialItemType'),
+    'ItemPaymentRet': ITEM_HEADER_FIELDS + ('ItemDesc', 'DepositToAccountRef', 'PaymentMethodRef'),
+    'ItemSalesTaxRet': ITEM_HEADER_FIELDS + ('ItemDesc', 'TaxRate', 'TaxVendorRef', 'SalesTaxReturnLineRef'),
+    'ItemSalesTaxGroupRet': ITEM_HEADER_FIELDS + ('ItemDesc', 'ItemSalesTaxRef'),
+}
+
+PURCHASE_ORDER_FIELDS = TXN_HEADER_FIELDS + (
+    'VendorRef', 'ClassRef', 'InventorySiteRef', 'ShipToEntityRef', 'TemplateRef', 'TxnDate',
+    'RefNumber', 'VendorAddress', 'VendorAddressBlock', 'ShipAddress', 'ShipAddressBlock',
+    'TermsRef', 'DueDate', 'ExpectedDate', 'ShipMethodRef', 'FOB', 'TotalAmount', 'CurrencyRef',
+    'ExchangeRate', 'TotalAmountInHomeCurrency', 'IsManuallyClosed', 'IsFullyReceived', 'Memo',
+    'VendorMsg', 'IsToBePrinted', 'IsToBeEmailed', 'IsTaxIncluded', 'SalesTaxCodeRef', 'Other1',
+    'Other2', 'ExternalGUID', 'LinkedTxn', 'PurchaseOrderLineRet', 'PurchaseOrderLineGroupRet',
+    'DataExtRet',
+    # set by PurchaseOrderQueryRequest.get_response_elements
+    'po_lines',
+)
+PURCHASE_ORDER_LINE_FIELDS = (
+    'TxnLineID', 'ItemRef', 'ManufacturerPartNumber', 'Desc', 'Quantity', 'UnitOfMeasure',
+    'OverrideUOMSetRef', 'Rate', 'ClassRef', 'Amount', 'InventorySiteLocationRef', 'CustomerRef',
+    'ServiceDate', 'SalesTaxCodeRef', 'ReceivedQuantity', 'UnbilledQuantity', 'IsBilled',
+    'IsManuallyClosed', 'Other1', 'Other2', 'DataExtRet',
+)
+PURCHASE_ORDER_LINE_GROUP_FIELDS = (
+    'TxnLineID', 'ItemGroupRef', 'Desc', 'Quantity', 'UnitOfMeasure', 'OverrideUOMSetRef',
+    'IsPrintItemsInGroup', 'TotalAmount', 'PurchaseOrderLineRet', 'DataExtRet',
+)
+
+RefRecord = record_class('Ref', REF_FIELDS)
+AddressRecord = record_class('Address', ADDRESS_FIELDS)
+
+RECORD_CLASSES = {
+    'CheckRet': record_class('CheckRet', CHECK_FIELDS),
+    'ExpenseLineRet': record_class('ExpenseLineRet', EXPENSE_LINE_FIELDS),
+    'ItemLineRet': record_class('ItemLineRet', ITEM_LINE_FIELDS),
+    'PurchaseOrderRet': record_class('PurchaseOrderRet', PURCHASE_ORDER_FIELDS),
+    'PurchaseOrderLineRet': record_class('PurchaseOrderLineRet', PURCHASE_ORDER_LINE_FIELDS),
+    'PurchaseOrderLineGroupRet': record_class('PurchaseOrderLineGroupRet', PURCHASE_ORDER_LINE_GROUP_FIELDS),
+    'ItemInventoryAssemblyLine': record_class('ItemInventoryAssemblyLine', ('ItemInventoryRef', 'Quantity')),
+}
+for tag, fields in ITEM_VARIANT_FIELDS.items():
+    RECORD_CLASSES[tag] = record_class(tag, fields + ITEM_TRAILER_FIELDS)
+for tag in ('Address', 'AddressBlock', 'VendorAddress', 'VendorAddressBlock', 'ShipAddress', 'ShipAddressBlock'):
+    RECORD_CLASSES[tag] = AddressRecord
+
+
+def get_record_class(tag):
+    record = RECORD_CLASSES.get(tag)
+    if record is None and tag.endswith('Ref'):
+        return RefRecord
+    return record
+
+
+def restore_record(name, items):
+    return get_record_class(name)(items)
+
+
+def element_to_record(element):
+    """
+    Build the record for an ElementTree element, elements without a record class are
+    converted by element_to_dict
+    """
+    record_type = get_record_class(element.tag)
+    if record_type is None or (not len(element) and not element.attrib):
+        return element_to_dict(element)
+
+    record = record_type()
+    for key, value in element.attrib.items():
+        record['@' + key] = value
+    for child in element:
+        value = element_to_record(child)
+        existing = record.get(child.tag, MISSING)
+        if existing is MISSING:
+            record[child.tag] = value
+        elif isinstance(existing, list):
+            existing.append(value)
+        else:
+            record[child.tag] = [existing, value]
+    text = element.text.strip() if element.text else None
+    if text:
+        record['#text'] = text
+    return record
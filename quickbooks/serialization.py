@@ -0,0 +1,271 @@
+# coding=utf-8
+"""
+qbpack, a compact binary encoding for task payloads holding parsed qbxml responses
+
+Parsed responses repeat the same few element names (and values like "true") thousands
+of times.  qbpack writes every string up to INTERN_MAX_BYTES once and refers back to
+it by index afterwards, lengths and integers are varints and the whole payload is
+optionally compressed with zlib or lz4 (when installed).
+
+Encoded values are None, bool, int, float, text, bytes, dict, OrderedDict (decoded as
+OrderedDict so element order is kept), list and tuple (decoded as list like json),
+naive datetime, date and Decimal.
+
+Example usage:
+
+    from quickbooks.serialization import register_serializer
+
+    register_serializer()
+    celery_app.send_task(..., serializer='qbpack')
+
+The consuming worker has to register the serializer too and accept 'qbpack' in its
+CELERY_ACCEPT_CONTENT.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import datetime
+import decimal
+import functools
+import struct
+import zlib
+
+import six
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+SERIALIZER_NAME = 'qbpack'
+CONTENT_TYPE = 'application/x-qbpack'
+
+MAGIC = b'QBP1'
+NO_COMPRESSION = b'n'
+ZLIB = b'z'
+LZ4 = b'4'
+COMPRESSION_NAMES = {None: NO_COMPRESSION, 'zlib': ZLIB, 'lz4': LZ4}
+
+# payloads smaller than this aren't worth compressing
+COMPRESSION_THRESHOLD = 512
+# longer strings are written out every time, they rarely repeat
+INTERN_MAX_BYTES = 64
+
+# value tags
+NONE, TRUE, FALSE = ord('N'), ord('T'), ord('F')
+INTEGER, FLOAT = ord('i'), ord('f')
+STRING, NEW_STRING, STRING_REF = ord('s'), ord('S'), ord('r')
+BYTES = ord('b')
+DICT, ORDERED_DICT, LIST = ord('d'), ord('o'), ord('l')
+DATETIME, DATE, DECIMAL = ord('t'), ord('a'), ord('m')
+
+DOUBLE = struct.Struct(str('>d'))
+
+
+class SerializationError(Exception):
+    'raised for values qbpack can not encode and payloads it can not decode'
+
+
+class Encoder(object):
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = dict()
+
+    def write_uint(self, number):
+        out = self.out
+        while number >= 0x80:
+            out.append((number & 0x7f) | 0x80)
+            number >>= 7
+        out.append(number)
+
+    def write_text(self, value):
+        index = self.strings.get(value)
+        if index is not None:
+            self.out.append(STRING_REF)
+            self.write_uint(index)
+            return
+        data = value.encode('utf-8')
+        if len(data) <= INTERN_MAX_BYTES:
+            self.strings[value] = len(self.strings)
+            self.out.append(NEW_STRING)
+        else:
+            self.out.append(STRING)
+        self.write_uint(len(data))
+        self.out += data
+
+    def write(self, value):
+        out = self.out
+        if value is None:
+            out.append(NONE)
+        elif value is True:
+            out.append(TRUE)
+        elif value is False:
+            out.append(FALSE)
+        elif isinstance(value, six.text_type):
+            self.write_text(value)
+        elif isinstance(value, dict):
+            out.append(ORDERED_DICT if isinstance(value, OrderedDict) else DICT)
+            self.write_uint(len(value))
+            for key, child in value.items():
+                self.write(key)
+                self.write(child)
+        elif isinstance(value, (list, tuple)):
+            out.append(LIST)
+            self.write_uint(len(value))
+            for child in value:
+                self.write(child)
+        elif isinstance(value, six.binary_type):
+            self.write_bytes(value)
+        elif isinstance(value, six.integer_types):
+            out.append(INTEGER)
+            # zigzag so small negative numbers stay short
+            self.write_uint(value * 2 if value >= 0 else -value * 2 - 1)
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += DOUBLE.pack(value)
+        elif isinstance(value, datetime.datetime):
+            if value.utcoffset() is not None:
+                raise SerializationError('qbpack only encodes naive datetimes')
+            out.append(DATETIME)
+            self.write_text(value.isoformat())
+        elif isinstance(value, datetime.date):
+            out.append(DATE)
+            self.write_text(value.isoformat())
+        elif isinstance(value, decimal.Decimal):
+            out.append(DECIMAL)
+            self.write_text(six.text_type(value))
+        else:
+            raise SerializationError('qbpack can not encode {!r}'.format(type(value)))
+
+    def write_bytes(self, value):
+        if six.PY2:
+            # python 2 str is text for everyone else, e.g. celery's own message fields
+            try:
+                return self.write_text(value.decode('utf-8'))
+            except UnicodeDecodeError:
+                pass
+        self.out.append(BYTES)
+        self.write_uint(len(value))
+        self.out += value
+
+
+class Decoder(object):
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.position = 0
+        self.strings = list()
+
+    def read_uint(self):
+        data = self.data
+        byte = data[self.position]
+        if byte < 0x80:
+            self.position += 1
+            return byte
+        number = shift = 0
+        while True:
+            byte = data[self.position]
+            self.position += 1
+            number |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return number
+            shift += 7
+
+    def read_raw(self):
+        size = self.read_uint()
+        start = self.position
+        self.position += size
+        return bytes(self.data[start:self.position])
+
+    def read(self):
+        tag = self.data[self.position]
+        self.position += 1
+        if tag == STRING_REF:
+            return self.strings[self.read_uint()]
+        if tag == NEW_STRING:
+            value = self.read_raw().decode('utf-8')
+            self.strings.append(value)
+            return value
+        if tag == STRING:
+            return self.read_raw().decode('utf-8')
+        if tag == ORDERED_DICT or tag == DICT:
+            value = OrderedDict() if tag == ORDERED_DICT else dict()
+            for _ in range(self.read_uint()):
+                key = self.read()
+                value[key] = self.read()
+            return value
+        if tag == LIST:
+            return [self.read() for _ in range(self.read_uint())]
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INTEGER:
+            number = self.read_uint()
+            return number >> 1 if not number & 1 else -((number + 1) >> 1)
+        if tag == FLOAT:
+            start = self.position
+            self.position += DOUBLE.size
+            return DOUBLE.unpack(bytes(self.data[start:self.position]))[0]
+        if tag == BYTES:
+            return self.read_raw()
+        if tag == DATETIME:
+            return parse_datetime(self.read())
+        if tag == DATE:
+            return datetime.datetime.strptime(self.read(), '%Y-%m-%d').date()
+        if tag == DECIMAL:
+            return decimal.Decimal(self.read())
+        raise SerializationError('Unknown qbpack tag {!r} at {}'.format(chr(tag), self.position - 1))
+
+
+def parse_datetime(value):
+    'datetime.isoformat output without a utc offset'
+    if '.' in value:
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
+
+def dumps(value, compression='zlib', threshold=COMPRESSION_THRESHOLD, level=6):
+    'encode value as qbpack, compressed with zlib, lz4 or None once it exceeds threshold bytes'
+    if compression not in COMPRESSION_NAMES:
+        raise SerializationError('Unknown qbpack compression {}'.format(compression))
+    if compression == 'lz4' and lz4_frame is None:
+        raise SerializationError('lz4 compression requires the lz4 package')
+    encoder = Encoder()
+    encoder.write(value)
+    payload = bytes(encoder.out)
+    if compression is None or len(payload) < threshold:
+        return MAGIC + NO_COMPRESSION + payload
+    if compression == 'lz4':
+        return MAGIC + LZ4 + lz4_frame.compress(payload)
+    return MAGIC + ZLIB + zlib.compress(payload, level)
+
+
+def loads(data):
+    if isinstance(data, six.text_type):
+        # kombu may hand over text for payloads that went through a text only transport
+        data = data.encode('latin-1')
+    data = bytes(data)
+    if data[:len(MAGIC)] != MAGIC:
+        raise SerializationError('Not a qbpack payload')
+    compression = data[len(MAGIC):len(MAGIC) + 1]
+    payload = data[len(MAGIC) + 1:]
+    if compression == ZLIB:
+        payload = zlib.decompress(payload)
+    elif compression == LZ4:
+        if lz4_frame is None:
+            raise SerializationError('lz4 compressed payload but the lz4 package is not installed')
+        payload = lz4_frame.decompress(payload)
+    elif compression != NO_COMPRESSION:
+        raise SerializationError('Unknown qbpack compression {!r}'.format(compression))
+    return Decoder(payload).read()
+
+
+def register_serializer(name=SERIALIZER_NAME, compression='zlib', threshold=COMPRESSION_THRESHOLD):
+    'register qbpack with kombu so tasks can be sent with serializer=name'
+    from kombu.serialization import register
+
+    encoder = functools.partial(dumps, compression=compression, threshold=threshold)
+    register(name, encoder, loads, content_type=CONTENT_TYPE, content_encoding='binary')
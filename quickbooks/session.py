@@ -0,0 +1,118 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionManager(object):
+    """
+    Keeps a single QuickBooks session open across the tasks of a worker so the
+    company file isn't opened and closed for every task.
+
+    The session is ended after idle_timeout seconds without a task or once max_tasks
+    tasks have used it.  An open session that has been idle for health_check_after
+    seconds or had a COM error since it was last checked is checked with a cheap request
+    before it is reused, only a broken session is closed by force.
+
+    Example usage:
+
+        sessions = SessionManager(lambda: QuickBooks(**QB_LOOKUP), idle_timeout=300)
+        with sessions.session() as qb:
+            qb.call('PreferencesQueryRq')
+
+    COM objects belong to the thread that created them so the manager must only be
+    used from the worker thread, which is always the case with --pool=solo.
+    """
+    def __init__(self, factory, idle_timeout=300, max_tasks=100, health_check=True, health_check_after=60, force_close=False, clock=time.time):
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.max_tasks = max_tasks
+        self.health_check = health_check
+        self.health_check_after = health_check_after
+        # close QuickBooks by force when ending healthy sessions as well
+        self.force_close = force_close
+        self.clock = clock
+        self.qb = None
+        self.task_count = 0
+        self.last_used = None
+        # com_errors of the session when it was last known to be healthy
+        self.com_errors = 0
+        self.sessions_opened = 0
+
+    @contextmanager
+    def session(self):
+        'context manager yielding an open QuickBooks instance'
+        qb = self.acquire()
+        try:
+            yield qb
+        finally:
+            self.release()
+
+    def acquire(self):
+        if self.qb is not None:
+            if self.is_expired():
+                self.close()
+            elif self.health_check and self.is_suspect() and not self.is_healthy():
+                logger.warning('QuickBooks session is broken, closing by force')
+                self.close(broken=True)
+        if self.qb is None:
+            self.open()
+        return self.qb
+
+    def release(self):
+        self.task_count += 1
+        self.last_used = self.clock()
+        if self.max_tasks and self.task_count >= self.max_tasks:
+            self.close()
+
+    def release_idle(self):
+        'end the session if it has been idle for longer than idle_timeout'
+        if self.qb is not None and self.is_expired():
+            self.close()
+
+    def is_expired(self):
+        if self.max_tasks and self.task_count >= self.max_tasks:
+            return True
+        return self.last_used is not None and self.clock() - self.last_used >= self.idle_timeout
+
+    def is_suspect(self):
+        'whether the session had a COM error or was idle long enough to need a check'
+        if self.qb.com_errors != self.com_errors:
+            return True
+        return self.last_used is not None and self.clock() - self.last_used >= self.health_check_after
+
+    def is_healthy(self):
+        if not self.qb.is_open:
+            return False
+        try:
+            healthy = self.qb.ping()
+        except Exception as e:
+            logger.error(e)
+            return False
+        self.com_errors = self.qb.com_errors
+        return healthy
+
+    def open(self):
+        qb = self.factory()
+        qb.begin_session()
+        self.qb = qb
+        self.task_count = 0
+        self.last_used = None
+        self.com_errors = qb.com_errors
+        self.sessions_opened += 1
+
+    def close(self, broken=False):
+        qb, self.qb = self.qb, None
+        if qb is None:
+            return
+        try:
+            qb.end_session(force=broken or self.force_close)
+        except Exception as e:
+            logger.error(e)
+            if not broken:
+                qb.close_by_force()
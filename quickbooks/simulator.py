@@ -0,0 +1,328 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import glob
+import itertools
+import os
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+import six
+
+from constants import STOP_ON_ERROR
+from .exceptions import QuickBooksError
+from .qbxml_serializers import escape_xml
+
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'qbxml_files')
+
+# (statusCode, statusSeverity, statusMessage)
+STATUS_OK = ('0', 'Info', 'Status OK')
+STATUS_NO_MATCH = ('1', 'Info', 'A query request did not find a matching object in QuickBooks')
+# status codes used by the simulator only
+STATUS_INVALID_ITERATOR = ('9001', 'Error', 'Simulator: iteratorID {} is not valid')
+STATUS_INVALID_REQUEST = ('9002', 'Error', 'Simulator: {} is missing its {} element')
+
+# answers for requests the fixture corpus has no responses for
+DEFAULT_RESPONSES = {
+    'HostQueryRs': [
+        '<HostRet><ProductName>QuickBooks Simulator</ProductName>'
+        '<MajorVersion>13</MajorVersion><MinorVersion>0</MinorVersion></HostRet>',
+    ],
+    'PreferencesQueryRs': [
+        '<PreferencesRet>'
+        '<AccountingPreferences><IsUsingAccountNumbers>false</IsUsingAccountNumbers>'
+        '<IsUsingClassTracking>true</IsUsingClassTracking></AccountingPreferences>'
+        '<PurchasesAndVendorsPreferences><IsUsingInventory>true</IsUsingInventory>'
+        '<DaysBillsAreDue>30</DaysBillsAreDue></PurchasesAndVendorsPreferences>'
+        '</PreferencesRet>',
+    ],
+}
+
+# entities identified by ListID, everything else added is treated as a transaction
+LIST_ENTITIES = ('Account', 'Class', 'Customer', 'Employee', 'OtherName', 'Vendor')
+
+ID_FILTERS = ('TxnID', 'ListID', 'RefNumber', 'FullName')
+
+# references EntityFilter matches, whichever the entity has
+ENTITY_REFS = ('VendorRef', 'PayeeEntityRef', 'CustomerRef', 'EntityRef')
+# ActiveStatus -> the IsActive values it returns
+ACTIVE_STATUSES = {'ActiveOnly': ('true', ''), 'InactiveOnly': ('false',), 'All': ('true', 'false', '')}
+# like QuickBooks, list queries without an ActiveStatus or id filter only return active entities
+DEFAULT_ACTIVE_STATUS = 'ActiveOnly'
+
+
+class SimulatorError(QuickBooksError):
+    'raised where the COM request processor raises a com_error'
+
+
+def element_text(element):
+    return (element.text or '').strip()
+
+
+def element_xml(element):
+    'serialized element without its tail'
+    element.tail = None
+    return ET.tostring(element).decode('ascii')
+
+
+class Record(object):
+    """
+    A *Ret element of the corpus, fields holds the text of its leaf elements up to
+    two levels deep e.g. fields['TxnID'] or fields['ClassRef/FullName']
+    """
+    __slots__ = ('label', 'xml', 'fields')
+
+    def __init__(self, element):
+        self.label = element.tag
+        self.fields = dict()
+        for child in element:
+            if len(child):
+                for grandchild in child:
+                    if not len(grandchild):
+                        path = '{}/{}'.format(child.tag, grandchild.tag)
+                        self.fields.setdefault(path, element_text(grandchild))
+            else:
+                self.fields.setdefault(child.tag, element_text(child))
+        self.xml = element_xml(element)
+
+    def project(self, includes):
+        'the element with only the included top level children, all of them without includes'
+        if not includes:
+            return self.xml
+        element = ET.fromstring(self.xml.encode('utf-8'))
+        for child in list(element):
+            if child.tag not in includes:
+                element.remove(child)
+        return element_xml(element)
+
+
+class ResponseCorpus(object):
+    'Response elements keyed by response type, e.g. ItemQueryRs, loaded from qbxml responses'
+    def __init__(self):
+        self.records = OrderedDict()
+
+    @classmethod
+    def from_directory(cls, directory, pattern='*response*.xml'):
+        corpus = cls()
+        for file_name in sorted(glob.glob(os.path.join(directory, pattern))):
+            with open(file_name, 'rb') as fin:
+                corpus.add_response(fin.read())
+        return corpus
+
+    def add_response(self, response):
+        if isinstance(response, six.text_type):
+            response = response.encode('utf-8')
+        for response_element in ET.fromstring(response).find('QBXMLMsgsRs'):
+            records = self.records.setdefault(response_element.tag, list())
+            records += [Record(element) for element in response_element]
+
+    def add_elements(self, response_type, elements):
+        'add *Ret elements given as xml strings'
+        records = self.records.setdefault(response_type, list())
+        records += [Record(ET.fromstring(element.encode('utf-8'))) for element in elements]
+
+    def query(self, response_type):
+        return self.records.get(response_type, list())
+
+
+_corpus_cache = dict()
+_corpus_lock = threading.Lock()
+
+
+def load_corpus(fixture_dir=DEFAULT_FIXTURE_DIR):
+    'corpora are loaded once per directory and shared by all simulators'
+    with _corpus_lock:
+        if fixture_dir not in _corpus_cache:
+            corpus = ResponseCorpus.from_directory(fixture_dir)
+            for response_type, elements in DEFAULT_RESPONSES.items():
+                if not corpus.query(response_type):
+                    corpus.add_elements(response_type, elements)
+            _corpus_cache[fixture_dir] = corpus
+        return _corpus_cache[fixture_dir]
+
+
+class RequestProcessorSimulator(object):
+    """
+    Pure python stand in for the QBXMLRP2.RequestProcessor COM object answering qbxml
+    requests from a corpus of responses, by default the fixtures in tests/qbxml_files.
+
+    Queries support the TxnID, ListID, RefNumber and FullName lists, modified date
+    ranges (compared as text), AccountFilter, EntityFilter, ActiveStatus, MaxReturned,
+    IncludeRetElement and iterators.  Add and Mod
+    requests echo their contents back in a *Ret element with new ids, the corpus
+    itself is never changed.  Multi request envelopes and onError are honoured.
+
+    Every ProcessRequest call sleeps for latency plus byte_cost for every character of
+    request and response to approximate the cost of QuickBooks itself.
+    """
+    def __init__(self, corpus=None, fixture_dir=None, latency=0.0, byte_cost=0.0, sleep=time.sleep):
+        self.corpus = corpus if corpus is not None else load_corpus(fixture_dir or DEFAULT_FIXTURE_DIR)
+        self.latency = latency
+        self.byte_cost = byte_cost
+        self.sleep = sleep
+        self.connected = False
+        self.tickets = set()
+        self.iterators = dict()
+        self.id_sequence = itertools.count(1)
+        self.requests_processed = 0
+
+    # COM interface
+
+    def OpenConnection2(self, application_id, application_name, connection_type):
+        self.connected = True
+
+    def BeginSession(self, company_file_name, file_mode):
+        if not self.connected:
+            raise SimulatorError('BeginSession called before OpenConnection2')
+        ticket = '{{{}}}'.format(uuid.uuid4())
+        self.tickets.add(ticket)
+        return ticket
+
+    def EndSession(self, ticket):
+        self.tickets.discard(ticket)
+        self.iterators.clear()
+
+    def CloseConnection(self):
+        self.connected = False
+
+    def ProcessRequest(self, ticket, request):
+        if ticket not in self.tickets:
+            raise SimulatorError('Invalid ticket {}'.format(ticket))
+        response = self.process(request)
+        self.requests_processed += 1
+        delay = self.latency + self.byte_cost * (len(request) + len(response))
+        if delay:
+            self.sleep(delay)
+        return response
+
+    # request processing
+
+    def process(self, request):
+        if isinstance(request, six.text_type):
+            request = request.encode('utf-8')
+        messages = ET.fromstring(request).find('QBXMLMsgsRq')
+        on_error = messages.get('onError', STOP_ON_ERROR)
+        responses = list()
+        for element in messages:
+            response, severity = self.process_element(element)
+            responses.append(response)
+            if severity == 'Error' and on_error == STOP_ON_ERROR:
+                break
+        return '<?xml version="1.0" ?>\n<QBXML>\n<QBXMLMsgsRs>\n{}</QBXMLMsgsRs>\n</QBXML>\n'.format(
+            ''.join(responses)
+        )
+
+    def process_element(self, element):
+        'returns the formatted *Rs element and its status severity'
+        response_type = element.tag[:-2] + 'Rs'
+        attributes = OrderedDict()
+        if element.get('requestID') is not None:
+            attributes['requestID'] = element.get('requestID')
+
+        if element.tag.endswith('QueryRq'):
+            return self.query(element, response_type, attributes)
+        if element.tag.endswith('AddRq') or element.tag.endswith('ModRq'):
+            return self.add_or_modify(element, response_type, attributes)
+        return self.format_response(response_type, attributes, STATUS_OK)
+
+    def query(self, element, response_type, attributes):
+        iterator = element.get('iterator')
+        if iterator == 'Continue':
+            iterator_id = element.get('iteratorID')
+            records = self.iterators.pop(iterator_id, None)
+            if records is None:
+                code, severity, message = STATUS_INVALID_ITERATOR
+                status = (code, severity, message.format(iterator_id))
+                return self.format_response(response_type, attributes, status)
+        else:
+            iterator_id = '{{{}}}'.format(uuid.uuid4())
+            records = [i for i in self.corpus.query(response_type) if self.matches(i, element)]
+
+        max_returned = element.findtext('MaxReturned')
+        if max_returned:
+            records, remaining = records[:int(max_returned)], records[int(max_returned):]
+        else:
+            remaining = list()
+        if iterator:
+            attributes['iteratorRemainingCount'] = six.text_type(len(remaining))
+            attributes['iteratorID'] = iterator_id
+            if remaining:
+                self.iterators[iterator_id] = remaining
+
+        status = STATUS_OK if records else STATUS_NO_MATCH
+        includes = set(element_text(i) for i in element.findall('IncludeRetElement'))
+        return self.format_response(response_type, attributes, status, [i.project(includes) for i in records])
+
+    def matches(self, record, element):
+        filtered_by_id = False
+        for tag in ID_FILTERS:
+            values = [element_text(i) for i in element.findall(tag)]
+            if values and record.fields.get(tag) not in values:
+                return False
+            filtered_by_id = filtered_by_id or bool(values)
+
+        modified = record.fields.get('TimeModified', '')
+        from_date = element.findtext('ModifiedDateRangeFilter/FromModifiedDate') or element.findtext('FromModifiedDate')
+        if from_date and modified[:len(from_date)] < from_date:
+            return False
+        to_date = element.findtext('ModifiedDateRangeFilter/ToModifiedDate') or element.findtext('ToModifiedDate')
+        if to_date and modified[:len(to_date)] > to_date:
+            return False
+
+        accounts = [element_text(i) for i in element.findall('AccountFilter/FullName')]
+        if accounts and record.fields.get('AccountRef/FullName') not in accounts:
+            return False
+        for key in ('ListID', 'FullName'):
+            entities = [element_text(i) for i in element.findall('EntityFilter/' + key)]
+            if entities and not any(record.fields.get('{}/{}'.format(i, key)) in entities for i in ENTITY_REFS):
+                return False
+        active_status = element.findtext('ActiveStatus') or (None if filtered_by_id else DEFAULT_ACTIVE_STATUS)
+        if active_status and record.fields.get('IsActive', '') not in ACTIVE_STATUSES.get(active_status, ()):
+            return False
+        return True
+
+    def add_or_modify(self, element, response_type, attributes):
+        entity = element.tag[:-5]
+        operation = element.tag[-5:-2]
+        body = element.find(entity + operation)
+        if body is None:
+            code, severity, message = STATUS_INVALID_REQUEST
+            status = (code, severity, message.format(element.tag, entity + operation))
+            return self.format_response(response_type, attributes, status)
+
+        id_tag = 'ListID' if self.is_list_entity(entity) else 'TxnID'
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        timestamp = int(time.time())
+        ret = ET.Element(entity + 'Ret')
+        object_id = body.findtext(id_tag) or '{:X}-{}'.format(next(self.id_sequence), timestamp)
+        for tag, text in ((id_tag, object_id), ('TimeCreated', now), ('TimeModified', now), ('EditSequence', timestamp)):
+            ET.SubElement(ret, tag).text = six.text_type(text)
+        for child in body:
+            if child.tag not in (id_tag, 'EditSequence'):
+                ret.append(child)
+        return self.format_response(response_type, attributes, STATUS_OK, [element_xml(ret)])
+
+    @staticmethod
+    def is_list_entity(entity):
+        return entity in LIST_ENTITIES or (entity.startswith('Item') and not entity.startswith('ItemReceipt'))
+
+    def format_response(self, response_type, attributes, status, elements=()):
+        code, severity, message = status
+        attributes['statusCode'] = code
+        attributes['statusSeverity'] = severity
+        attributes['statusMessage'] = message
+        # status attributes come before the iterator attributes in QuickBooks responses
+        for name in ('iteratorRemainingCount', 'iteratorID'):
+            if name in attributes:
+                attributes[name] = attributes.pop(name)
+        formatted_attributes = ''.join(
+            ' {}="{}"'.format(name, escape_xml(value)) for name, value in attributes.items()
+        )
+        response = '<{}{}>\n{}</{}>\n'.format(
+            response_type, formatted_attributes, ''.join(i + '\n' for i in elements), response_type
+        )
+        return response, severity
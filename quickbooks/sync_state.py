@@ -0,0 +1,246 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from contextlib import closing
+import datetime
+import hashlib
+import json
+import sqlite3
+
+from .records import json_default
+
+
+QB_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# query params that look up specific entities instead of a modified date range
+LOOKUP_PARAMS = ('txn_ids', 'ref_numbers', 'list_ids', 'full_names')
+
+
+def parse_time_modified(value):
+    """
+    QuickBooks datetime e.g. 2016-09-23T12:27:12-07:00 as a naive UTC datetime so
+    values with different offsets compare correctly.  Values without an offset are
+    taken as they are.
+    """
+    if len(value) == 10:
+        return datetime.datetime.strptime(value, '%Y-%m-%d')
+    moment = datetime.datetime.strptime(value[:19], QB_DATETIME_FORMAT)
+    offset = value[19:]
+    if offset and offset != 'Z':
+        hours, minutes = offset[1:].split(':')
+        delta = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        moment = moment - delta if offset[0] == '+' else moment + delta
+    return moment
+
+
+def modified_since(watermark, overlap=datetime.timedelta(minutes=10)):
+    'FromModifiedDate for the watermark moved back by overlap, keeping its utc offset'
+    if len(watermark) == 10:
+        return watermark
+    moment = datetime.datetime.strptime(watermark[:19], QB_DATETIME_FORMAT) - overlap
+    return moment.strftime(QB_DATETIME_FORMAT) + watermark[19:]
+
+
+def is_lookup(query_params):
+    'True for queries of specific entities by id or name'
+    return any(query_params.get(i) for i in LOOKUP_PARAMS)
+
+
+def incremental_query_params(query_params, watermark, overlap=datetime.timedelta(minutes=10)):
+    """
+    query params that only fetch entities modified since the watermark.  Lookups by
+    id or name and queries without a watermark yet are left as they are.
+    """
+    if not watermark or is_lookup(query_params):
+        return query_params
+    return dict(
+        query_params,
+        initial=False,
+        days=None,
+        start_date=modified_since(watermark, overlap),
+        end_date=None,
+    )
+
+
+class WatermarkTracker(object):
+    'passes entities through and keeps the latest TimeModified among them'
+    def __init__(self):
+        self.latest = None
+        self._latest_moment = None
+
+    def track(self, entities):
+        for entity in entities:
+            time_modified = entity.get('TimeModified')
+            if time_modified:
+                moment = parse_time_modified(time_modified)
+                if self._latest_moment is None or moment > self._latest_moment:
+                    self.latest = time_modified
+                    self._latest_moment = moment
+            yield entity
+
+
+class WatermarkStore(object):
+    """
+    Latest TimeModified synced per query type and company file, kept in sqlite.
+
+    Example usage:
+
+        store = WatermarkStore('qb_state.sqlite3')
+        params = incremental_query_params(params, store.get('item', company_file))
+        tracker = WatermarkTracker()
+        entities = list(tracker.track(qb.quickbooks_query('item', params)))
+        # hand off entities, then move the watermark forward
+        store.advance('item', company_file, tracker.latest)
+    """
+    def __init__(self, path):
+        self.path = path
+        with closing(self.connect()) as connection, connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS watermarks ('
+                'query_type TEXT, company_file TEXT, time_modified TEXT, updated_at TEXT, '
+                'PRIMARY KEY (query_type, company_file))'
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def get(self, query_type, company_file):
+        with closing(self.connect()) as connection:
+            row = connection.execute(
+                'SELECT time_modified FROM watermarks WHERE query_type = ? AND company_file = ?',
+                (query_type, company_file)
+            ).fetchone()
+        return row[0] if row else None
+
+    def advance(self, query_type, company_file, time_modified):
+        'store time_modified as the watermark unless the current one is later, returns the watermark'
+        if not time_modified:
+            return self.get(query_type, company_file)
+        with closing(self.connect()) as connection, connection:
+            row = connection.execute(
+                'SELECT time_modified FROM watermarks WHERE query_type = ? AND company_file = ?',
+                (query_type, company_file)
+            ).fetchone()
+            if row and parse_time_modified(row[0]) >= parse_time_modified(time_modified):
+                return row[0]
+            connection.execute(
+                'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)',
+                (query_type, company_file, time_modified, datetime.datetime.utcnow().isoformat())
+            )
+        return time_modified
+
+
+def entity_id(entity):
+    return entity.get('ListID') or entity.get('TxnID')
+
+
+def fingerprint(entity):
+    """
+    EditSequence of the entity, QuickBooks changes it on every modification.  Entities
+    without one get a hash of their contents.
+    """
+    edit_sequence = entity.get('EditSequence')
+    if edit_sequence:
+        return edit_sequence
+    content = json.dumps(entity, sort_keys=True, default=json_default)
+    return 'sha1:' + hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class FingerprintDelta(object):
+    """
+    Change detection for one query run, see FingerprintIndex.delta.  Fingerprints of
+    the entities let through are only stored by commit, after they were sent on.
+    """
+    def __init__(self, index, query_type, company_file, known):
+        self.index = index
+        self.query_type = query_type
+        self.company_file = company_file
+        self.known = known
+        self.seen = set()
+        self.pending = dict()
+        self.suppressed = 0
+        self.forwarded = 0
+
+    def changed(self, entities):
+        'the new or changed entities among entities'
+        return list(self.iter_changed(entities))
+
+    def iter_changed(self, entities):
+        'changed yielding the new or changed entities as entities produces them'
+        for entity in entities:
+            key = entity_id(entity)
+            if key:
+                self.seen.add(key)
+                value = fingerprint(entity)
+                if self.known.get(key) == value:
+                    self.suppressed += 1
+                    continue
+                self.pending[key] = value
+            self.forwarded += 1
+            yield entity
+
+    def removed(self):
+        """
+        ids of entities known to the index that this run didn't return, only meaningful
+        once every page of a query covering all entities has been passed to changed
+        """
+        return sorted(key for key in self.known if key not in self.seen)
+
+    def commit(self, removed=()):
+        'store the fingerprints let through so far and forget the removed ids'
+        self.index.update(self.query_type, self.company_file, self.pending, removed)
+        self.known.update(self.pending)
+        for key in removed:
+            self.known.pop(key, None)
+        self.pending = dict()
+
+
+class FingerprintIndex(object):
+    """
+    ListID or TxnID to fingerprint of every entity sent on per query type and company
+    file, kept in sqlite so unchanged entities aren't forwarded again.
+
+    Example usage:
+
+        index = FingerprintIndex('qb_state.sqlite3')
+        delta = index.delta('item', company_file)
+        for page in qb.quickbooks_query_pages('item', {'initial': True}):
+            send(delta.changed(page))
+            delta.commit()
+        removed = delta.removed()
+        send_removed(removed)
+        delta.commit(removed)
+    """
+    def __init__(self, path):
+        self.path = path
+        with closing(self.connect()) as connection, connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS fingerprints ('
+                'query_type TEXT, company_file TEXT, entity_id TEXT, fingerprint TEXT, '
+                'PRIMARY KEY (query_type, company_file, entity_id))'
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def load(self, query_type, company_file):
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                'SELECT entity_id, fingerprint FROM fingerprints WHERE query_type = ? AND company_file = ?',
+                (query_type, company_file)
+            )
+            return dict(rows.fetchall())
+
+    def delta(self, query_type, company_file):
+        return FingerprintDelta(self, query_type, company_file, self.load(query_type, company_file))
+
+    def update(self, query_type, company_file, fingerprints, removed=()):
+        with closing(self.connect()) as connection, connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)',
+                [(query_type, company_file, key, value) for key, value in fingerprints.items()]
+            )
+            connection.executemany(
+                'DELETE FROM fingerprints WHERE query_type = ? AND company_file = ? AND entity_id = ?',
+                [(query_type, company_file, key) for key in removed]
+            )
@@ -0,0 +1,61 @@
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from ..archive import Archive, find_exchange, iter_index, segment_paths
+from ..qbcom import QuickBooks
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_quickbooks_exchanges(self):
+        archive = Archive(self.directory)
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', archive=archive)
+        qb.begin_session()
+        try:
+            qb.call('HostQueryRq', save_xml=True)
+            qb.process_request('ItemQueryRq', qb.format_request('ItemQueryRq', [('ListID', ['missing'])]), surrogate_key=7)
+            qb.format_request('ItemReceiptAddRq', [('ItemReceiptAdd', (('RefNumber', '1'),))], save_xml=True)
+        finally:
+            qb.end_session()
+        archive.close()
+
+        entries = list(iter_index(self.directory))
+        self.assertEquals(
+            [(entry['request_type'], entry['surrogate_key'], entry['status_code']) for entry in entries],
+            [('HostQueryRq', None, '0'), ('ItemQueryRq', 7, '1'), ('ItemReceiptAddRq', None, None)],
+        )
+        self.assertTrue(entries[0]['latency'] >= 0)
+
+        exchange = find_exchange(self.directory, entries[1]['id'][:8])
+        self.assertIn('<ListID>missing</ListID>', exchange['request'])
+        self.assertIn('ItemQueryRs', exchange['response'])
+        self.assertEquals(find_exchange(self.directory, entries[2]['id'])['response'], None)
+
+        # the segment is a plain gzip file of JSON lines
+        with gzip.open(segment_paths(self.directory)[0]) as fin:
+            lines = [json.loads(line.decode('utf-8')) for line in fin]
+        self.assertEquals([line['id'] for line in lines], [entry['id'] for entry in entries])
+
+    def test_rotation(self):
+        archive = Archive(self.directory, max_segment_bytes=1, max_segments=3)
+        for number in range(5):
+            archive.record('HostQueryRq', '<HostQueryRq>{}</HostQueryRq>'.format(number))
+        archive.close()
+        self.assertEquals(len(segment_paths(self.directory)), 3)
+        requests = [find_exchange(self.directory, entry['id'])['request'] for entry in iter_index(self.directory)]
+        self.assertEquals(requests, ['<HostQueryRq>{}</HostQueryRq>'.format(number) for number in range(2, 5)])
+
+    def test_full_buffer(self):
+        archive = Archive(self.directory, buffer_size=1)
+        archive.start = lambda: None
+        self.assertTrue(archive.record('HostQueryRq', ''))
+        self.assertFalse(archive.record('HostQueryRq', ''))
+        self.assertEquals(archive.dropped, 1)
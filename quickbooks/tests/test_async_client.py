@@ -0,0 +1,69 @@
+from concurrent.futures import TimeoutError
+import threading
+import unittest
+
+from ..async_client import AsyncQuickBooks
+from ..processors import SimulatorBackend
+from ..qbcom import QuickBooks
+
+
+class TestAsyncQuickBooks(unittest.TestCase):
+    def setUp(self):
+        self.threads = dict()
+        self.qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator')
+        self.qb.metrics.add_hook(self.record_thread)
+        self.client = AsyncQuickBooks(self.qb)
+        self.client.start().result()
+
+    def tearDown(self):
+        self.client.close().result()
+
+    def record_thread(self, name, labels, seconds):
+        self.threads.setdefault(labels.get('stage'), set()).add(threading.current_thread().name)
+
+    def test_concurrent_calls(self):
+        purchase_orders = list(self.client.query('purchase_order', {'initial': True}))
+        txn_ids = [purchase_order['TxnID'] for purchase_order in purchase_orders][:10]
+        futures = [self.client.call('PurchaseOrderQueryRq', [('TxnID', [txn_id])]) for txn_id in txn_ids]
+        self.assertEquals(
+            [future.result()['PurchaseOrderQueryRs']['PurchaseOrderRet']['TxnID'] for future in futures], txn_ids
+        )
+
+        # the session and every request on one thread, the caller never touches COM
+        com_threads = self.threads['begin'] | self.threads['process_request']
+        self.assertEquals(len(com_threads), 1)
+        self.assertTrue(list(com_threads)[0].startswith('quickbooks-com'))
+        self.assertNotIn(threading.current_thread().name, self.threads['format'] | self.threads['parse'])
+
+    def test_paged_query(self):
+        processed = self.qb.request_processor.requests_processed
+        everything = list(self.qb.quickbooks_query('purchase_order', {'initial': True}, page_size=5))
+        pages = self.qb.request_processor.requests_processed - processed
+        elements = list(self.client.query('purchase_order', {'initial': True}, page_size=5))
+        self.assertEquals(elements, everything)
+        self.assertEquals(self.qb.request_processor.requests_processed - processed, 2 * pages)
+        self.assertEquals(list(self.client.query('item', {'list_ids': ['missing']})), [])
+
+    def test_timeout(self):
+        self.client.close().result()
+        self.client = AsyncQuickBooks(QuickBooks(
+            company_file_name='simulated.QBW', backend='simulator', backend_options={'latency': 0.2},
+        ))
+        self.client.start().result()
+        slow = self.client.call('HostQueryRq', timeout=0.05)
+        # still queued behind the slow request when it times out, never sent
+        dropped = self.client.call('HostQueryRq', timeout=0.1)
+        self.assertRaises(TimeoutError, slow.result)
+        self.assertRaises(TimeoutError, dropped.result)
+        response = self.client.call('HostQueryRq').result()
+        self.assertEquals(response['HostQueryRs']['@statusCode'], '0')
+        self.assertEquals(self.client.qb.request_processor.requests_processed, 2)
+
+    def test_close_leaves_quickbooks_running(self):
+        closed = list()
+        backend = SimulatorBackend()
+        backend.close_by_force = closed.append
+        with AsyncQuickBooks(company_file_name='simulated.QBW', backend=backend) as client:
+            self.assertEquals(client.call('HostQueryRq').result()['HostQueryRs']['@statusCode'], '0')
+        self.assertFalse(client.qb.is_open)
+        self.assertEquals(closed, [])
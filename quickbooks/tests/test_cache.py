@@ -0,0 +1,158 @@
+from collections import OrderedDict
+import unittest
+
+from six.moves import cPickle as pickle
+
+from ..cache import QueryCache, entity_family, written_families
+from ..metrics import CACHE_HITS
+from ..qbcom import QuickBooks
+from ..qbxml_templates import format_request
+from ..records import record_class
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = QueryCache(ttls={'ItemQueryRq': 300, 'CheckQueryRq': 60}, clock=lambda: self.now)
+
+    def test_entity_families(self):
+        self.assertEquals(entity_family('ItemQueryRq'), 'Item')
+        self.assertEquals(entity_family('ItemInventoryAddRq'), 'Item')
+        self.assertEquals(entity_family('ItemReceiptModRq'), 'ItemReceipt')
+        self.assertEquals(entity_family('PurchaseOrderQueryRq'), 'PurchaseOrder')
+
+        self.assertEquals(written_families(format_request('CheckQueryRq')), set())
+        self.assertEquals(
+            written_families(format_request('ItemReceiptAddRq', [('ItemReceiptAdd', (('RefNumber', '1'),))])),
+            set(['ItemReceipt', 'Item', 'PurchaseOrder']),
+        )
+        self.assertEquals(
+            written_families(format_request('ListDelRq', [('ListDelType', 'ItemNonInventory'), ('ListID', '1')])),
+            set(['Item']),
+        )
+        self.assertEquals(written_families(format_request('TxnDelRq', [('TxnID', '1')])), None)
+
+    def test_ttl_per_type(self):
+        key = self.cache.key('response', 'CheckQueryRq', [('TxnID', ['1'])])
+        self.assertTrue(self.cache.put(key, 'CheckQueryRq', {'CheckQueryRs': {}}))
+        self.assertFalse(self.cache.put(self.cache.key('response', 'HostQueryRq'), 'HostQueryRq', {}))
+        self.assertEquals(len(self.cache), 1)
+
+        self.now += 59
+        self.assertEquals(self.cache.get(key), {'CheckQueryRs': {}})
+        self.now += 1
+        self.assertEquals(self.cache.get(key), None)
+        self.assertEquals((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEquals((len(self.cache), self.cache.size), (0, 0))
+
+    def test_copies_and_normalized_keys(self):
+        key = self.cache.key('response', 'ItemQueryRq', [('ListID', ['1']), ('Filter', {'a': '1', 'b': '2'})])
+        response = {'ItemQueryRs': {'ItemServiceRet': {'ListID': '1'}}}
+        self.cache.put(key, 'ItemQueryRq', response)
+        response['ItemQueryRs']['ItemServiceRet']['category'] = 'changed'
+
+        same = self.cache.key('response', 'ItemQueryRq', (('ListID', ('1',)), ('Filter', {'b': '2', 'a': '1'})))
+        cached = self.cache.get(same)
+        self.assertEquals(cached, {'ItemQueryRs': {'ItemServiceRet': {'ListID': '1'}}})
+        cached['ItemQueryRs'].clear()
+        self.assertEquals(self.cache.get(key), {'ItemQueryRs': {'ItemServiceRet': {'ListID': '1'}}})
+
+        ordered = self.cache.key('response', 'ItemQueryRq', OrderedDict([('b', '2'), ('a', '1')]))
+        self.assertNotEqual(ordered, self.cache.key('response', 'ItemQueryRq', OrderedDict([('a', '1'), ('b', '2')])))
+
+    def test_least_recently_used_evicted(self):
+        cache = QueryCache(ttls={'ItemQueryRq': 300}, max_entries=2, clock=lambda: self.now)
+        keys = [cache.key('response', 'ItemQueryRq', [('ListID', [str(i)])]) for i in range(3)]
+        cache.put(keys[0], 'ItemQueryRq', {'ListID': '0'})
+        cache.put(keys[1], 'ItemQueryRq', {'ListID': '1'})
+        cache.get(keys[0])
+        cache.put(keys[2], 'ItemQueryRq', {'ListID': '2'})
+        self.assertEquals([cache.get(key) is not None for key in keys], [True, False, True])
+
+        payload = len(pickle.dumps({'ListID': '0'}, pickle.HIGHEST_PROTOCOL))
+        cache = QueryCache(ttls={'ItemQueryRq': 300}, max_bytes=payload * 2, clock=lambda: self.now)
+        for index, key in enumerate(keys):
+            cache.put(key, 'ItemQueryRq', {'ListID': str(index)})
+        self.assertEquals((len(cache), cache.size), (2, payload * 2))
+        self.assertEquals(cache.get(keys[0]), None)
+
+    def test_invalidation(self):
+        item = self.cache.key('response', 'ItemQueryRq', [('ListID', ['1'])])
+        check = self.cache.key('response', 'CheckQueryRq', [('TxnID', ['1'])])
+        self.cache.put(item, 'ItemQueryRq', {})
+        self.cache.put(check, 'CheckQueryRq', {})
+
+        self.cache.invalidate_request(format_request('ItemReceiptAddRq', [('ItemReceiptAdd', (('RefNumber', '1'),))]))
+        self.assertEquals(self.cache.get(item), None)
+        self.assertEquals(self.cache.get(check), {})
+
+        self.cache.invalidate_request(format_request('TxnDelRq', [('TxnID', '1')]))
+        self.assertEquals(len(self.cache), 0)
+
+    def test_records_pickle(self):
+        ret = record_class('ItemServiceRet', ('ListID', 'Name'))
+        record = ret([('ListID', '1'), ('Name', 'Service'), ('ItemRef', {'ListID': '2'})])
+        self.assertEquals(pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL)), record)
+
+
+class TestCachedQueries(unittest.TestCase):
+    def setUp(self):
+        self.cache = QueryCache(ttls={'ItemQueryRq': 300, 'CheckQueryRq': 300, 'PurchaseOrderQueryRq': 300})
+        self.qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', cache=self.cache)
+        self.qb.begin_session()
+        self.simulator = self.qb.request_processor
+
+    def tearDown(self):
+        self.qb.end_session()
+
+    def test_read_through(self):
+        full_names = [list(self.qb.quickbooks_query('item', {'initial': True}))[0]['FullName']]
+        items = list(self.qb.quickbooks_query('item', {'full_names': full_names}))
+        self.assertEquals(self.simulator.requests_processed, 2)
+
+        cached = list(self.qb.quickbooks_query('item', {'full_names': full_names}))
+        self.assertEquals(cached, items)
+        self.assertEquals(cached[0]['category'], items[0]['category'])
+        self.assertEquals(self.simulator.requests_processed, 2)
+        self.assertEquals(self.qb.metrics.counter(CACHE_HITS).values, {(('request_type', 'ItemQueryRq'),): 1})
+
+        # neither are queries with other post filters
+        list(self.qb.quickbooks_query('item', {'full_names': full_names, 'status': 'inactive'}))
+        self.assertEquals(self.simulator.requests_processed, 3)
+
+        # paged queries are not cached
+        list(self.qb.quickbooks_query('item', {'full_names': full_names}, page_size=10))
+        self.assertEquals(self.simulator.requests_processed, 4)
+
+        response = self.qb.call('CheckQueryRq', request_dictionary=[('MaxReturned', '1')])
+        self.assertEquals(self.qb.call('CheckQueryRq', request_dictionary=[('MaxReturned', '1')]), response)
+        self.assertEquals(self.simulator.requests_processed, 5)
+
+    def test_writes_invalidate(self):
+        list(self.qb.quickbooks_query('item', {'initial': True}))
+        list(self.qb.quickbooks_query('check', {'initial': True}))
+        self.assertEquals(len(self.cache), 2)
+
+        self.qb.call('ItemReceiptAddRq', request_dictionary=[('ItemReceiptAdd', (('RefNumber', 'SOC18731'),))])
+        self.assertEquals(len(self.cache), 1)
+        list(self.qb.quickbooks_query('check', {'initial': True}))
+        list(self.qb.quickbooks_query('item', {'initial': True}))
+        self.assertEquals(self.simulator.requests_processed, 4)
+
+        # so do writes inside a batch
+        sections = [(0, self.qb.format_request_section('CheckModRq', [('CheckMod', (('TxnID', '1'),))], 0))]
+        self.qb.call_batch(sections)
+        list(self.qb.quickbooks_query('check', {'initial': True}))
+        self.assertEquals(self.simulator.requests_processed, 6)
+
+    def test_lazy_elements_cached_as_dictionaries(self):
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', cache=self.cache, lazy=True)
+        qb.begin_session()
+        try:
+            purchase_orders = list(qb.quickbooks_query('purchase_order', {'initial': True}))
+            cached = list(qb.quickbooks_query('purchase_order', {'initial': True}))
+            self.assertEquals(qb.request_processor.requests_processed, 1)
+            self.assertEquals([i['TxnID'] for i in cached], [i['TxnID'] for i in purchase_orders])
+            self.assertEquals(cached[0]['po_lines'][0]['TxnLineID'], purchase_orders[0]['po_lines'][0]['TxnLineID'])
+        finally:
+            qb.end_session()
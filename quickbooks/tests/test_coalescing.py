@@ -0,0 +1,112 @@
+import json
+import unittest
+
+from ..coalescing import Coalescer
+from ..qbcom import QuickBooks
+
+
+ITEM_IDS = ['80003A41-1474655232', '80002CBD-1426114159']
+
+
+def item_query(surrogate_key, list_id):
+    return (surrogate_key, 'item', ('ItemQueryRq', [('ListID', list_id)]))
+
+
+class TestCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator')
+        self.qb.begin_session()
+
+    def tearDown(self):
+        self.qb.end_session()
+
+    def send(self, coalescer):
+        responses = dict()
+        for request_id, (_, _, (request_type, request_dict)) in enumerate(coalescer.requests):
+            response = self.qb.call(request_type, request_dictionary=request_dict)
+            for entry, entry_response in coalescer.fan_out(request_id, response):
+                if entry_response is None:
+                    entry_response = self.qb.call(*entry[2])
+                responses[entry[0]] = entry_response
+        return responses
+
+    def test_single_id_queries_are_merged(self):
+        request_list = [
+            item_query(1, [ITEM_IDS[0]]),
+            item_query(2, ITEM_IDS[1]),
+            item_query(3, ['missing']),
+            # the same query again
+            item_query(4, [ITEM_IDS[0]]),
+        ]
+        coalescer = Coalescer(request_list)
+        self.assertEquals(coalescer.requests, [
+            (None, None, ('ItemQueryRq', [('ListID', ITEM_IDS + ['missing'])])),
+        ])
+        self.assertEquals(coalescer.merged, 3)
+
+        responses = self.send(coalescer)
+        # the id that wasn't found is sent again on its own
+        self.assertEquals(self.qb.request_processor.requests_processed, 2)
+        for surrogate_key, list_id in ((1, ITEM_IDS[0]), (2, ITEM_IDS[1]), (3, 'missing'), (4, ITEM_IDS[0])):
+            expected = self.qb.call('ItemQueryRq', [('ListID', [list_id])])
+            self.assertEquals(json.dumps(responses[surrogate_key]), json.dumps(expected))
+
+        # the status QuickBooks gives the merged query isn't the one of the missing id
+        response = {'ItemQueryRs': {'@statusCode': '500', '@statusSeverity': 'Warn', 'ItemServiceRet': {'ListID': ITEM_IDS[0]}}}
+        fanned_out = list(Coalescer(request_list[:3]).fan_out(0, response))
+        self.assertEquals([entry_response is None for _, entry_response in fanned_out], [False, True, True])
+
+    def test_queries_are_not_merged_across_other_requests(self):
+        receipt = (5, 'receipt', ('ItemReceiptAddRq', [('ItemReceiptAdd', (('RefNumber', 'SOC18731'),))]))
+        request_list = [item_query(1, ITEM_IDS[0]), receipt, item_query(2, ITEM_IDS[1]), item_query(3, ITEM_IDS[0])]
+        coalescer = Coalescer(request_list)
+        self.assertEquals([i[2][0] for i in coalescer.requests], ['ItemQueryRq', 'ItemReceiptAddRq', 'ItemQueryRq'])
+        # a lone query is sent as is
+        self.assertEquals(coalescer.requests[0], request_list[0])
+        self.assertEquals(coalescer.requests[2][2][1], [('ListID', ITEM_IDS[1:] + ITEM_IDS[:1])])
+        self.assertEquals(sorted(self.send(coalescer)), [1, 2, 3, 5])
+
+    def test_identical_and_incompatible_queries(self):
+        date_query = ('ItemQueryRq', [('FromModifiedDate', '2016-01-01')])
+        request_list = [
+            (1, 'item', date_query),
+            (2, 'item', date_query),
+            # other contents, not merged with each other
+            (3, 'po', ('PurchaseOrderQueryRq', [('RefNumber', 'a'), ('IncludeLineItems', '1')])),
+            (4, 'po', ('PurchaseOrderQueryRq', [('RefNumber', 'b')])),
+        ]
+        coalescer = Coalescer(request_list)
+        self.assertEquals(coalescer.requests, [request_list[0], request_list[2], request_list[3]])
+        self.assertEquals(coalescer.targets[0], [(request_list[0], None, None), (request_list[1], None, None)])
+        self.assertEquals(Coalescer(request_list, coalesce=False).requests, request_list)
+
+        # responses without the filter element can't be fanned out
+        projected = [
+            (i, 'item', ('ItemQueryRq', [('ListID', list_id), ('IncludeRetElement', ['Name'])]))
+            for i, list_id in enumerate(ITEM_IDS)
+        ]
+        self.assertEquals(Coalescer(projected).requests, projected)
+        projected = [
+            (i, 'item', ('ItemQueryRq', [('ListID', list_id), ('IncludeRetElement', ['ListID', 'Name'])]))
+            for i, list_id in enumerate(ITEM_IDS)
+        ]
+        self.assertEquals(len(Coalescer(projected).requests), 1)
+
+    def test_first_occurrence_order(self):
+        date_query = ('ItemQueryRq', [('FromModifiedDate', '2016-01-01')])
+        request_list = [item_query(1, ITEM_IDS[0]), (2, 'item', date_query), item_query(3, ITEM_IDS[1]), (4, 'item', date_query)]
+        coalescer = Coalescer(request_list)
+        self.assertEquals(coalescer.requests, [
+            (None, None, ('ItemQueryRq', [('ListID', ITEM_IDS)])),
+            request_list[1],
+        ])
+
+    def test_max_values(self):
+        request_list = [item_query(i, 'id{}'.format(i)) for i in range(5)]
+        coalescer = Coalescer(request_list, max_values=2)
+        self.assertEquals([i[2][1][0][1] for i in coalescer.requests], [['id0', 'id1'], ['id2', 'id3'], ['id4']])
+
+    def test_failed_merged_query(self):
+        coalescer = Coalescer([item_query(1, ITEM_IDS[0]), item_query(2, ITEM_IDS[1])])
+        response = {'ItemQueryRs': {'@statusCode': '3120', '@statusSeverity': 'Error'}}
+        self.assertEquals([response for _, response in coalescer.fan_out(0, response)], [None, None])
@@ -0,0 +1,72 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..columnar import Column, NUMBER, column_batches, convert_value, numpy, pyarrow, write_arrow, write_parquet
+from ..qbcom import QuickBooks
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestColumnBatches(unittest.TestCase):
+    def setUp(self):
+        self.qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator')
+        self.qb.begin_session()
+
+    def tearDown(self):
+        self.qb.end_session()
+
+    def test_column_values(self):
+        entity = {'SalesOrPurchase': {'Price': '2.50'}, 'Memo': {'@attr': 'x', '#text': 'memo'}}
+        self.assertEquals(Column('SalesPrice', NUMBER, ['SalesPrice', 'SalesOrPurchase/Price']).value(entity), '2.50')
+        self.assertEquals(Column('Memo').value(entity), 'memo')
+        self.assertEquals(Column('Missing', paths=['SalesOrPurchase/Desc']).value(entity), None)
+        self.assertEquals(convert_value('datetime', '2016-09-23T12:27:12-07:00'), datetime.datetime(2016, 9, 23, 19, 27, 12))
+
+    def test_item_batches(self):
+        items = list(self.qb.quickbooks_query('item', {'initial': True}))
+        batches = list(column_batches('item', items, batch_size=200))
+        self.assertEquals([len(i) for i in batches], [200, 200, 21])
+
+        batch = batches[0]
+        self.assertEquals(batch.columns['ListID'][0], items[0]['ListID'])
+        self.assertEquals(batch.columns['category'][0], items[0]['category'])
+        self.assertEquals(batch.columns['QuantityOnHand'].dtype, numpy.dtype('float64'))
+        self.assertEquals(batch.columns['TimeModified'].dtype, numpy.dtype('datetime64[s]'))
+        self.assertEquals(batch.columns['Sublevel'].dtype, numpy.dtype('int64'))
+
+        quantities = numpy.concatenate([i.columns['QuantityOnHand'] for i in batches])
+        expected = sum(float(i['QuantityOnHand']) for i in items if 'QuantityOnHand' in i)
+        self.assertAlmostEqual(numpy.nansum(quantities), expected)
+        # non inventory items have no quantity and their price is nested
+        non_inventory = [n for n, i in enumerate(items) if i['category'] == 'ItemNonInventoryRet']
+        self.assertTrue(non_inventory)
+        row = non_inventory[0]
+        self.assertTrue(numpy.isnan(quantities[row]))
+        prices = numpy.concatenate([i.columns['SalesPrice'] for i in batches])
+        self.assertEquals(prices[row], float(items[row]['SalesOrPurchase']['Price']))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_write_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            checks = list(self.qb.quickbooks_query('check', {'start_date': '2009-01-01'}))
+            path = os.path.join(directory, 'checks.parquet')
+            self.assertEquals(write_parquet(path, 'check', checks, batch_size=4), len(checks))
+            table = pyarrow.parquet.read_table(path)
+            self.assertEquals(table.num_rows, len(checks))
+            self.assertEquals(table.column('TxnID').to_pylist(), [i['TxnID'] for i in checks])
+            self.assertEquals(
+                table.column('TxnDate').to_pylist(),
+                [datetime.datetime.strptime(i['TxnDate'], '%Y-%m-%d').date() for i in checks]
+            )
+
+            purchase_orders = list(self.qb.quickbooks_query('purchase_order', {'initial': True}))
+            path = os.path.join(directory, 'purchase_orders.arrow')
+            self.assertEquals(write_arrow(path, 'purchase_order', purchase_orders, batch_size=10), len(purchase_orders))
+            table = pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+            self.assertEquals(table.column('TotalAmount').to_pylist(), [float(i['TotalAmount']) for i in purchase_orders])
+            self.assertEquals(table.column('IsFullyReceived').to_pylist(), [i['IsFullyReceived'] == 'true' for i in purchase_orders])
+        finally:
+            shutil.rmtree(directory)
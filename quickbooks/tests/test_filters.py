@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import unittest
+
+from constants import DISTRIBUTOR_ACCOUNTS
+from ..exceptions import QuickBooksError
+from ..filters import QueryFilters
+from ..metrics import ELEMENTS_DROPPED, FILTERS_PUSHED
+from ..qbcom import QuickBooks
+from ..qbxml_request_formatter import CheckQueryRequest, ItemQueryRequest
+
+
+class TestQueryFilters(unittest.TestCase):
+    def test_pushed_and_post_filters(self):
+        filters = QueryFilters('PurchaseOrderQueryRq', {
+            'entity_names': ['Arco Inc.'], 'class_list_ids': ['1'], 'class_names': ['Gifting'], 'status': 'open',
+        })
+        self.assertEquals(filters.pushed, OrderedDict([('entity', ('EntityFilter', {'FullName': ['Arco Inc.']}))]))
+        self.assertEquals(list(filters.post), ['class', 'status'])
+
+        elements = [
+            {'ClassRef': {'ListID': '1'}, 'IsFullyReceived': 'false'},
+            {'ClassRef': {'ListID': '2'}},
+            {'ClassRef': {'ListID': '1'}, 'IsFullyReceived': 'true'},
+        ]
+        self.assertEquals(list(filters.filter(elements)), elements[:1])
+        self.assertEquals((filters.returned, filters.dropped, filters.kept), (3, {'class': 1, 'status': 1}, 1))
+
+        # lookups can't have filter elements
+        filters = QueryFilters('PurchaseOrderQueryRq', {'entity_names': ['Arco Inc.']}, lookup=True)
+        self.assertEquals((list(filters.pushed), list(filters.post)), ([], ['entity']))
+        self.assertRaises(QuickBooksError, QueryFilters, 'PurchaseOrderQueryRq', {'account_names': ['a']}, lookup=True)
+        self.assertRaises(QuickBooksError, QueryFilters, 'CheckQueryRq', {'status': 'open'})
+
+    def test_filter_elements_in_schema_order(self):
+        request = ItemQueryRequest(start_date='2016-01-01', max_returned=10, status='all')
+        self.assertEquals(
+            [key for key, _ in request.request_dictionary], ['MaxReturned', 'ActiveStatus', 'FromModifiedDate']
+        )
+        request = CheckQueryRequest(start_date='2016-01-01', entity_list_ids=['1'])
+        self.assertEquals(
+            request.request_dictionary[1:3],
+            [('EntityFilter', {'ListID': ['1']}), ('AccountFilter', {'FullName': DISTRIBUTOR_ACCOUNTS})],
+        )
+        # checks looked up by id are not limited to the distributor accounts
+        self.assertEquals(CheckQueryRequest(txn_ids=['1']).filters.post, OrderedDict())
+
+
+class TestFilteredQueries(unittest.TestCase):
+    def setUp(self):
+        self.qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator')
+        self.qb.begin_session()
+
+    def tearDown(self):
+        self.qb.end_session()
+
+    def test_purchase_orders(self):
+        everything = self.qb.quickbooks_query('purchase_order', {'initial': True, 'class_names': []})
+        gifting = self.qb.quickbooks_query('purchase_order', {'initial': True})
+        self.assertEquals(gifting, [i for i in everything if i['ClassRef']['FullName'] == 'Gifting'])
+
+        vendor = gifting[0]['VendorRef']['FullName']
+        results = self.qb.quickbooks_query('purchase_order', {'initial': True, 'entity_names': [vendor], 'status': 'open'})
+        self.assertEquals(results, [
+            i for i in gifting if i['VendorRef']['FullName'] == vendor and i.get('IsFullyReceived') != 'true'
+        ])
+        # the vendor was filtered by QuickBooks, classes and status afterwards
+        self.assertEquals(
+            self.qb.metrics.counter(FILTERS_PUSHED).values,
+            {(('predicate', 'entity'), ('request_type', 'PurchaseOrderQueryRq')): 1},
+        )
+        dropped = self.qb.metrics.counter(ELEMENTS_DROPPED).values
+        self.assertEquals(sorted(set(labels[0][1] for labels in dropped)), ['class', 'status'])
+
+    def test_paged_item_status(self):
+        pages = list(self.qb.quickbooks_query_pages('item', {'initial': True, 'status': 'inactive'}, page_size=100))
+        self.assertEquals(pages, [[]])
+        items = list(self.qb.quickbooks_query('item', {'initial': True, 'status': 'active'}))
+        self.assertEquals(len(items), 421)
@@ -0,0 +1,40 @@
+import unittest
+
+from ..handoff import chunk_entities, serialized_size
+
+
+class TestChunkEntities(unittest.TestCase):
+    def test_chunk_by_count(self):
+        chunks = list(chunk_entities(iter(range(7)), max_count=3))
+        self.assertEquals(chunks, [(0, [0, 1, 2], False), (1, [3, 4, 5], False), (2, [6], True)])
+
+        chunks = list(chunk_entities(iter(range(6)), max_count=3))
+        self.assertEquals(chunks, [(0, [0, 1, 2], False), (1, [3, 4, 5], True)])
+
+    def test_end_of_stream_is_always_sent(self):
+        self.assertEquals(list(chunk_entities(iter([]), max_count=3)), [(0, [], True)])
+        self.assertEquals(list(chunk_entities(iter([1, 2]))), [(0, [1, 2], True)])
+
+    def test_chunk_by_bytes(self):
+        entities = [{'Name': 'x' * size} for size in (10, 10, 40, 5, 5)]
+        sizes = [serialized_size(i) for i in entities]
+        chunks = list(chunk_entities(entities, max_bytes=sizes[0] * 2))
+        self.assertEquals([len(chunk) for _, chunk, _ in chunks], [2, 1, 2])
+        self.assertEquals([last for _, _, last in chunks], [False, False, True])
+
+        # whichever limit is reached first closes the chunk
+        chunks = list(chunk_entities(entities, max_count=1, max_bytes=1000))
+        self.assertEquals([sequence for sequence, _, _ in chunks], [0, 1, 2, 3, 4])
+
+    def test_entities_are_consumed_lazily(self):
+        produced = list()
+
+        def entities():
+            for i in range(10):
+                produced.append(i)
+                yield i
+
+        chunks = chunk_entities(entities(), max_count=4)
+        next(chunks)
+        # the first chunk is sent as soon as the entity after it shows it isn't the last
+        self.assertEquals(produced, [0, 1, 2, 3, 4])
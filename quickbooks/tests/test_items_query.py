@@ -1,12 +1,13 @@
 import datetime
 import os
 import unittest
+import xml.etree.ElementTree as ET
 
 from freezegun import freeze_time
 
 from config import QB_LOOKUP, celery_app
 from ..qbcom import QuickBooks
-from ..qbxml_serializers import parse_response
+from ..qbxml_serializers import iter_parse_response, parse_response
 from ..qbxml_request_formatter import ItemQueryRequest
 from . import get_elements, get_values_by_tag
 
@@ -75,6 +76,30 @@ class TestItemRequests(unittest.TestCase):
             expected_formatted_request = fin.read()
         self.assertEquals(test_request, expected_formatted_request)
 
+    def test_iterator_request(self):
+        request_object = ItemQueryRequest(initial=True, max_returned=100)
+        test_request = self.qb_com.format_request(
+            request_object.request_type,
+            request_dictionary=request_object.request_dictionary,
+            attributes=request_object.request_attributes,
+        )
+        self.assertEquals(get_values_by_tag(test_request, 'MaxReturned'), {'100'})
+        request_element = ET.fromstring(test_request).find('QBXMLMsgsRq/ItemQueryRq')
+        self.assertEquals(request_element.get('iterator'), 'Start')
+
+        # following pages continue the iterator returned by quickbooks
+        request_object.continue_iterator('{ae0f6b4e-1a43-4b5c-9b26-cf4d5ee1e9a8}')
+        test_request = self.qb_com.format_request(
+            request_object.request_type,
+            request_dictionary=request_object.request_dictionary,
+            attributes=request_object.request_attributes,
+        )
+        request_element = ET.fromstring(test_request).find('QBXMLMsgsRq/ItemQueryRq')
+        self.assertEquals(request_element.get('iterator'), 'Continue')
+        self.assertEquals(
+            request_element.get('iteratorID'), '{ae0f6b4e-1a43-4b5c-9b26-cf4d5ee1e9a8}'
+        )
+
     def test_listid_lookup(self):
         list_ids = [
             '8000380C-1459355152',
@@ -199,4 +224,20 @@ class TestItemRequests(unittest.TestCase):
             )), 2
         )
 
+    def test_streaming_item_query_response(self):
+        request_object = ItemQueryRequest(days=20)
+        with open(self.item_query_response) as fin:
+            quickbooks_response = fin.read()
 
+        parsed_elements = list(request_object.get_response_elements(
+            parse_response(request_object.request_type, quickbooks_response)
+        ))
+        response_stream = iter_parse_response(
+            request_object.request_type, quickbooks_response
+        )
+        streamed_elements = list(
+            request_object.get_response_elements(response_stream)
+        )
+        # streaming yields the same elements in the same order as the full parse
+        self.assertEquals(streamed_elements, parsed_elements)
+        self.assertEquals(response_stream.status['@statusCode'], '0')
@@ -0,0 +1,88 @@
+import json
+import os
+import unittest
+
+from ..lazy_response import LazyResponse
+from ..qbcom import QuickBooks
+from ..qbxml_request_formatter import PurchaseOrderQueryRequest
+from ..qbxml_serializers import iter_parse_response, parse_response
+
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qbxml_files')
+
+
+class TestLazyResponse(unittest.TestCase):
+    def read(self, file_name):
+        with open(os.path.join(TEST_DATA_DIR, file_name), 'rb') as fin:
+            return fin.read().decode('utf-8')
+
+    def test_elements_match_parsed_response(self):
+        for file_name, request_type in (
+            ('check_query_response.xml', 'CheckQueryRq'),
+            ('item_query_response.xml', 'ItemQueryRq'),
+            ('purchase_order_query_response.xml', 'PurchaseOrderQueryRq'),
+        ):
+            response = self.read(file_name)
+            lazy = LazyResponse(request_type, response)
+            stream = iter_parse_response(request_type, response)
+            expected = list(stream)
+            self.assertEquals([label for label, _ in lazy], [label for label, _ in expected])
+            for (_, element), (_, expected_element) in zip(lazy, expected):
+                self.assertEquals(list(element.keys()), list(expected_element.keys()))
+                self.assertEquals(json.dumps(element.to_dict()), json.dumps(expected_element))
+            # ElementTree does not keep the order of attributes
+            self.assertEquals(
+                dict((k, dict(v)) for k, v in lazy.statuses.items()),
+                dict((k, dict(v)) for k, v in stream.statuses.items())
+            )
+
+    def test_partial_access(self):
+        response = LazyResponse('PurchaseOrderQueryRq', self.read('purchase_order_query_response.xml'))
+        label, purchase_order = next(iter(response))
+        expected = parse_response('PurchaseOrderQueryRq', self.read('purchase_order_query_response.xml'))
+        expected = expected['PurchaseOrderQueryRs']['PurchaseOrderRet'][0]
+
+        self.assertEquals(purchase_order.find('ClassRef/FullName'), expected['ClassRef']['FullName'])
+        self.assertEquals(purchase_order['TxnID'], expected['TxnID'])
+        self.assertEquals(purchase_order.find('VendorRef/Missing', 'default'), 'default')
+        self.assertTrue('PurchaseOrderLineRet' in purchase_order)
+        self.assertFalse('Missing' in purchase_order)
+        # only the children asked for were decoded
+        self.assertEquals(sorted(purchase_order.children), ['ClassRef', 'TxnID', 'VendorRef'])
+        self.assertEquals(purchase_order.decoded, None)
+
+        purchase_order['po_lines'] = []
+        self.assertEquals(purchase_order.to_dict()['po_lines'], [])
+        self.assertEquals(purchase_order['TxnNumber'], expected['TxnNumber'])
+
+    def test_purchase_order_filter(self):
+        response = self.read('purchase_order_query_response.xml')
+        request = PurchaseOrderQueryRequest(initial=True)
+        expected = request.get_response_elements(parse_response('PurchaseOrderQueryRq', response))
+        purchase_orders = request.get_response_elements(LazyResponse('PurchaseOrderQueryRq', response))
+        self.assertEquals(len(purchase_orders), len(expected))
+        self.assertEquals(
+            json.dumps([i.to_dict() for i in purchase_orders], sort_keys=True),
+            json.dumps(expected, sort_keys=True)
+        )
+
+    def test_lazy_query(self):
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', lazy=True)
+        qb.begin_session()
+        try:
+            purchase_orders = qb.quickbooks_query('purchase_order', {'initial': True})
+        finally:
+            qb.end_session()
+        self.assertEquals(len(purchase_orders), 47)
+        self.assertTrue(all(i['po_lines'] for i in purchase_orders))
+
+    def test_preferences(self):
+        for lazy in (False, True):
+            qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', lazy=lazy)
+            qb.begin_session()
+            try:
+                preferences = dict(qb.get_preferences())
+                self.assertEquals(preferences['AccountingPreferences']['IsUsingClassTracking'], 'true')
+                self.assertEquals(preferences['PurchasesAndVendorsPreferences']['DaysBillsAreDue'], '30')
+            finally:
+                qb.end_session()
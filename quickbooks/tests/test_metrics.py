@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from six.moves.urllib.request import urlopen
+
+from ..metrics import Metrics, describe, serve, write_textfile
+from ..qbcom import QuickBooks
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 0.5
+        return self.now
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        metrics = Metrics(buckets=(1, 10), clock=FakeClock())
+        metrics.counter('qb_requests_total', 'Requests sent')
+        metrics.inc('qb_requests_total', request_type='ItemQueryRq')
+        metrics.inc('qb_requests_total', 2, request_type='ItemQueryRq')
+        with metrics.timer('qb_stage_seconds', stage='parse', request_type='Item"QueryRq'):
+            pass
+        metrics.observe('qb_stage_seconds', 20, stage='parse', request_type='Item"QueryRq')
+        self.assertEquals(metrics.render().splitlines(), [
+            '# HELP qb_requests_total Requests sent',
+            '# TYPE qb_requests_total counter',
+            'qb_requests_total{request_type="ItemQueryRq"} 3',
+            '# TYPE qb_stage_seconds histogram',
+            'qb_stage_seconds_bucket{request_type="Item\\"QueryRq",stage="parse",le="1.0"} 1',
+            'qb_stage_seconds_bucket{request_type="Item\\"QueryRq",stage="parse",le="10.0"} 1',
+            'qb_stage_seconds_bucket{request_type="Item\\"QueryRq",stage="parse",le="+Inf"} 2',
+            'qb_stage_seconds_sum{request_type="Item\\"QueryRq",stage="parse"} 20.5',
+            'qb_stage_seconds_count{request_type="Item\\"QueryRq",stage="parse"} 2',
+        ])
+
+    def test_hooks(self):
+        metrics = Metrics(clock=FakeClock())
+        observed = list()
+        metrics.add_hook(lambda name, labels, seconds: observed.append((name, labels, seconds)))
+        with metrics.timer('qb_session_seconds', stage='begin'):
+            pass
+        self.assertEquals(observed, [('qb_session_seconds', {'stage': 'begin'}, 0.5)])
+
+    def test_quickbooks_stages(self):
+        metrics = Metrics()
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', metrics=describe(metrics))
+        stages = list()
+        metrics.add_hook(lambda name, labels, seconds: stages.append((labels.get('stage'), labels.get('request_type'))))
+        qb.begin_session()
+        list(qb.quickbooks_query('item', {'list_ids': ['80003A41-1474655232']}))
+        qb.call('ItemQueryRq', [('ListID', ['missing'])])
+        qb.end_session()
+
+        self.assertEquals(stages, [
+            ('begin', None),
+            ('format', 'ItemQueryRq'), ('process_request', 'ItemQueryRq'), ('parse', 'ItemQueryRq'),
+            ('format', 'ItemQueryRq'), ('process_request', 'ItemQueryRq'), ('parse', 'ItemQueryRq'),
+            ('end', None), ('close_by_force', None),
+        ])
+        counters = dict((name, metric.values) for name, metric in metrics.metrics.items() if metric.kind == 'counter')
+        self.assertEquals(counters['qb_requests_total'], {(('request_type', 'ItemQueryRq'),): 2})
+        self.assertEquals(counters['qb_session_opens_total'], {(): 1})
+        self.assertEquals(counters['qb_responses_total'], {
+            (('response_type', 'ItemQueryRs'), ('severity', 'Info'), ('status_code', '0')): 1,
+            (('response_type', 'ItemQueryRs'), ('severity', 'Info'), ('status_code', '1')): 1,
+        })
+        self.assertTrue(list(counters['qb_response_bytes_total'].values())[0] > 1000)
+
+    def test_bytes_are_utf8(self):
+        metrics = Metrics()
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', metrics=metrics)
+        qb.begin_session()
+        request = qb.format_request('ItemQueryRq', [('FullName', [u'Caf\xe9 \u2615'])])
+        response = qb.process_request('ItemQueryRq', request)
+        qb.end_session()
+        counters = dict((name, metric.values) for name, metric in metrics.metrics.items())
+        self.assertEquals(
+            list(counters['qb_request_bytes_total'].values()), [len(request.encode('utf-8'))]
+        )
+        self.assertEquals(list(counters['qb_request_bytes_total'].values())[0], len(request) + 3)
+        self.assertEquals(
+            list(counters['qb_response_bytes_total'].values()), [len(response.encode('utf-8'))]
+        )
+
+    def test_exporters(self):
+        metrics = Metrics()
+        metrics.inc('qb_session_opens_total')
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'quickbooks.prom')
+            write_textfile(metrics, path)
+            write_textfile(metrics, path)
+            with open(path) as fin:
+                self.assertEquals(fin.read(), metrics.render())
+            self.assertEquals(os.listdir(directory), ['quickbooks.prom'])
+        finally:
+            shutil.rmtree(directory)
+
+        server = serve(metrics, 0)
+        try:
+            response = urlopen('http://127.0.0.1:{}/metrics'.format(server.server_address[1]))
+            self.assertEquals(response.read().decode('utf-8'), metrics.render())
+        finally:
+            server.shutdown()
+            server.server_close()
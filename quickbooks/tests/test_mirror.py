@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..mirror import EntityMirror, query_variant
+from ..qbcom import QuickBooks
+
+
+class TestEntityMirror(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.directory = tempfile.mkdtemp()
+        self.mirror = EntityMirror(
+            os.path.join(self.directory, 'mirror.sqlite3'), max_age=300, clock=lambda: self.now
+        )
+        self.qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', mirror=self.mirror)
+        self.qb.begin_session()
+        self.simulator = self.qb.request_processor
+
+    def tearDown(self):
+        self.qb.end_session()
+        shutil.rmtree(self.directory)
+
+    def test_lookups_answered_from_mirror(self):
+        items = list(self.qb.quickbooks_query('item', {'initial': True}))
+        self.assertEquals(len(items), 421)
+        self.assertEquals(self.simulator.requests_processed, 1)
+
+        list_ids = ['80003A41-1474655232', '80002CBD-1426114159']
+        mirrored = list(self.qb.quickbooks_query('item', {'list_ids': list_ids}))
+        self.assertEquals(sorted(i['ListID'] for i in mirrored), sorted(list_ids))
+        self.assertEquals(self.simulator.requests_processed, 1)
+
+        # the mirrored entity is the same as the one returned by QuickBooks
+        expected = [i for i in items if i['ListID'] == list_ids[0]][0]
+        full_name = expected['FullName']
+        by_name = list(self.qb.quickbooks_query('item', {'full_names': [full_name]}))
+        self.assertEquals(by_name, [expected])
+        self.assertEquals(self.simulator.requests_processed, 1)
+        self.assertEquals(self.mirror.hits, 3)
+
+    def test_misses_and_stale_entries_go_to_quickbooks(self):
+        purchase_orders = list(self.qb.quickbooks_query('purchase_order', {'initial': True}))
+        txn_ids = [i['TxnID'] for i in purchase_orders[:2]]
+        self.mirror.clear('purchase_order')
+        self.mirror.store('purchase_order', {}, purchase_orders[:1])
+
+        self.simulator.requests_processed = 0
+        results = list(self.qb.quickbooks_query('purchase_order', {'txn_ids': txn_ids}))
+        self.assertEquals(sorted(i['TxnID'] for i in results), sorted(txn_ids))
+        self.assertEquals(self.simulator.requests_processed, 1)
+        self.assertEquals((self.mirror.hits, self.mirror.misses), (1, 1))
+
+        # the miss was mirrored
+        list(self.qb.quickbooks_query('purchase_order', {'txn_ids': txn_ids}))
+        self.assertEquals(self.simulator.requests_processed, 1)
+
+        self.now += 301
+        list(self.qb.quickbooks_query('purchase_order', {'txn_ids': txn_ids}))
+        self.assertEquals(self.simulator.requests_processed, 2)
+
+    def test_variants(self):
+        self.assertEquals(query_variant({'initial': True, 'include_line_items': False}), query_variant({'txn_ids': ['1'], 'include_line_items': False}))
+        self.assertNotEqual(query_variant({'include_line_items': False}), query_variant({}))
+
+        checks = list(self.qb.quickbooks_query('check', {'start_date': '2009-01-01'}))
+        txn_ids = [checks[0]['TxnID']]
+        list(self.qb.quickbooks_query('check', {'txn_ids': txn_ids}))
+        self.assertEquals(self.simulator.requests_processed, 1)
+        # entities mirrored with line items don't answer queries without them
+        list(self.qb.quickbooks_query('check', {'txn_ids': txn_ids, 'include_line_items': False}))
+        self.assertEquals(self.simulator.requests_processed, 2)
@@ -0,0 +1,110 @@
+import json
+import os
+import unittest
+
+import six
+
+from ..parse_pool import ParsePool, split_response
+from ..qbcom import QuickBooks
+from ..qbxml_serializers import parse_response
+
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qbxml_files')
+
+BATCH = [
+    ('ItemReceiptAddRq', [('ItemReceiptAdd', (('RefNumber', 'SOC18731'),))]),
+    ('ItemQueryRq', [('ListID', ['80003A41-1474655232'])]),
+    ('ItemReceiptAddRq', [('ItemReceiptMod', (('RefNumber', 'SOC18732'),))]),
+    ('ItemQueryRq', [('ListID', ['80002CBD-1426114159'])]),
+]
+
+
+def string_types(value):
+    'the types of every key and string in a parsed response'
+    if isinstance(value, dict):
+        return set(type(key) for key in value).union(*[string_types(i) for i in value.values()])
+    if isinstance(value, list):
+        return set().union(*[string_types(i) for i in value])
+    return set([type(value)]) if isinstance(value, six.string_types + (bytes,)) else set()
+
+
+class TestParsePool(unittest.TestCase):
+    def setUp(self):
+        # threshold=0 sends every response to the pool
+        self.parser = ParsePool(processes=2, threshold=0)
+        self.qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', parser=self.parser)
+        self.inline = QuickBooks(company_file_name='simulated.QBW', backend='simulator')
+        self.qb.begin_session()
+        self.inline.begin_session()
+
+    def tearDown(self):
+        self.qb.end_session()
+        self.inline.end_session()
+        self.parser.close()
+
+    def test_split_response(self):
+        with open(os.path.join(TEST_DATA_DIR, 'check_query_response.xml')) as fin:
+            response = fin.read()
+        [(response_type, status, section)] = split_response(response)
+        self.assertEquals(response_type, 'CheckQueryRs')
+        self.assertEquals(status['@statusCode'], '0')
+        self.assertTrue(section.startswith('<CheckQueryRs') and section.endswith('</CheckQueryRs>'))
+
+    def test_call_async(self):
+        for request_type, request_dictionary in BATCH[1::2]:
+            future = self.qb.call_async(request_type, request_dictionary)
+            self.assertEquals(
+                json.dumps(future.result()), json.dumps(self.inline.call(request_type, request_dictionary))
+            )
+            self.assertEquals(string_types(future.result()), set([six.text_type]))
+        self.assertTrue(self.parser.executor is not None)
+
+    def test_call_batch_async(self):
+        sections = [
+            (index, self.qb.format_request_section(request_type, request_dictionary, index))
+            for index, (request_type, request_dictionary) in enumerate(BATCH)
+        ]
+        expected = self.inline.call_batch(sections, on_error='continueOnError')
+        responses = [i.result() for i in self.qb.call_batch_async(sections, on_error='continueOnError')]
+        # the simulator gives every receipt a new TxnID
+        self.assertEquals(json.dumps(responses[1::2]), json.dumps(expected[1::2]))
+        self.assertEquals(
+            [list(i.values())[0]['@statusSeverity'] for i in responses],
+            [list(i.values())[0]['@statusSeverity'] for i in expected]
+        )
+        self.assertEquals(responses[2]['ItemReceiptAddRs']['@statusSeverity'], 'Error')
+
+        # requests skipped after an error have a response of None like call_batch
+        futures = self.qb.call_batch_async(sections)
+        self.assertEquals([i.result() is None for i in futures], [False, False, False, True])
+
+    def test_parsed_query_pages(self):
+        pages = list(self.qb.quickbooks_query_pages('item', {'initial': True}, page_size=100))
+        expected = list(self.inline.quickbooks_query_pages('item', {'initial': True}, page_size=100))
+        self.assertEquals([len(i) for i in pages], [100, 100, 100, 100, 21])
+        self.assertEquals(json.dumps(pages), json.dumps(expected))
+        self.assertEquals(self.qb.request_processor.iterators, {})
+
+    def test_parsed_purchase_order_pages(self):
+        # the post filters of the request object are pickled to the pool
+        args = {'initial': True, 'entity_names': ['Arco Inc.'], 'status': 'open'}
+        pages = list(self.qb.quickbooks_query_pages('purchase_order', dict(args, class_names=[]), page_size=25))
+        expected = list(self.inline.quickbooks_query_pages('purchase_order', dict(args, class_names=[]), page_size=25))
+        self.assertEquals(json.dumps(pages), json.dumps(expected))
+        pages = list(self.qb.quickbooks_query_pages('purchase_order', {'initial': True}, page_size=25))
+        expected = list(self.inline.quickbooks_query_pages('purchase_order', {'initial': True}, page_size=25))
+        self.assertEquals([len(i) for i in pages], [len(i) for i in expected])
+        self.assertTrue(len(pages) > 1)
+        self.assertEquals(json.dumps(pages), json.dumps(expected))
+
+    def test_small_responses_are_parsed_inline(self):
+        parser = ParsePool(processes=2)
+        with open(os.path.join(TEST_DATA_DIR, 'check_query_response.xml')) as fin:
+            response = fin.read()
+        future = parser.parse('CheckQueryRq', response)
+        self.assertTrue(future.done())
+        self.assertEquals(parser.executor, None)
+        self.assertEquals(json.dumps(future.result()), json.dumps(parse_response('CheckQueryRq', response)))
+        # unicode like xmltodict's even for ASCII on python 2
+        self.assertEquals(string_types(future.result()), string_types(parse_response('CheckQueryRq', response)))
+        self.assertEquals(string_types(future.result()), set([six.text_type]))
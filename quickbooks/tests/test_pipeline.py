@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+
+from ..metrics import PIPELINE_BUSY_SECONDS, Metrics
+from ..pipeline import Pipeline
+from ..qbcom import QuickBooks
+
+
+class TestPipeline(unittest.TestCase):
+    def test_order_and_errors(self):
+        threads = dict()
+        errors = list()
+
+        def stage(name, function):
+            def run(value):
+                threads.setdefault(name, set()).add(threading.current_thread().name)
+                return function(value)
+            return name, run
+
+        pipeline = Pipeline([
+            stage('format', lambda value: 10 // value),
+            stage('process_request', lambda value: value + 1),
+            stage('send', lambda value: value * 2),
+        ], inline='process_request', queue_size=1, on_error=lambda stage, error: errors.append(stage))
+        self.assertEquals(pipeline.run([1, 2, 0, 5, 10]), [22, 12, None, 6, 4])
+        self.assertEquals(errors, ['format'])
+        self.assertEquals(threads['process_request'], set([threading.current_thread().name]))
+        self.assertNotIn(threading.current_thread().name, threads['format'] | threads['send'])
+        self.assertEquals(pipeline.run([]), [])
+
+    def test_results_on_the_calling_thread(self):
+        delivered = list()
+        flushed = list()
+
+        def process(value):
+            if value == 3:
+                # every result before it was delivered
+                pipeline.flush()
+                flushed.extend(delivered)
+            return value
+
+        def on_result(result):
+            delivered.append((result, threading.current_thread().name))
+
+        pipeline = Pipeline([
+            ('process_request', process),
+            ('parse', lambda value: time.sleep(0.01) or 10 // value),
+        ], inline='process_request', on_error=lambda stage, error: None)
+        self.assertEquals(pipeline.run([1, 0, 2, 3, 5], on_result=on_result), [10, None, 5, 3, 2])
+        name = threading.current_thread().name
+        self.assertEquals(delivered, [(10, name), (None, name), (5, name), (3, name), (2, name)])
+        self.assertEquals([result for result, _ in flushed], [10, None, 5])
+
+    def test_stages_overlap(self):
+        metrics = Metrics()
+        pipeline = Pipeline([
+            ('format', lambda value: time.sleep(0.01)),
+            ('process_request', lambda value: time.sleep(0.03)),
+            ('send', lambda value: time.sleep(0.01)),
+        ], inline='process_request', metrics=metrics)
+        pipeline.run(range(10))
+        # sequentially it would take 0.5s
+        self.assertLess(pipeline.elapsed, 0.45)
+        utilization = pipeline.utilization()
+        self.assertEquals(max(utilization, key=utilization.get), 'process_request')
+        self.assertEquals(len(metrics.counter(PIPELINE_BUSY_SECONDS).values), 3)
+
+    def test_quickbooks_requests(self):
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator')
+        qb.begin_session()
+        try:
+            requests = [('HostQueryRq', None), ('CompanyQueryRq', None), ('HostQueryRq', None)]
+            pipeline = Pipeline([
+                ('format', lambda request: (request[0], qb.format_request(*request))),
+                ('process_request', lambda request: (request[0], qb.process_request(*request))),
+                ('send', lambda response: qb.read_response(*response)),
+            ], inline='process_request')
+            responses = pipeline.run(requests)
+        finally:
+            qb.end_session()
+        self.assertEquals([list(response)[0] for response in responses], ['HostQueryRs', 'CompanyQueryRs', 'HostQueryRs'])
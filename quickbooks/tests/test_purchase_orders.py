@@ -4,7 +4,7 @@ import unittest
 
 from config import QB_LOOKUP, celery_app
 from ..qbcom import QuickBooks
-from ..qbxml_serializers import parse_response
+from ..qbxml_serializers import iter_parse_response, parse_response
 from ..qbxml_request_formatter import PurchaseOrderQueryRequest
 from . import get_elements, get_values_by_tag
 
@@ -152,3 +152,15 @@ class TestPurchaseOrderRequests(unittest.TestCase):
         response_elements = request_object.get_response_elements(parsed_response)
         self.assertEquals(len(list(response_elements)), 47)
 
+    def test_streaming_purchase_order_query_response(self):
+        request_object = PurchaseOrderQueryRequest(start_date=datetime.date(2016, 8, 27))
+        with open(self.purchase_order_response) as fin:
+            quickbooks_response = fin.read()
+
+        response_stream = iter_parse_response(
+            request_object.request_type, quickbooks_response
+        )
+        response_elements = request_object.get_response_elements(response_stream)
+        self.assertEquals(len(response_elements), 47)
+        # line items are still collected from the streamed elements
+        self.assertTrue(all(i['po_lines'] for i in response_elements))
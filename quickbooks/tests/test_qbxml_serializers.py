@@ -0,0 +1,109 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import os
+import unittest
+
+from ..qbxml_serializers import (
+    format_envelope,
+    format_request,
+    format_request_section,
+    parse_batch_response,
+)
+from . import get_elements
+
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'qbxml_files')
+
+
+class TestFormatRequest(unittest.TestCase):
+    def test_empty_request(self):
+        with open(os.path.join(TEST_DATA_DIR, 'initial_item_query.xml')) as fin:
+            expected_formatted_request = fin.read()
+        self.assertEquals(format_request('ItemQueryRq'), expected_formatted_request)
+
+    def test_nested_request(self):
+        request = format_request('ItemReceiptAddRq', [
+            ('ItemReceiptAdd', (
+                ('VendorRef', (('FullName', 'Mrs. Fields'),)),
+                ('Memo', 'Cookies & "cream" <b>'),
+                ('ItemLineAdd', [
+                    (('ItemRef', (('ListID', '80002CBD-1426114159'),)), ('Quantity', 12)),
+                    (('ItemRef', (('ListID', '80002EDE-1426787483'),)), ('Quantity', 2)),
+                ]),
+                ('Other', ''),
+            )),
+        ])
+        self.assertEquals(request, '\n'.join([
+            '<?xml version="1.0" ?>',
+            '<?qbxml version="13.0"?>',
+            '<QBXML>',
+            '  <QBXMLMsgsRq onError="stopOnError">',
+            '    <ItemReceiptAddRq>',
+            '      <ItemReceiptAdd>',
+            '        <VendorRef>',
+            '          <FullName>Mrs. Fields</FullName>',
+            '        </VendorRef>',
+            '        <Memo>Cookies &amp; &quot;cream&quot; &lt;b&gt;</Memo>',
+            '        <ItemLineAdd>',
+            '          <ItemRef>',
+            '            <ListID>80002CBD-1426114159</ListID>',
+            '          </ItemRef>',
+            '          <Quantity>12</Quantity>',
+            '        </ItemLineAdd>',
+            '        <ItemLineAdd>',
+            '          <ItemRef>',
+            '            <ListID>80002EDE-1426787483</ListID>',
+            '          </ItemRef>',
+            '          <Quantity>2</Quantity>',
+            '        </ItemLineAdd>',
+            '        <Other/>',
+            '      </ItemReceiptAdd>',
+            '    </ItemReceiptAddRq>',
+            '  </QBXMLMsgsRq>',
+            '</QBXML>',
+            '',
+        ]))
+
+    def test_compact_request(self):
+        request_items = [('TxnID', ['44F338-1465312853', '460DA5-1467916919'])]
+        compact_request = format_request('PurchaseOrderQueryRq', request_items, indent=None)
+        self.assertNotIn('\n', compact_request)
+        self.assertEquals(
+            get_elements(compact_request),
+            get_elements(format_request('PurchaseOrderQueryRq', request_items))
+        )
+
+
+class TestBatchRequests(unittest.TestCase):
+    def test_envelope_with_several_requests(self):
+        sections = [
+            format_request_section('ItemQueryRq', [('ListID', ['80002CBD-1426114159'])], {'requestID': 0}),
+            format_request_section('ItemQueryRq', [('FullName', ['10476'])], {'requestID': 1}),
+        ]
+        request = format_envelope(sections, on_error='continueOnError')
+        self.assertEquals(
+            get_elements(request),
+            ['QBXML', 'QBXMLMsgsRq', 'ItemQueryRq', 'ListID', 'ItemQueryRq', 'FullName']
+        )
+        self.assertIn('<ItemQueryRq requestID="1">', request)
+        self.assertIn('<QBXMLMsgsRq onError="continueOnError">', request)
+
+    def test_responses_are_mapped_by_request_id(self):
+        responses = parse_batch_response('''<?xml version="1.0" ?>
+<QBXML>
+<QBXMLMsgsRs>
+<ItemReceiptAddRs requestID="0" statusCode="0" statusSeverity="Info" statusMessage="Status OK">
+<ItemReceiptRet><TxnID>1-1</TxnID></ItemReceiptRet>
+</ItemReceiptAddRs>
+<ItemQueryRs requestID="1" statusCode="1" statusSeverity="Info" statusMessage="No match" />
+<ItemReceiptAddRs requestID="2" statusCode="3140" statusSeverity="Error" statusMessage="Invalid reference" />
+</QBXMLMsgsRs>
+</QBXML>''')
+        self.assertEquals(
+            dict((request_id, list(response)) for request_id, response in responses.items()),
+            {'0': ['ItemReceiptAddRs'], '1': ['ItemQueryRs'], '2': ['ItemReceiptAddRs']},
+        )
+        self.assertEquals(responses['0']['ItemReceiptAddRs']['ItemReceiptRet']['TxnID'], '1-1')
+        self.assertEquals(responses['1']['ItemQueryRs']['@statusCode'], '1')
+        self.assertEquals(responses['2']['ItemReceiptAddRs']['@statusSeverity'], 'Error')
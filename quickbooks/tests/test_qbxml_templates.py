@@ -0,0 +1,79 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import datetime
+import threading
+import unittest
+
+from ..qbxml_request_formatter import CheckQueryRequest, PurchaseOrderQueryRequest
+from ..qbxml_serializers import format_request
+from ..qbxml_templates import TemplateCache, format_request as template_format_request
+
+
+def item_receipt(lines):
+    return [
+        ('ItemReceiptAdd', (
+            ('VendorRef', (('FullName', 'Mrs. Fields'),)),
+            ('Memo', 'Cookies & "cream"'),
+            ('ItemLineAdd', [
+                (('ItemRef', (('ListID', '80002CBD-1426114159'),)), ('Quantity', i))
+                for i in range(lines)
+            ]),
+        )),
+    ]
+
+
+class TestRequestTemplates(unittest.TestCase):
+    def setUp(self):
+        self.cache = TemplateCache(maxsize=4)
+
+    def assertSameRequest(self, request_type, request_items):
+        self.assertEquals(
+            template_format_request(request_type, request_items, cache=self.cache),
+            format_request(request_type, request_items),
+        )
+
+    def test_templates_match_format_request(self):
+        self.assertSameRequest('ItemQueryRq', None)
+        self.assertSameRequest('ItemReceiptAddRq', item_receipt(3))
+        request_object = CheckQueryRequest(start_date=datetime.date(2016, 9, 17))
+        self.assertSameRequest(request_object.request_type, request_object.request_dictionary)
+        # shapes that can't be compiled are still formatted the same way
+        self.assertSameRequest('TestRq', [('A', [(('B', '1'),), 'C'])])
+        self.assertSameRequest('TestRq', [('A', (('B', '1'), ('B', '2')))])
+        self.assertSameRequest('TestRq', [('A', ''), ('A', {}), ('A', [])])
+
+    def test_templates_are_reused(self):
+        for txn_ids in (['44F338-1465312853'], ['460DA5-1467916919', '44F338-1465312853']):
+            request_object = PurchaseOrderQueryRequest(txn_ids=txn_ids)
+            self.assertSameRequest(request_object.request_type, request_object.request_dictionary)
+        # repeating elements don't change the shape of the request
+        self.assertEquals((self.cache.misses, self.cache.hits), (1, 1))
+
+        self.assertSameRequest('ItemReceiptAddRq', item_receipt(1))
+        self.assertSameRequest('ItemReceiptAddRq', item_receipt(20))
+        self.assertEquals((self.cache.misses, self.cache.hits), (2, 2))
+
+        # a different shape with the same top level elements gets its own template
+        self.assertSameRequest('ItemReceiptAddRq', [('ItemReceiptAdd', (('Memo', 'x'),))])
+        self.assertEquals(self.cache.misses, 3)
+        self.assertEquals(len(self.cache), 3)
+
+    def test_counts_from_threads(self):
+        def render():
+            for _ in range(200):
+                self.cache.render('ItemReceiptAddRq', item_receipt(1))
+
+        threads = [threading.Thread(target=render) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(self.cache.hits + self.cache.misses, 800)
+
+    def test_least_recently_used_templates_are_evicted(self):
+        for i in range(6):
+            self.assertSameRequest('TestRq', [('Element{}'.format(i), '1')])
+        self.assertEquals(len(self.cache), 4)
+        self.assertSameRequest('TestRq', [('Element0', '1')])
+        self.assertEquals(self.cache.misses, 7)
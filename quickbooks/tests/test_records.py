@@ -0,0 +1,63 @@
+import json
+import os
+import unittest
+
+from ..qbcom import QuickBooks
+from ..qbxml_serializers import iter_parse_response
+from ..records import RECORD_CLASSES, Record, element_to_record, record_class, to_dict
+
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qbxml_files')
+
+
+class TestRecords(unittest.TestCase):
+    def test_mapping_access(self):
+        Line = record_class('Line', ('TxnLineID', 'Quantity'))
+        line = Line(TxnLineID='1', Extra='x')
+        self.assertEquals(line['TxnLineID'], '1')
+        self.assertEquals(line.get('Quantity', 'default'), 'default')
+        self.assertRaises(KeyError, lambda: line['Quantity'])
+        self.assertTrue('Extra' in line)
+        self.assertFalse('Quantity' in line)
+        line['Quantity'] = '3'
+        self.assertEquals(line.keys(), ['TxnLineID', 'Quantity', 'Extra'])
+        self.assertEquals(json.dumps(line.to_dict()), '{"TxnLineID": "1", "Quantity": "3", "Extra": "x"}')
+        del line['Extra']
+        self.assertEquals(len(line), 2)
+        self.assertFalse(hasattr(line, '__dict__'))
+
+    def test_records_match_parsed_dicts(self):
+        for file_name, request_type in (
+            ('check_query_response.xml', 'CheckQueryRq'),
+            ('item_query_response.xml', 'ItemQueryRq'),
+            ('purchase_order_query_response.xml', 'PurchaseOrderQueryRq'),
+        ):
+            with open(os.path.join(TEST_DATA_DIR, file_name)) as fin:
+                response = fin.read()
+            expected = list(iter_parse_response(request_type, response))
+            records = list(iter_parse_response(request_type, response, element_to_record))
+            self.assertEquals(len(records), len(expected))
+            for (label, record), (expected_label, element) in zip(records, expected):
+                self.assertEquals(label, expected_label)
+                self.assertTrue(isinstance(record, RECORD_CLASSES[label]))
+                self.assertEquals(json.loads(json.dumps(record.to_dict())), json.loads(json.dumps(element)))
+                # fields are in schema order, only lines and line groups mixed in a
+                # purchase order can come out in a different order than xmltodict's
+                self.assertEquals(sorted(record.to_dict()), sorted(element))
+                self.assertEquals(record.extras, None)
+
+    def test_query_adapters_with_records(self):
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', records=True)
+        qb.begin_session()
+        try:
+            purchase_orders = list(qb.quickbooks_query('purchase_order', {'initial': True}))
+            self.assertEquals(len(purchase_orders), 47)
+            self.assertTrue(all(isinstance(i, Record) for i in purchase_orders))
+            self.assertTrue(all(isinstance(line, Record) for i in purchase_orders for line in i['po_lines']))
+            self.assertEquals(to_dict(purchase_orders)[0]['po_lines'][0], purchase_orders[0]['po_lines'][0].to_dict())
+
+            items = list(qb.quickbooks_query('item', {'initial': True}))
+            self.assertEquals(len(items), 421)
+            self.assertEquals(items[0].category, items[0]['category'])
+        finally:
+            qb.end_session()
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+import datetime
+import decimal
+import json
+import os
+import pickle
+import unittest
+
+from ..qbxml_serializers import parse_response
+from ..serialization import SerializationError, dumps, loads, register_serializer
+
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qbxml_files')
+
+
+class TestQBPack(unittest.TestCase):
+    def test_round_trip(self):
+        value = OrderedDict([
+            ('ItemRet', [OrderedDict([('ListID', u'80003A41-1474655232'), ('Name', u'caf\xe9')])] * 3),
+            ('@statusCode', u'0'),
+            ('plain', {u'nested': (1, -1, 0, 2 ** 40, -2 ** 40)}),
+            ('float', 1.5),
+            ('flags', [True, False, None]),
+            ('long', u'x' * 1000),
+            ('when', datetime.datetime(2016, 9, 23, 12, 27, 12, 5)),
+            ('day', datetime.date(2016, 9, 23)),
+            ('amount', decimal.Decimal('12.50')),
+        ])
+        for compression in (None, 'zlib'):
+            decoded = loads(dumps(value, compression=compression))
+            self.assertEquals(decoded['plain'][u'nested'], [1, -1, 0, 2 ** 40, -2 ** 40])
+            decoded['plain'][u'nested'] = tuple(decoded['plain'][u'nested'])
+            self.assertEquals(decoded, value)
+            self.assertTrue(isinstance(decoded, OrderedDict))
+            self.assertFalse(isinstance(decoded['plain'], OrderedDict))
+
+    def test_fixture_responses(self):
+        for file_name, request_type in (
+            ('item_query_response.xml', 'ItemQueryRq'),
+            ('purchase_order_query_response.xml', 'PurchaseOrderQueryRq'),
+        ):
+            with open(os.path.join(TEST_DATA_DIR, file_name)) as fin:
+                response = parse_response(request_type, fin.read())
+            payload = [u'surrogate', u'model', response, u'quickbooks']
+            encoded = dumps(payload)
+            self.assertEquals(loads(encoded), payload)
+            self.assertTrue(len(encoded) < len(json.dumps(payload)) / 5)
+            self.assertTrue(len(encoded) < len(pickle.dumps(payload, 2)) / 5)
+
+    def test_errors(self):
+        self.assertRaises(SerializationError, dumps, object())
+        self.assertRaises(SerializationError, loads, b'not qbpack')
+
+    def test_kombu_registration(self):
+        from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads
+
+        register_serializer()
+        content_type, content_encoding, body = kombu_dumps({u'args': [1, u'two']}, serializer='qbpack')
+        self.assertEquals(content_type, 'application/x-qbpack')
+        self.assertEquals(kombu_loads(body, content_type, content_encoding, accept=[content_type]), {u'args': [1, u'two']})
@@ -0,0 +1,87 @@
+import unittest
+
+from ..session import SessionManager
+
+
+class FakeQuickBooks(object):
+    'records session calls instead of talking to QuickBooks'
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.is_open = False
+        self.ended = None
+        self.com_errors = 0
+        self.pings = 0
+
+    def begin_session(self):
+        self.is_open = True
+
+    def end_session(self, force=True):
+        self.is_open = False
+        self.ended = 'force' if force else 'graceful'
+
+    def ping(self):
+        self.pings += 1
+        return self.healthy
+
+
+class TestSessionManager(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.created = list()
+        self.sessions = SessionManager(
+            self.create, idle_timeout=300, max_tasks=3, clock=lambda: self.now
+        )
+
+    def create(self):
+        qb = FakeQuickBooks()
+        self.created.append(qb)
+        return qb
+
+    def run_task(self):
+        with self.sessions.session() as qb:
+            return qb
+
+    def test_session_is_reused_until_max_tasks(self):
+        qbs = [self.run_task() for _ in range(4)]
+        self.assertEquals(len(self.created), 2)
+        self.assertTrue(qbs[0] is qbs[1] is qbs[2])
+        self.assertEquals(qbs[0].ended, 'graceful')
+        self.assertTrue(qbs[3].is_open)
+
+    def test_idle_session_is_released(self):
+        qb = self.run_task()
+        self.now = 200
+        self.sessions.release_idle()
+        self.assertTrue(qb.is_open)
+
+        self.now = 500
+        self.sessions.release_idle()
+        self.assertEquals(qb.ended, 'graceful')
+        self.assertFalse(self.run_task() is qb)
+
+    def test_broken_session_is_closed_by_force(self):
+        qb = self.run_task()
+        qb.healthy = False
+        qb.com_errors += 1
+        self.assertFalse(self.run_task() is qb)
+        self.assertEquals(qb.ended, 'force')
+        self.assertEquals(self.sessions.sessions_opened, 2)
+
+    def test_health_check_after_idle_or_com_error(self):
+        self.sessions.max_tasks = None
+        qb = self.run_task()
+        self.now = 30
+        self.run_task()
+        self.assertEquals(qb.pings, 0)
+
+        qb.com_errors += 1
+        self.now = 40
+        self.run_task()
+        self.now = 50
+        self.run_task()
+        self.assertEquals(qb.pings, 1)
+
+        # idle for health_check_after
+        self.now = 110
+        self.assertTrue(self.run_task() is qb)
+        self.assertEquals(qb.pings, 2)
@@ -0,0 +1,116 @@
+import unittest
+
+from .. import pluralize
+from ..exceptions import QuickBooksError
+from ..processors import SimulatorBackend
+from ..qbcom import QuickBooks
+from ..simulator import RequestProcessorSimulator, ResponseCorpus
+
+
+class TestRequestProcessorSimulator(unittest.TestCase):
+    def setUp(self):
+        self.delays = list()
+        self.qb = QuickBooks(
+            company_file_name='simulated.QBW',
+            backend='simulator',
+            backend_options={'latency': 0.01, 'byte_cost': 1e-6, 'sleep': self.delays.append},
+        )
+        self.qb.begin_session()
+
+    def tearDown(self):
+        self.qb.end_session()
+
+    def test_query(self):
+        items = list(self.qb.quickbooks_query('item', {'initial': True}))
+        self.assertEquals(len(items), 421)
+        checks = list(self.qb.quickbooks_query('check', {'start_date': '2009-01-01'}))
+        # one check of the fixture is drawn on an account outside DISTRIBUTOR_ACCOUNTS
+        self.assertEquals(len(checks), 15)
+        purchase_orders = self.qb.quickbooks_query('purchase_order', {'initial': True})
+        self.assertEquals(len(purchase_orders), 47)
+        # every request pays the latency and the per byte cost
+        self.assertEquals(len(self.delays), 3)
+        self.assertTrue(all(i > 0.01 for i in self.delays))
+
+    def test_id_lookup(self):
+        list_ids = ['80003A41-1474655232', '80002CBD-1426114159']
+        items = list(self.qb.quickbooks_query('item', {'list_ids': list_ids}))
+        self.assertEquals(sorted(i['ListID'] for i in items), sorted(list_ids))
+
+        response = self.qb.call('ItemQueryRq', [('ListID', ['missing'])])
+        self.assertEquals(response['ItemQueryRs']['@statusCode'], '1')
+
+    def test_iterator_pages(self):
+        pages = list(self.qb.quickbooks_query_pages('item', {'initial': True}, page_size=100))
+        self.assertEquals([len(i) for i in pages], [100, 100, 100, 100, 21])
+        # iterators are cleaned up once all pages were returned
+        self.assertEquals(self.qb.request_processor.iterators, {})
+
+    def test_include_ret_element(self):
+        full = self.qb.quickbooks_query('purchase_order', {'initial': True})
+        purchase_orders = self.qb.quickbooks_query('purchase_order', {'initial': True, 'fields': ['TxnID', 'RefNumber']})
+        # the elements get_response_elements reads are always included
+        self.assertEquals([i['TxnID'] for i in purchase_orders], [i['TxnID'] for i in full])
+        self.assertEquals(
+            set(purchase_orders[0]),
+            set(['TxnID', 'RefNumber', 'ClassRef', 'PurchaseOrderLineRet', 'po_lines']) & set(full[0]),
+        )
+        self.assertEquals(purchase_orders[0]['po_lines'], full[0]['po_lines'])
+
+        pages = list(self.qb.quickbooks_query_pages('item', {'initial': True, 'fields': ['ListID']}, page_size=200))
+        self.assertEquals([len(i) for i in pages], [200, 200, 21])
+        self.assertTrue(all(set(i) == set(['ListID', 'category']) for page in pages for i in page))
+
+    def test_batch_with_stop_on_error(self):
+        responses = self.qb.call_many([
+            ('ItemReceiptAddRq', [('ItemReceiptAdd', (('RefNumber', 'SOC18731'),))]),
+            ('ItemReceiptAddRq', [('ItemReceiptMod', (('RefNumber', 'SOC18732'),))]),
+            ('ItemQueryRq', [('ListID', ['80003A41-1474655232'])]),
+        ], max_batch_size=3)
+        self.assertEquals(
+            responses[0]['ItemReceiptAddRs']['ItemReceiptRet']['RefNumber'], 'SOC18731'
+        )
+        self.assertEquals(responses[1]['ItemReceiptAddRs']['@statusSeverity'], 'Error')
+        # stopOnError skips the rest of the envelope
+        self.assertEquals(responses[2], None)
+        self.assertEquals(self.qb.request_processor.requests_processed, 1)
+
+    def test_active_status(self):
+        corpus = ResponseCorpus()
+        corpus.add_elements('ItemQueryRs', [
+            '<ItemServiceRet><ListID>1</ListID><IsActive>true</IsActive></ItemServiceRet>',
+            '<ItemServiceRet><ListID>2</ListID><IsActive>false</IsActive></ItemServiceRet>',
+        ])
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator', backend_options={'corpus': corpus})
+        qb.begin_session()
+        try:
+            def list_ids(request_dictionary):
+                response = qb.call('ItemQueryRq', request_dictionary)['ItemQueryRs']
+                return [i['ListID'] for i in pluralize(response.get('ItemServiceRet', []))]
+
+            # active entities only unless the query asks for others or filters by id
+            self.assertEquals(list_ids(None), ['1'])
+            self.assertEquals(list_ids([('ActiveStatus', 'All')]), ['1', '2'])
+            self.assertEquals(list_ids([('ActiveStatus', 'InactiveOnly')]), ['2'])
+            self.assertEquals(list_ids([('ListID', ['2'])]), ['2'])
+        finally:
+            qb.end_session()
+
+    def test_only_sessions_close_by_force(self):
+        closed = list()
+        backend = SimulatorBackend()
+        backend.close_by_force = closed.append
+        qb = QuickBooks(company_file_name='simulated.QBW', backend=backend, service_user='qb')
+        qb.format_request('HostQueryRq')
+        # e.g. pretty_print, QuickBooks may be running a session of another instance
+        qb.__del__()
+        self.assertEquals(closed, [])
+
+        qb = QuickBooks(company_file_name='simulated.QBW', backend=backend, service_user='qb')
+        qb.begin_session()
+        qb.__del__()
+        self.assertEquals(closed, ['qb'])
+
+    def test_requests_need_a_session(self):
+        simulator = RequestProcessorSimulator()
+        self.assertRaises(QuickBooksError, simulator.ProcessRequest, 'ticket', '<QBXML/>')
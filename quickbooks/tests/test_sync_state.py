@@ -0,0 +1,123 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..qbcom import QuickBooks
+from ..sync_state import (
+    FingerprintIndex,
+    WatermarkStore,
+    WatermarkTracker,
+    incremental_query_params,
+    modified_since,
+    parse_time_modified,
+)
+
+
+class TestWatermarks(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = WatermarkStore(os.path.join(self.directory, 'state.sqlite3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_time_modified(self):
+        self.assertEquals(parse_time_modified('2016-09-23T12:27:12-07:00'), datetime.datetime(2016, 9, 23, 19, 27, 12))
+        self.assertEquals(parse_time_modified('2016-09-23T12:27:12+01:30'), datetime.datetime(2016, 9, 23, 10, 57, 12))
+        self.assertEquals(parse_time_modified('2016-09-23T12:27:12'), datetime.datetime(2016, 9, 23, 12, 27, 12))
+        self.assertEquals(parse_time_modified('2016-09-23'), datetime.datetime(2016, 9, 23))
+
+    def test_store_only_moves_forward(self):
+        self.assertEquals(self.store.get('item', 'company.QBW'), None)
+        self.store.advance('item', 'company.QBW', '2016-09-23T12:27:12-07:00')
+        # earlier in utc although later on the clock
+        self.store.advance('item', 'company.QBW', '2016-09-23T13:27:12-05:00')
+        self.store.advance('item', 'company.QBW', None)
+        self.assertEquals(self.store.get('item', 'company.QBW'), '2016-09-23T12:27:12-07:00')
+        self.store.advance('item', 'company.QBW', '2016-09-24T08:00:00-07:00')
+        self.assertEquals(self.store.get('item', 'company.QBW'), '2016-09-24T08:00:00-07:00')
+        # watermarks are kept per query type and company file
+        self.assertEquals(self.store.get('check', 'company.QBW'), None)
+        self.assertEquals(self.store.get('item', 'other.QBW'), None)
+        reopened = WatermarkStore(self.store.path)
+        self.assertEquals(reopened.get('item', 'company.QBW'), '2016-09-24T08:00:00-07:00')
+
+    def test_incremental_query_params(self):
+        overlap = datetime.timedelta(minutes=10)
+        self.assertEquals(modified_since('2016-09-23T12:07:12-07:00', overlap), '2016-09-23T11:57:12-07:00')
+
+        params = incremental_query_params({'days': 30, 'include_line_items': True}, '2016-09-23T12:07:12-07:00', overlap)
+        self.assertEquals(params['start_date'], '2016-09-23T11:57:12-07:00')
+        self.assertEquals(params['days'], None)
+        self.assertEquals(params['include_line_items'], True)
+
+        # nothing synced yet or a lookup of specific entities
+        self.assertEquals(incremental_query_params({'initial': True}, None), {'initial': True})
+        lookup = {'list_ids': ['80003A41-1474655232']}
+        self.assertEquals(incremental_query_params(lookup, '2016-09-23T12:07:12-07:00'), lookup)
+
+    def test_fingerprints(self):
+        index = FingerprintIndex(self.store.path)
+        items = [
+            {'ListID': '1', 'EditSequence': '100', 'Name': 'one'},
+            {'ListID': '2', 'EditSequence': '200', 'Name': 'two'},
+            {'ListID': '3', 'Name': 'three'},
+        ]
+        delta = index.delta('item', 'company.QBW')
+        self.assertEquals(delta.changed(items), items)
+        # nothing is stored until the entities were sent on
+        self.assertEquals(index.delta('item', 'company.QBW').changed(items), items)
+        delta.commit()
+
+        changed = [
+            {'ListID': '1', 'EditSequence': '101', 'Name': 'one'},
+            {'ListID': '3', 'Name': 'three'},
+            {'ListID': '4', 'EditSequence': '400', 'Name': 'four'},
+        ]
+        delta = index.delta('item', 'company.QBW')
+        self.assertEquals([i['ListID'] for i in delta.changed(changed)], ['1', '4'])
+        self.assertEquals(delta.suppressed, 1)
+        self.assertEquals(delta.removed(), ['2'])
+        delta.commit(delta.removed())
+        self.assertEquals(sorted(index.load('item', 'company.QBW')), ['1', '3', '4'])
+
+        # content hashes change with the entity
+        delta = index.delta('item', 'company.QBW')
+        self.assertEquals(delta.changed([{'ListID': '3', 'Name': 'renamed'}]), [{'ListID': '3', 'Name': 'renamed'}])
+        self.assertEquals(index.load('check', 'company.QBW'), {})
+
+    def test_lazy_tracking(self):
+        read = list()
+
+        def entities():
+            for list_id in ('1', '2'):
+                read.append(list_id)
+                yield {'ListID': list_id, 'EditSequence': '1', 'TimeModified': '2016-09-0{}T12:00:00'.format(list_id)}
+
+        tracker = WatermarkTracker()
+        delta = FingerprintIndex(self.store.path).delta('item', 'company.QBW')
+        forwarded = delta.iter_changed(tracker.track(entities()))
+        self.assertEquals(next(forwarded)['ListID'], '1')
+        # the second entity isn't read before the first is handed on
+        self.assertEquals((read, tracker.latest), (['1'], '2016-09-01T12:00:00'))
+        self.assertEquals([i['ListID'] for i in forwarded], ['2'])
+        self.assertEquals((delta.forwarded, tracker.latest), (2, '2016-09-02T12:00:00'))
+
+    def test_incremental_query(self):
+        qb = QuickBooks(company_file_name='simulated.QBW', backend='simulator')
+        qb.begin_session()
+        try:
+            tracker = WatermarkTracker()
+            items = list(tracker.track(qb.quickbooks_query('item', {'initial': True})))
+            self.assertEquals(len(items), 421)
+            watermark = self.store.advance('item', 'simulated.QBW', tracker.latest)
+            self.assertEquals(watermark, max(items, key=lambda i: parse_time_modified(i['TimeModified']))['TimeModified'])
+
+            params = incremental_query_params({}, watermark, datetime.timedelta(0))
+            changed = list(qb.quickbooks_query('item', params))
+            self.assertTrue(0 < len(changed) < len(items))
+            self.assertTrue(all(i['TimeModified'] >= watermark for i in changed))
+        finally:
+            qb.end_session()
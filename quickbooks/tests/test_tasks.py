@@ -0,0 +1,95 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import tasks
+
+from ..processors import SimulatorBackend
+from ..qbcom import QuickBooks
+from ..session import SessionManager
+from ..simulator import RequestProcessorSimulator
+from ..sync_state import FingerprintIndex
+
+
+class LostIterators(RequestProcessorSimulator):
+    'answers every request continuing an iterator with an error'
+    def ProcessRequest(self, ticket, request):
+        if 'iterator="Continue"' in request:
+            self.iterators.clear()
+        return super(LostIterators, self).ProcessRequest(ticket, request)
+
+
+class RecordingSimulator(RequestProcessorSimulator):
+    'keeps the request types of every request in the order they were processed'
+    processed = list()
+
+    def ProcessRequest(self, ticket, request):
+        self.processed.append(re.findall(r'<(?!QBXMLMsgsRq)(\w+Rq)[ >]', request))
+        return super(RecordingSimulator, self).ProcessRequest(ticket, request)
+
+
+class TestTasks(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sent = list()
+        self.threads = set()
+        self.backend = SimulatorBackend()
+        self.patched = dict((name, getattr(tasks, name)) for name in ('SESSIONS', 'FINGERPRINTS', 'send_quickbooks_task'))
+        tasks.SESSIONS = SessionManager(
+            lambda: QuickBooks(company_file_name='simulated.QBW', backend=self.backend)
+        )
+        tasks.FINGERPRINTS = FingerprintIndex(os.path.join(self.directory, 'state.sqlite3'))
+        tasks.send_quickbooks_task = self.send_quickbooks_task
+
+    def tearDown(self):
+        tasks.SESSIONS.close()
+        for name, value in self.patched.items():
+            setattr(tasks, name, value)
+        shutil.rmtree(self.directory)
+
+    def send_quickbooks_task(self, task_name, args, kwargs=None):
+        self.sent.append((task_name, args))
+        self.threads.add(threading.current_thread().name)
+
+    def test_responses_are_sent_on_the_task_thread(self):
+        tasks.qb_requests([
+            (1, 'item', ('ItemQueryRq', [('ListID', ['80003A41-1474655232'])])),
+            (2, 'po', ('PurchaseOrderQueryRq', [('MaxReturned', '1')])),
+            (3, 'check', ('CheckQueryRq', [('MaxReturned', '1')])),
+        ])
+        self.assertEquals([args[0] for task_name, args in self.sent if task_name == 'process_response'], [1, 2, 3])
+        self.assertEquals(self.threads, set([threading.current_thread().name]))
+
+    def test_merged_queries_are_completed_before_a_mod(self):
+        request_list = [
+            (1, 'item', ('ItemQueryRq', [('ListID', ['80003A41-1474655232'])])),
+            (2, 'item', ('ItemQueryRq', [('ListID', ['missing'])])),
+            (3, 'item', ('ItemServiceModRq', [('ItemServiceMod', (('ListID', '80003A41-1474655232'), ('Name', 'x')))])),
+            (4, 'item', ('ItemQueryRq', [('ListID', ['80003A41-1474655232'])])),
+        ]
+        self.backend.simulator_class = RecordingSimulator
+        for batch_size in (None, 10):
+            RecordingSimulator.processed = list()
+            del self.sent[:]
+            tasks.qb_requests(request_list, batch_size=batch_size)
+            # the missing id is sent again on its own before the mod
+            self.assertEquals(RecordingSimulator.processed[:3], [
+                ['ItemQueryRq'], ['ItemQueryRq'], ['ItemServiceModRq', 'ItemQueryRq'] if batch_size else ['ItemServiceModRq'],
+            ])
+            self.assertEquals([args[0] for task_name, args in self.sent if task_name == 'process_response'], [1, 2, 3, 4])
+
+    def test_no_removals_after_an_error_page(self):
+        counts = tasks.quickbooks_query('item', {'initial': True}, page_size=100, changes_only=True)
+        self.assertEquals((counts['sent'], counts['removed']), (421, 0))
+
+        self.backend.simulator_class = LostIterators
+        tasks.SESSIONS.close()
+        del self.sent[:]
+        counts = tasks.quickbooks_query('item', {'initial': True}, page_size=100, changes_only=True)
+        # the first page was unchanged, the pages after it were never received
+        self.assertEquals(counts, {'sent': 0, 'suppressed': 100, 'removed': 0})
+        self.assertNotIn('process_removed_quickbooks_entities', [task_name for task_name, _ in self.sent])
+        self.assertEquals(len(tasks.FINGERPRINTS.load('item', tasks.QB_LOOKUP['company_file_name'])), 421)
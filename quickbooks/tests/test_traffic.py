@@ -0,0 +1,82 @@
+from collections import OrderedDict
+import datetime
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ..traffic import Replay, TrafficCapture, Timing, percentile, read_capture, report
+
+
+class TestTraffic(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'traffic.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_capture(self):
+        now = [1000.0]
+        capture = TrafficCapture(self.path, clock=lambda: now[0])
+        request = ('ItemReceiptAddRq', [('ItemReceiptAdd', (('RefNumber', '1'), ('Amount', Decimal('1.50'))))])
+        self.assertTrue(capture.record('qb_desktop.tasks.qb_requests', [[(12, 'receipt', request)]], {'batch_size': 50}))
+        now[0] += 2.5
+        self.assertTrue(capture.record(
+            'qb_desktop.tasks.quickbooks_query', ('item', {'start_date': datetime.date(2016, 9, 1)}), None
+        ))
+        self.assertFalse(capture.record('qb_desktop.tasks.release_idle_session', (), {}))
+        capture.close()
+
+        records = read_capture(self.path)
+        self.assertEquals([record['time'] for record in records], [1000.0, 1002.5])
+        self.assertEquals(records[0]['args'], [[(12, 'receipt', request)]])
+        self.assertEquals(records[0]['kwargs'], {'batch_size': 50})
+        self.assertEquals(records[1]['args'], ['item', {'start_date': datetime.date(2016, 9, 1)}])
+
+    def test_ordered_request(self):
+        keys = ['RefNumber', 'VendorRef', 'TxnDate', 'Memo', 'ItemLineAdd', 'ExpenseLineAdd']
+        request = ('PurchaseOrderAddRq', OrderedDict([('PurchaseOrderAdd', OrderedDict((key, '1') for key in keys))]))
+        capture = TrafficCapture(self.path)
+        capture.record('qb_desktop.tasks.qb_requests', [[(12, 'po', request)]], {})
+        capture.close()
+
+        replayed = read_capture(self.path)[0]['args'][0][0][2]
+        self.assertEquals(replayed, request)
+        self.assertTrue(isinstance(replayed[1]['PurchaseOrderAdd'], OrderedDict))
+        self.assertEquals(list(replayed[1]['PurchaseOrderAdd']), keys)
+
+    def test_eager_replay(self):
+        records = [
+            {'time': 10.0, 'task': 'qb_desktop.tasks.qb_requests'},
+            {'time': 10.0, 'task': 'qb_desktop.tasks.qb_requests'},
+            {'time': 11.0, 'task': 'qb_desktop.tasks.quickbooks_query'},
+        ]
+        replay = Replay(records, speed=10)
+        self.assertEquals([offset for offset, _ in replay.schedule()], [0.0, 0.0, 0.1])
+
+        def run(record):
+            time.sleep(0.02)
+            return record['task'].endswith('quickbooks_query')
+
+        timings = replay.run_eager(run)
+        self.assertEquals([timing.task for timing in timings], [record['task'] for record in records])
+        # the second task waits for the first
+        self.assertTrue(timings[1].started - timings[1].scheduled >= 0.015)
+        self.assertTrue(replay.elapsed >= 0.1)
+
+        results = report(timings, replay.elapsed)
+        self.assertEquals(list(results), ['qb_desktop.tasks.qb_requests', 'qb_desktop.tasks.quickbooks_query'])
+        self.assertEquals((results['qb_desktop.tasks.qb_requests']['count'], results['qb_desktop.tasks.qb_requests']['failed']), (2, 0))
+        self.assertEquals(results['qb_desktop.tasks.quickbooks_query']['failed'], 1)
+
+    def test_report(self):
+        self.assertEquals(percentile([], 50), None)
+        self.assertEquals([percentile(list(range(1, 101)), percent) for percent in (50, 90, 99)], [50, 90, 99])
+        timings = [Timing('query', 0.0, 1.0, 3.0, False), Timing('query', 1.0, None, None, True)]
+        results = report(timings, 4.0)
+        self.assertEquals(results['query']['throughput'], 0.25)
+        self.assertEquals(results['query']['latency'][50], 3.0)
+        self.assertEquals(results['query']['wait'][99], 1.0)
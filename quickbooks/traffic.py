@@ -0,0 +1,338 @@
+# coding=utf-8
+"""
+Capture the tasks a worker runs and replay them as load
+
+TrafficCapture appends every qb_requests, quickbooks_query and pretty_print task
+the worker starts to a JSON lines file: when it started, the task name, args and
+kwargs.  Tuples, OrderedDicts, dates, datetimes and Decimals are tagged so they are
+replayed as they were received, a list in a request dictionary means repeated
+elements where a tuple means nested ones and an OrderedDict keeps its element
+order.  Times are when the worker started the task, tasks that queued up while it
+was busy are captured as they were run.
+
+Replay runs the captured tasks again on the original schedule, sped up or slowed
+down by speed (0 sends everything at once):
+
+  * eager runs the tasks in this process one at a time on the calling thread like
+    a worker with --pool=solo, the hand offs to the quickbooks queue are dropped
+    unless handoff is set
+  * broker sends them to a worker through the broker and polls their results,
+    which needs the result backend.  The tasks track when they started
+
+and reports throughput, latency (scheduled to finished) and queue wait (scheduled
+to started) percentiles per task:
+
+    python -m quickbooks.traffic replay traffic.jsonl --speed 2
+    python -m quickbooks.traffic replay traffic.jsonl --mode broker --speed 0
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+from collections import OrderedDict, namedtuple
+import datetime
+from decimal import Decimal
+import json
+import logging
+import math
+import threading
+import time
+
+from six.moves import queue
+
+
+logger = logging.getLogger(__name__)
+
+CAPTURED_TASKS = (
+    'qb_desktop.tasks.qb_requests',
+    'qb_desktop.tasks.quickbooks_query',
+    'qb_desktop.tasks.pretty_print',
+)
+
+PERCENTILES = (50, 90, 99)
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# scheduled, started and finished are seconds since the replay started
+Timing = namedtuple('Timing', ['task', 'scheduled', 'started', 'finished', 'failed'])
+
+DONE = object()
+
+
+def encode(value):
+    'value with tuples, OrderedDicts, dates, datetimes and Decimals tagged for json'
+    if isinstance(value, tuple):
+        return {'__tuple__': [encode(item) for item in value]}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    if isinstance(value, OrderedDict):
+        # json objects don't keep their order, the pairs are a list
+        return {'__ordered__': [[key, encode(item)] for key, item in value.items()]}
+    if isinstance(value, dict):
+        return dict((key, encode(item)) for key, item in value.items())
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.strftime(DATETIME_FORMAT)}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    return value
+
+
+def decode_tagged(value):
+    'json object_hook reversing encode'
+    if '__tuple__' in value:
+        return tuple(value['__tuple__'])
+    if '__ordered__' in value:
+        return OrderedDict((key, item) for key, item in value['__ordered__'])
+    if '__datetime__' in value:
+        return datetime.datetime.strptime(value['__datetime__'], DATETIME_FORMAT)
+    if '__date__' in value:
+        return datetime.datetime.strptime(value['__date__'], '%Y-%m-%d').date()
+    if '__decimal__' in value:
+        return Decimal(value['__decimal__'])
+    return value
+
+
+def read_capture(path):
+    'the captured tasks of the file in order'
+    records = list()
+    with open(path, 'rb') as fin:
+        for line in fin:
+            if line.strip():
+                records.append(json.loads(line.decode('utf-8'), object_hook=decode_tagged))
+    return records
+
+
+class TrafficCapture(object):
+    """
+    Appends the tasks of CAPTURED_TASKS to the JSON lines file at path
+
+    Example usage:
+
+        capture = TrafficCapture('traffic.jsonl')
+        capture.record('qb_desktop.tasks.quickbooks_query', ['item', {'days': 1}], {})
+    """
+    def __init__(self, path, tasks=CAPTURED_TASKS, clock=time.time):
+        self.path = path
+        self.tasks = frozenset(tasks)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.file = None
+
+    def record(self, task, args, kwargs):
+        'append the task if it is captured, False if it is not'
+        if task not in self.tasks:
+            return False
+        line = json.dumps({
+            'time': self.clock(),
+            'task': task,
+            'args': encode(list(args or ())),
+            'kwargs': encode(dict(kwargs or {})),
+        })
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+            self.file.write(line.encode('utf-8') + b'\n')
+            self.file.flush()
+        return True
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            self.file = None
+
+
+def percentile(values, percent):
+    'nearest rank percentile of the values, None without values'
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def report(timings, elapsed):
+    'per task: count, failed, throughput per second and latency and queue wait percentiles'
+    tasks = OrderedDict()
+    for timing in timings:
+        tasks.setdefault(timing.task, list()).append(timing)
+    results = OrderedDict()
+    for task, task_timings in tasks.items():
+        finished = [timing for timing in task_timings if timing.finished is not None]
+        latencies = [timing.finished - timing.scheduled for timing in finished]
+        waits = [timing.started - timing.scheduled for timing in task_timings if timing.started is not None]
+        results[task] = OrderedDict([
+            ('count', len(task_timings)),
+            ('failed', sum(1 for timing in task_timings if timing.failed)),
+            ('throughput', float(len(finished)) / elapsed if elapsed else None),
+            ('latency', OrderedDict((percent, percentile(latencies, percent)) for percent in PERCENTILES)),
+            ('wait', OrderedDict((percent, percentile(waits, percent)) for percent in PERCENTILES)),
+        ])
+    return results
+
+
+def format_report(results):
+    def seconds(value):
+        return '{:.3f}'.format(value) if value is not None else '-'
+
+    header = ['task', 'count', 'failed', 'per sec']
+    header += ['latency p{}'.format(percent) for percent in PERCENTILES]
+    header += ['wait p{}'.format(percent) for percent in PERCENTILES]
+    rows = [header]
+    for task, result in results.items():
+        row = [task.rsplit('.', 1)[-1], result['count'], result['failed'], seconds(result['throughput'])]
+        row += [seconds(value) for value in result['latency'].values()]
+        row += [seconds(value) for value in result['wait'].values()]
+        rows.append(row)
+    return '\n'.join(
+        '{:<18}'.format(row[0]) + '  '.join('{:>12}'.format(column) for column in row[1:]) for row in rows
+    )
+
+
+class Replay(object):
+    """
+    Runs captured tasks again at their captured offsets divided by speed, speed=0
+    schedules all of them right away.  run_eager and run_broker return a Timing
+    for every task in the order they were scheduled, elapsed is the replay time.
+
+    Example usage:
+
+        replay = Replay(read_capture('traffic.jsonl'), speed=2)
+        print(format_report(report(replay.run_eager(), replay.elapsed)))
+    """
+    def __init__(self, records, speed=1.0, clock=time.time, sleep=time.sleep):
+        self.records = list(records)
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        self.elapsed = 0.0
+
+    def schedule(self):
+        'the (offset, record) of every task'
+        if not self.records:
+            return []
+        first = self.records[0]['time']
+        return [
+            ((record['time'] - first) / self.speed if self.speed else 0.0, record) for record in self.records
+        ]
+
+    def wait_until(self, start, offset):
+        delay = start + offset - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+    def run_eager(self, run=None):
+        """
+        run(record) every task on the calling thread, True if it failed.  Tasks due
+        while one runs wait in a queue, like they would in the broker.  Runs the
+        tasks of the tasks module by default, see run_task
+        """
+        run = run or run_task
+        due = queue.Queue()
+        start = self.clock()
+
+        def release():
+            for offset, record in self.schedule():
+                self.wait_until(start, offset)
+                due.put((offset, record))
+            due.put(DONE)
+
+        scheduler = threading.Thread(target=release, name='traffic-scheduler')
+        scheduler.daemon = True
+        scheduler.start()
+        timings = list()
+        for offset, record in iter(due.get, DONE):
+            started = self.clock() - start
+            try:
+                failed = bool(run(record))
+            except Exception as e:
+                logger.error('{} failed: {}'.format(record['task'], e))
+                failed = True
+            timings.append(Timing(record['task'], offset, started, self.clock() - start, failed))
+        scheduler.join()
+        self.elapsed = self.clock() - start
+        return timings
+
+    def run_broker(self, app, queue_name='qb_desktop', poll=0.05, timeout=3600):
+        """
+        send every task with app.send_task on schedule and poll the result backend for
+        when it started and finished.  Times are as precise as poll, tasks that did
+        not finish within timeout seconds count as failed
+        """
+        start = self.clock()
+        pending = list(self.schedule())
+        # [offset, record, AsyncResult, started]
+        outstanding = list()
+        timings = list()
+        while pending or outstanding:
+            now = self.clock() - start
+            while pending and pending[0][0] <= now:
+                offset, record = pending.pop(0)
+                result = app.send_task(record['task'], args=record['args'], kwargs=record['kwargs'], queue=queue_name)
+                outstanding.append([offset, record, result, None])
+
+            for entry in list(outstanding):
+                offset, record, result, started = entry
+                now = self.clock() - start
+                state = result.state
+                if started is None and state != 'PENDING':
+                    started = entry[3] = now
+                if state in ('SUCCESS', 'FAILURE', 'REVOKED') or now - offset > timeout:
+                    outstanding.remove(entry)
+                    timings.append(Timing(record['task'], offset, started, now, state != 'SUCCESS'))
+
+            next_send = pending[0][0] - (self.clock() - start) if pending else poll
+            self.sleep(max(min(poll, next_send), 0))
+        self.elapsed = self.clock() - start
+        return sorted(timings, key=lambda timing: timing.scheduled)
+
+
+def run_task(record, handoff=False):
+    """
+    apply the task of the record from the tasks module, True if it failed.  Unless
+    handoff is set nothing is sent on to the quickbooks queue.  Replayed tasks are
+    not captured again
+    """
+    import tasks
+
+    send, capture = tasks.send_quickbooks_task, tasks.CAPTURE
+    if not handoff:
+        tasks.send_quickbooks_task = lambda *args, **kwargs: None
+    tasks.CAPTURE = None
+    try:
+        task = tasks.celery_app.tasks[record['task']]
+        return task.apply(args=record['args'], kwargs=record['kwargs']).failed()
+    finally:
+        tasks.send_quickbooks_task, tasks.CAPTURE = send, capture
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay captured qb_desktop tasks')
+    commands = parser.add_subparsers(dest='command')
+    replay = commands.add_parser('replay', help='run the captured tasks again and report their timings')
+    replay.add_argument('path')
+    replay.add_argument('--speed', type=float, default=1.0, help='timing divided by speed, 0 runs everything at once')
+    replay.add_argument('--mode', choices=['eager', 'broker'], default='eager')
+    replay.add_argument('--handoff', action='store_true', help='send the eager hand offs to the quickbooks queue')
+    replay.add_argument('--task', action='append', help='only replay these tasks e.g. qb_desktop.tasks.qb_requests')
+    args = parser.parse_args(argv)
+
+    if args.command != 'replay':
+        parser.print_help()
+        return 2
+
+    records = [record for record in read_capture(args.path) if not args.task or record['task'] in args.task]
+    replay = Replay(records, speed=args.speed)
+    if args.mode == 'broker':
+        from config import celery_app
+        timings = replay.run_broker(celery_app)
+    else:
+        timings = replay.run_eager(lambda record: run_task(record, handoff=args.handoff))
+    print('{} tasks in {:.1f}s'.format(len(timings), replay.elapsed))
+    print(format_report(report(timings, replay.elapsed)))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
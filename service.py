@@ -10,6 +10,11 @@ import win32serviceutil
 # This is my base path
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
 
+WORKER_COMMAND = "celery worker -A tasks -Q qb_desktop --loglevel=info --pool=solo"
+# celery refuses worker -B on windows, beat runs next to the worker and sends it
+# release_idle_session every minute
+BEAT_COMMAND = "celery beat -A tasks --loglevel=info"
+
 
 class QBService(win32serviceutil.ServiceFramework):
     _base_path = BASE_PATH
@@ -20,13 +25,14 @@ class QBService(win32serviceutil.ServiceFramework):
     def __init__(self, args):
         win32serviceutil.ServiceFramework.__init__(self, args)
         self.hWaitStop = win32event.CreateEvent(None, 0, 0, None)
+        self.process = None
+        self.beat = None
 
     def SvcDoRun(self):
-        # start celery worker
+        # start celery beat and worker
         os.chdir(BASE_PATH)
-        self.process = subprocess.Popen(
-            "celery worker -A tasks -Q qb_desktop --loglevel=info --pool=solo"
-        )
+        self.beat = subprocess.Popen(BEAT_COMMAND)
+        self.process = subprocess.Popen(WORKER_COMMAND)
         self.process.communicate()
         win32event.WaitForSingleObject(self.hWaitStop, win32event.INFINITE)
 
@@ -35,6 +41,8 @@ class QBService(win32serviceutil.ServiceFramework):
         # Do the actual stop 
         if self.process:
             self.process.kill()
+        if self.beat:
+            self.beat.kill()
         self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
         win32event.SetEvent(self.hWaitStop)
         self.ReportServiceStatus(win32service.SERVICE_STOPPED)
@@ -10,7 +10,7 @@ setup(
     version=version,
     description="Receive and return quickbooks requests and responses through celery task queue",
     author='SendOutCards',
-    packages=find_packages(exclude=['*.tests']),
+    packages=find_packages(exclude=['*.tests', 'benchmarks']),
     platforms=["any"],
     zip_safe=False,
     install_requires=[
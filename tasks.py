@@ -1,27 +1,249 @@
 from __future__ import absolute_import
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import datetime
+from itertools import chain
 import json
+import uuid
 
-from config import celery_app, QB_LOOKUP
+from config import celery_app, QB_ARCHIVE, QB_CACHE, QB_LOOKUP, QB_METRICS, QB_MIRROR, QB_PARSE, QB_PIPELINE, QB_SERIALIZATION, QB_SESSION, QB_SYNC, QB_TRAFFIC
 import constants
+from celery import signals
 from celery.utils.log import get_task_logger
 
+from quickbooks import columnar, metrics
+from quickbooks.archive import Archive
+from quickbooks.cache import QueryCache
+from quickbooks.coalescing import Coalescer, is_query
 from quickbooks.exceptions import QuickBooksError
 from quickbooks.qbxml_request_formatter import CheckQueryRequest
-from quickbooks.qbcom import QuickBooks
+from quickbooks.handoff import chunk_entities
+from quickbooks.mirror import EntityMirror
+from quickbooks.parse_pool import ParsePool
+from quickbooks.pipeline import Pipeline
+from quickbooks.qbcom import QuickBooks, pack_batches, preload_query_templates
+from quickbooks.records import to_dict
+from quickbooks.session import SessionManager
+from quickbooks.sync_state import (
+    FingerprintIndex,
+    WatermarkStore,
+    WatermarkTracker,
+    incremental_query_params,
+    is_lookup,
+)
+from quickbooks.traffic import TrafficCapture
 
 
 logger = get_task_logger(__name__)
 
+# lookups by id or name are answered locally when the mirror_db setting is set
+MIRROR = EntityMirror(QB_MIRROR['path'], QB_MIRROR['max_age']) if QB_MIRROR['path'] else None
+
+# repeated queries are answered from memory when query_cache_ttls is set
+CACHE = QueryCache(**QB_CACHE) if QB_CACHE['ttls'] else None
+
+# every exchange with QuickBooks when archive_dir is set
+ARCHIVE = Archive(**QB_ARCHIVE) if QB_ARCHIVE['directory'] else None
+
+# parses large responses in other processes while the session sends the next request
+PARSER = ParsePool(**QB_PARSE)
+
+# timings and counts of every QuickBooks session of this worker
+METRICS = metrics.describe(metrics.Metrics())
+
+# one QuickBooks session shared by the tasks of this worker
+SESSIONS = SessionManager(
+    lambda: QuickBooks(mirror=MIRROR, cache=CACHE, parser=PARSER, metrics=METRICS, archive=ARCHIVE, **QB_LOOKUP), **QB_SESSION
+)
+
+# tasks started by this worker for replays when traffic_capture is set
+CAPTURE = TrafficCapture(QB_TRAFFIC['capture_path']) if QB_TRAFFIC['capture_path'] else None
+
+# latest TimeModified synced per query type for incremental quickbooks_query runs
+WATERMARKS = WatermarkStore(QB_SYNC['state_db'])
+# fingerprints of the entities sent on for quickbooks_query with changes_only
+FINGERPRINTS = FingerprintIndex(QB_SYNC['state_db'])
+
+
+@signals.worker_init.connect
+def on_worker_init(**kwargs):
+    preload_query_templates()
+    if QB_METRICS['port']:
+        metrics.serve(METRICS, QB_METRICS['port'])
+
+
+@signals.task_prerun.connect
+def on_task_prerun(task=None, args=None, kwargs=None, **extra):
+    if CAPTURE is not None:
+        try:
+            CAPTURE.record(task.name, args, kwargs)
+        except Exception as e:
+            logger.error(e)
+
+
+@signals.task_postrun.connect
+def on_task_postrun(**kwargs):
+    if QB_METRICS['textfile']:
+        try:
+            metrics.write_textfile(METRICS, QB_METRICS['textfile'])
+        except (IOError, OSError) as e:
+            logger.error(e)
+
+
+@signals.worker_shutdown.connect
+def on_worker_shutdown(**kwargs):
+    SESSIONS.close()
+    PARSER.close()
+    if ARCHIVE is not None:
+        ARCHIVE.close()
+    if CAPTURE is not None:
+        CAPTURE.close()
+
 
 # doesn't seem to respect the CELERYD_TASK_SOFT_TIME_LIMIT setting
 SOFT_TIME_LIMIT = 3600
 
+# page_size of chunked quickbooks_query runs that don't give one
+CHUNK_PAGE_SIZE = 500
+
+
+def send_quickbooks_task(task_name, args, kwargs=None):
+    'hand off to a task of the quickbooks app e.g. process_response'
+    celery_app.send_task(
+        'quickbooks.tasks.{}'.format(task_name),
+        queue='quickbooks', args=args, kwargs=kwargs, expires=1800,
+        serializer=QB_SERIALIZATION['serializer'],
+    )
+
+
+def send_response(entry, response, app):
+    surrogate_key, model_name, request_body = entry
+    request_type, request_dict = request_body
+    if surrogate_key and request_dict:
+        send_quickbooks_task('process_response', [surrogate_key, model_name, response, app])
+
+
+def send_coalesced_response(qb, coalescer, request_id, response, app):
+    """
+    send on the response to coalescer.requests[request_id] for every entry it answers
+    in order, entries the merged query failed or didn't find all values for are sent
+    to QuickBooks on their own in their place
+    """
+    for entry, entry_response in coalescer.fan_out(request_id, response):
+        try:
+            if entry_response is None:
+                surrogate_key, model_name, (request_type, request_dict) = entry
+                entry_response = qb.call(request_type, request_dictionary=request_dict)
+            send_response(entry, entry_response, app)
+        except Exception as e:
+            logger.error(e)
+
+
+def send_parsed_responses(qb, coalescer, pending, app, wait=True):
+    """
+    send on the responses of the (request_id, Future) in pending in order, without wait
+    only as far as they are parsed already
+    """
+    while pending and (wait or pending[0][1].done()):
+        request_id, future = pending.popleft()
+        try:
+            response = future.result()
+            if response is None:
+                surrogate_key, model_name, (request_type, request_dict) = coalescer.requests[request_id]
+                logger.error('Request Type: {} not processed after an earlier error in its batch'.format(request_type))
+                continue
+            send_coalesced_response(qb, coalescer, request_id, response, app)
+        except Exception as e:
+            logger.error(e)
+
+
+def process_requests(qb, coalescer, app):
+    """
+    send the requests one at a time through a Pipeline: while QuickBooks processes a
+    request on this thread the next one is formatted and the last response parsed by
+    other threads.  Parsed responses are sent on from this thread, celery producers
+    can't be shared across threads.  Entries of merged queries that have to be sent
+    again on their own are sent before the next request that isn't a query.
+    """
+    merged = list()
+
+    def format_request(request_id):
+        surrogate_key, model_name, (request_type, request_dict) = coalescer.requests[request_id]
+        return request_id, request_type, qb.format_request(request_type, request_dict)
+
+    def process_request(formatted):
+        request_id, request_type, request = formatted
+        if merged and not is_query(request_type):
+            # the entries of merged queries mustn't see the changes of this request
+            pipeline.flush()
+            del merged[:]
+        if coalescer.is_merged(request_id):
+            merged.append(request_id)
+        surrogate_key = coalescer.requests[request_id][0]
+        return request_id, request_type, qb.process_request(request_type, request, surrogate_key)
+
+    def parse(processed):
+        request_id, request_type, response = processed
+        return request_id, qb.watch(qb.parser.parse(request_type, response), request_type).result()
+
+    def send(parsed):
+        if parsed is not None:
+            request_id, response = parsed
+            send_coalesced_response(qb, coalescer, request_id, response, app)
+
+    pipeline = Pipeline(
+        [('format', format_request), ('process_request', process_request), ('parse', parse)],
+        inline='process_request', queue_size=QB_PIPELINE['queue_size'],
+        on_error=lambda stage, error: logger.error(error), metrics=qb.metrics,
+    )
+    pipeline.run(range(len(coalescer.requests)), on_result=send)
+    logger.info('qb_requests stage utilization: {}'.format(', '.join(
+        '{} {:.0%}'.format(stage, utilization) for stage, utilization in pipeline.utilization().items()
+    )))
+
+
+def process_request_batches(qb, coalescer, app, batch_size=None, batch_bytes=None, on_error=constants.STOP_ON_ERROR):
+    """
+    send the requests in multi request envelopes and map every response back to its
+    entry by requestID.  on_error applies to each envelope separately.  Responses are
+    parsed while the next envelope is sent.  A request that isn't a query starts a new
+    envelope after merged queries and waits until their entries that have to be sent
+    again on their own were sent.
+    """
+    sections = list()
+    for request_id, entry in enumerate(coalescer.requests):
+        try:
+            surrogate_key, model_name, (request_type, request_dict) = entry
+            sections.append((request_id, qb.format_request_section(request_type, request_dict, request_id)))
+        except Exception as e:
+            logger.error(e)
+
+    segments = [list()]
+    merged = False
+    for request_id, section in sections:
+        surrogate_key, model_name, (request_type, request_dict) = coalescer.requests[request_id]
+        if merged and not is_query(request_type):
+            segments.append(list())
+            merged = False
+        segments[-1].append((request_id, section))
+        merged = merged or coalescer.is_merged(request_id)
+
+    pending = deque()
+    for segment in segments:
+        send_parsed_responses(qb, coalescer, pending, app)
+        for batch in pack_batches(segment, batch_size, batch_bytes):
+            try:
+                futures = qb.call_batch_async(batch, on_error=on_error)
+            except Exception as e:
+                logger.error(e)
+                continue
+            pending.extend((request_id, future) for (request_id, _), future in zip(batch, futures))
+            send_parsed_responses(qb, coalescer, pending, app, wait=False)
+    send_parsed_responses(qb, coalescer, pending, app)
+
 
 @celery_app.task(name='qb_desktop.tasks.qb_requests', track_started=True, max_retries=5, soft_time_limit=SOFT_TIME_LIMIT)
-def qb_requests(request_list=None, app='quickbooks'):
+def qb_requests(request_list=None, app='quickbooks', batch_size=None, batch_bytes=None, on_error=constants.STOP_ON_ERROR, coalesce=True):
     """
     Always send a list of requests so we aren't opening and closing file more than necessary
     ex: 
@@ -29,60 +251,145 @@ def qb_requests(request_list=None, app='quickbooks'):
         (item_key, model_name, ('ItemReceiptAddRq', receipt_instance.quickbooks_request_tuple)),
         (item_key, model_name, ('ItemReceiptAddRq', receipt_instance.quickbooks_request_tuple))
     ])
-    """
-    try:
-        qb = QuickBooks(**QB_LOOKUP)
-        qb.begin_session()
 
+    with a batch_size and/or batch_bytes many requests are sent in a single envelope,
+    on_error (stopOnError or continueOnError) applies to each envelope
+
+    with coalesce consecutive queries for a single ListID, TxnID, RefNumber or FullName
+    are merged into one query and identical queries are only sent once, every entry
+    still gets its own process_response task.  See quickbooks.coalescing
+    """
+    with SESSIONS.session() as qb:
+        coalescer = Coalescer(request_list or list(), coalesce=coalesce)
+        if coalescer.merged:
+            logger.info('{} requests coalesced into {}'.format(len(request_list), len(coalescer.requests)))
         # process request list if it exists or just get open purchase orders
-        if request_list:
-            for entry in request_list:
-                try:
-                    surrogate_key, model_name, request_body = entry
-                    request_type, request_dict = request_body
-                    response = qb.call(request_type, request_dictionary=request_dict)
-                    if surrogate_key and request_dict:
-                        celery_app.send_task(
-                            'quickbooks.tasks.process_response',
-                            queue='quickbooks',
-                            args=[surrogate_key, model_name, response, app], expires=1800
-                        )
-                except Exception as e:
-                    logger.error(e)
-
-        celery_app.send_task(
-            'quickbooks.tasks.process_preferences',
-            queue='quickbooks',
-            args=[qb.get_preferences()], expires=1800
-        )
-    finally:
-        # making sure to end session and close file
-        del(qb)
+        if request_list and (batch_size or batch_bytes):
+            process_request_batches(qb, coalescer, app, batch_size, batch_bytes, on_error)
+        elif request_list:
+            process_requests(qb, coalescer, app)
+
+        send_quickbooks_task('process_preferences', [qb.get_preferences()])
 
 
 @celery_app.task(name='qb_desktop.tasks.quickbooks_query', track_started=True, max_retries=5, soft_time_limit=SOFT_TIME_LIMIT)
-def quickbooks_query(query_type, query_params):
+def quickbooks_query(query_type, query_params, page_size=None, incremental=False, changes_only=False, chunk_size=None, chunk_bytes=None):
     """
     args are query type string and any query_params which should be a dict
     query types include 
     purchase_order, item, check
+
+    with a page_size results are fetched with a qbxml iterator and every page is sent
+    on as soon as it is received
+
+    with a chunk_size and/or chunk_bytes results are sent on in chunks of at most
+    chunk_size entities and about chunk_bytes of serialized entities as soon as they
+    are parsed instead of one message per page, pages of CHUNK_PAGE_SIZE entities
+    unless a page_size is given.  Chunks carry the kwargs stream_id,
+    sequence (from 0) and last so the consumer can tell when it has all of them.
+
+    incremental queries only fetch entities modified since the latest TimeModified of
+    the previous incremental run (less the sync_overlap_minutes setting) instead of the
+    date range in query_params.  The watermark only moves forward once every page has
+    been sent on.  Queries for specific ids or names are never incremental.
+
+    with changes_only only entities that are new or changed (by EditSequence) since they
+    were last sent on are forwarded.  Initial queries also send the ids of entities
+    that are no longer returned to quickbooks.tasks.process_removed_quickbooks_entities,
+    unless QuickBooks answered any of their requests with an error.
+    returns counts of the entities sent, suppressed and removed
+    """
+    company_file = QB_LOOKUP['company_file_name']
+    incremental = incremental and not is_lookup(query_params)
+    if incremental:
+        overlap = datetime.timedelta(minutes=QB_SYNC['overlap_minutes'])
+        query_params = incremental_query_params(query_params, WATERMARKS.get(query_type, company_file), overlap)
+    # only queries of every entity can tell which ones were removed
+    full_sync = query_params.get('initial') and not is_lookup(query_params)
+    tracker = WatermarkTracker()
+    delta = FINGERPRINTS.delta(query_type, company_file) if changes_only else None
+    counts = {'sent': 0, 'suppressed': 0, 'removed': 0}
+
+    def forwarded(results):
+        'the results to send on, tracked and checked for changes as they are read'
+        results = tracker.track(results)
+        return delta.iter_changed(results) if delta is not None else results
+
+    chunked = chunk_size or chunk_bytes
+    # chunks are sent as entities are parsed, a single page would be read in full first
+    page_size = page_size or (CHUNK_PAGE_SIZE if chunked else None)
+    with SESSIONS.session() as qb:
+        errors = qb.error_responses
+        if page_size:
+            pages = qb.quickbooks_query_pages(query_type, query_params, page_size)
+        else:
+            pages = [qb.quickbooks_query(query_type, query_params)]
+
+        if chunked:
+            stream_id = uuid.uuid4().hex
+            entities = chain.from_iterable(forwarded(results) for results in pages)
+            for sequence, chunk, last in chunk_entities(entities, chunk_size, chunk_bytes):
+                send_quickbooks_task(
+                    'process_quickbooks_entities', [query_type, to_dict(chunk)],
+                    {'stream_id': stream_id, 'sequence': sequence, 'last': last}
+                )
+                counts['sent'] += len(chunk)
+        else:
+            for results in pages:
+                results = list(forwarded(results))
+                if delta is not None and not results:
+                    continue
+                send_quickbooks_task('process_quickbooks_entities', [query_type, to_dict(results)])
+                counts['sent'] += len(results)
+                if delta is not None:
+                    delta.commit()
+        # pages stop at an error, the entities not seen may still be there
+        failed = qb.error_responses != errors
+
+    if delta is not None:
+        # chunked runs only store fingerprints once every chunk was sent
+        delta.commit()
+        counts['suppressed'] = delta.suppressed
+        if full_sync and failed:
+            logger.warning('{}: not checking for removed entities after an error response'.format(query_type))
+        removed = delta.removed() if full_sync and not failed else list()
+        if removed:
+            send_quickbooks_task('process_removed_quickbooks_entities', [query_type, removed])
+            delta.commit(removed)
+            counts['removed'] = len(removed)
+        logger.info('{}: sent {sent}, suppressed {suppressed} unchanged, removed {removed}'.format(query_type, **counts))
+
+    if incremental:
+        WATERMARKS.advance(query_type, company_file, tracker.latest)
+    return counts
+
+
+@celery_app.task(name='qb_desktop.tasks.quickbooks_export', track_started=True, max_retries=5, soft_time_limit=SOFT_TIME_LIMIT)
+def quickbooks_export(query_type, query_params, path, file_format='parquet', page_size=None, batch_size=10000):
+    """
+    write the results of a query to a columnar file at path on the worker instead of
+    sending them on, file_format is parquet or arrow (an IPC file that can be
+    memory-mapped).  See quickbooks.columnar for the columns of each query type.
+    returns the number of rows written
+    """
+    with SESSIONS.session() as qb:
+        entities = qb.quickbooks_query(query_type, query_params, page_size=page_size)
+        return columnar.export(path, query_type, entities, file_format, batch_size)
+
+
+@celery_app.task(name='qb_desktop.tasks.release_idle_session', ignore_result=True)
+def release_idle_session():
+    """
+    scheduled with celery beat, ends the shared QuickBooks session once it has been idle
+    for longer than the session_idle_timeout setting so the company file is released
     """
-    try:
-        qb = QuickBooks(**QB_LOOKUP)
-        qb.begin_session()
-        results = qb.quickbooks_query(query_type, query_params)
-        celery_app.send_task(
-            'quickbooks.tasks.process_quickbooks_entities',
-            queue='quickbooks', args=[query_type, list(results)], expires=1800
-        )
-    finally:
-        del(qb)
+    SESSIONS.release_idle()
 
 
 @celery_app.task(name='qb_desktop.tasks.pretty_print', track_started=True, max_retries=5)
 def pretty_print(request_list):
     """
-    send the same list of requests as you would to qb_request without the key or model name.  The requests will be formatted to qbxml and saved to files in the worker directory where they can be tested using the qbxml validator from intuit
+    send the same list of requests as you would to qb_request without the key or model name.  The requests will be formatted to qbxml and saved to files in the worker directory (or to the archive when archive_dir is set) where they can be tested using the qbxml validator from intuit
     ex: 
     pretty_print.delay([
         (item_key, model_name, ('ItemReceiptAddRq', receipt_instance.quickbooks_request_tuple)),
@@ -90,7 +397,7 @@ def pretty_print(request_list):
     ])
 
     """
-    qb = QuickBooks(**QB_LOOKUP)
+    qb = QuickBooks(archive=ARCHIVE, **QB_LOOKUP)
 
     for entry in request_list:
         surrogate_key, model_name, request_body = entry